@@ -1,55 +1,499 @@
-from flask import Flask, request
+import functools
+import hashlib
+import itertools
+import time
+import click
+import compression
+from flask import Flask, Response, json, make_response, request, stream_with_context
 from flask_cors import CORS
 import sqlite3
-from model.database import close_db
+import metrics
+import ratelimit
+import warmup
+from export import EXPORT_FORMATS, GZIP_LEVEL, encode_rows, gzip_chunks
+from json_provider import JSONProvider
+from model.cache import CACHE_MAX_SIZE, CACHE_TTL, categories_cache, products_cache
+from model.changes import CHANGES_PAGE_LIMIT, get_change_feed
+from model.database import close_db, database_path, get_pool, read_only
+from model.migrate import QueryPlanError, check_query_plans, migrate
+from model.snapshot import get_snapshot, get_snapshot_manager
+from model.writer import get_writer
 from model.categories_table import CategoriesTable
+from model.price_history_table import PriceHistoryTable
 from model.products_table import ProductsTable
 
 
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+CATALOG_CACHE_CONTROL = "public, no-cache"
+PRODUCT_FILTERS = ("category_id", "min_price", "max_price", "sort", "fields")
+EXPORT_BATCH_SIZE = 1000
+EXPORT_MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+MAX_BATCH_KEYS = 1000
+CHANGES_MAX_WAIT = 30.0
+CHANGES_HEARTBEAT = 15.0
+CHANGES_STREAM_TIMEOUT = 300.0
+# Set by asgi.py to a threading.Event that is set once the client disconnects.
+DISCONNECTED_KEY = "bakery.disconnected"
+
+
 app = Flask(__name__)
-CORS(app)
+app.json = JSONProvider(app)
+app.config.from_prefixed_env("BAKERY")
+
+if app.config.get("CORS", True):
+    CORS(app)
+
+metrics.init_app(app)
+ratelimit.init_app(app)
+compression.init_app(app)
+
+for cache in (products_cache, categories_cache):
+    cache.configure(
+        app.config.get("CACHE_MAX_SIZE", CACHE_MAX_SIZE),
+        app.config.get("CACHE_TTL", CACHE_TTL),
+    )
+
+
+def conditional(*tables):
+    """Makes a GET handler answer conditional requests from table versions.
+
+    The strong ETag is derived from the change counters of the tables the
+    handler reads and the request path and query, so a matching
+    If-None-Match (or, without one, an If-Modified-Since no older than the
+    last change) is answered with a 304 before the handler reads any row.
+    The versions are read before the rows, so a concurrent write can only
+    make an ETag stale, never wrongly fresh. Compressed representations carry
+    the ETag suffixed with their encoding, and a 304 echoes the one the
+    client sent.
+
+    Last-Modified has a one second resolution, and a second change within
+    the same second keeps it. It is therefore only sent, and
+    If-Modified-Since only honoured, once the second of the last change is
+    over; until then the ETag alone validates.
+
+    Args:
+        tables (class): CategoriesTable and/or ProductsTable, e.g. both for
+            the products of a category, which a deleted category hides
+
+    Returns:
+        function: the decorator
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                versions = [table.get_version() for table in tables]
+            except sqlite3.Error as error:
+                return {"error": str(error)}, 500
+            modified_at = max(modified_at for _, modified_at in versions)
+            settled = modified_at < int(time.time())
+            key = ":".join([*(str(version) for version, _ in versions), request.full_path])
+            etag = hashlib.sha1(key.encode()).hexdigest()[:20]
+            if request.if_none_match:
+                matches = [
+                    variant
+                    for variant in compression.etag_variants(etag)
+                    if request.if_none_match.contains(variant)
+                ]
+                not_modified = bool(matches)
+                if not_modified:
+                    etag = matches[0]
+            else:
+                since = request.if_modified_since
+                not_modified = settled and since is not None and since.timestamp() >= modified_at
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if settled:
+                response.last_modified = modified_at
+            response.headers["Cache-Control"] = app.config.get(
+                "CATALOG_CACHE_CONTROL", CATALOG_CACHE_CONTROL
+            )
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def wants_stream():
+    """Tells whether the client asked for a streamed listing (?stream=1)."""
+    return request.args.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def wants_page():
+    """Tells whether the client asked for a page of a listing (?after=/&limit=)."""
+    return "after" in request.args or "limit" in request.args
+
+
+def parse_page_args():
+    """Reads the keyset pagination arguments from the query string.
+
+    Raises:
+        ValueError: if "after" or "limit" is not a valid integer
+
+    Returns:
+        tuple: (after, limit) where after is the last id of the previous page
+            (0 by default) and limit is clamped to MAX_PAGE_LIMIT
+    """
+    try:
+        after = int(request.args.get("after", 0))
+        limit = int(request.args.get("limit", DEFAULT_PAGE_LIMIT))
+    except ValueError:
+        raise ValueError("after and limit must be integers.")
+    if after < 0 or limit <= 0:
+        raise ValueError("after must be >= 0 and limit must be > 0.")
+    return after, min(limit, MAX_PAGE_LIMIT)
+
+
+def wants_filter():
+    """Tells whether the client filtered, sorted or projected a product listing."""
+    return any(name in request.args for name in PRODUCT_FILTERS)
+
+
+def parse_product_query():
+    """Reads the filter, sort, projection and pagination arguments of a
+    product listing from the query string.
+
+    Raises:
+        ValueError: if a numeric argument is not a number or out of range
+
+    Returns:
+        dict: keyword arguments for ProductsTable.query()
+    """
+    args = request.args
+    query = {}
+    try:
+        if "category_id" in args:
+            query["category_id"] = int(args["category_id"])
+        if "min_price" in args:
+            query["min_price"] = float(args["min_price"])
+        if "max_price" in args:
+            query["max_price"] = float(args["max_price"])
+        # Price filters are only answered in price order.
+        filtered = "min_price" in query or "max_price" in query
+        sort = query["sort"] = args.get("sort", "price" if filtered else "id")
+        limit = int(args.get("limit", DEFAULT_PAGE_LIMIT))
+        if "after" in args:
+            query["after"] = int(args["after"]) if sort.lstrip("-") == "id" else args["after"]
+    except ValueError:
+        raise ValueError("category_id, min_price, max_price, limit and after must be numbers.")
+    if limit <= 0:
+        raise ValueError("limit must be > 0.")
+    query["limit"] = min(limit, MAX_PAGE_LIMIT)
+    if "fields" in args:
+        query["fields"] = [field.strip() for field in args["fields"].split(",")]
+    return query
+
+
+def stream_json_list(key, batches):
+    """Builds a response that streams {key: [row, ...]} one batch at a time.
+
+    Each batch of row tuples is encoded in one call to the JSON provider and
+    then dropped, so the response never holds more than one batch. The first
+    batch is pulled before the response is returned so that a failing query
+    is still reported by the caller as a 500 instead of a broken body.
+
+    Raises:
+        sqlite3.Error: If the first database read fails
+
+    Args:
+        key (str): the name of the list in the JSON document
+        batches (iterator): (columns, rows) batches, typically a table's
+            iter_batches()
+
+    Returns:
+        flask.Response: a streamed application/json response
+    """
+    batches = iter(batches)
+    first = next(batches, None)
+
+    def generate():
+        yield b'{"%s":[' % key.encode()
+        if first is not None:
+            yield app.json.encode_rows(*first)[1:-1]
+            for columns, rows in batches:
+                yield b"," + app.json.encode_rows(columns, rows)[1:-1]
+        yield b"]}\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+def categories_json(snapshot):
+    """Encodes the body of the full GET /category listing, from the catalog
+    snapshot unless it is None."""
+    if snapshot is not None:
+        return snapshot.categories_json
+    return app.json.encode({"categories": CategoriesTable.get()}) + b"\n"
+
+
+def products_json(snapshot):
+    """Encodes the body of the full GET /product listing, from the catalog
+    snapshot unless it is None."""
+    if snapshot is not None:
+        return snapshot.products_json
+    return app.json.encode({"products": ProductsTable.get()}) + b"\n"
 
 
 @app.get("/category")
+@conditional(CategoriesTable)
 def get_categories():
     """
     Retrieves all categories from the bakery.
 
+    Query Parameters:
+        after (integer): return categories with an id greater than this one.
+        limit (integer): maximum number of categories to return.
+        stream (boolean): stream the full list row by row.
+
     Returns:
         categories: The specified category.
+        next: The "after" value of the following page, if paginated.
 
     Response Codes:
         200: Successful Request.
+        400: Invalid pagination parameters.
         500: Database operation failed
 
     """
     try:
-        categories = CategoriesTable.get()
-        return {"categories": categories}, 200
+        if wants_stream():
+            return stream_json_list("categories", CategoriesTable.iter_batches())
+        if wants_page():
+            try:
+                after, limit = parse_page_args()
+            except ValueError as error:
+                return {"error": str(error)}, 400
+            categories, next_after = CategoriesTable.get_page(after, limit)
+            return {"categories": categories, "next": next_after}, 200
+        encoding = compression.negotiate()
+        if encoding is not None:
+            return compression.compressed_listing(
+                "CATEGORIES", "categories", encoding, categories_json
+            )
+        return Response(categories_json(get_snapshot()), mimetype="application/json")
     except sqlite3.Error as error:
         return {"error": str(error)}, 500
 
 
 @app.get("/product")
+@conditional(ProductsTable)
 def get_products():
     """
     Retrieves all products from the bakery.
 
+    Query Parameters:
+        category_id (integer): only products of this category.
+        min_price (number): only products costing at least this much.
+        max_price (number): only products costing at most this much.
+        sort (string): id, price or name; prefix with "-" for descending order.
+            Defaults to price when filtering by price, which needs it; else id.
+        fields (string): comma separated columns to return, e.g. "ProductName,Price".
+        after (integer or string): the "next" value of the previous page.
+        limit (integer): maximum number of products to return.
+        stream (boolean): stream the full list row by row.
+
     Returns:
         products: The specified product.
+        next: The "after" value of the following page, if paginated.
 
     Response Codes:
         200: Successful Request.
+        400: Invalid filter, sort, fields or pagination parameters.
         500: Database operation failed
     """
     try:
-        products = ProductsTable.get()
+        if wants_stream():
+            return stream_json_list("products", ProductsTable.iter_batches())
+        if wants_page() or wants_filter():
+            try:
+                products, next_after = ProductsTable.query(**parse_product_query())
+            except ValueError as error:
+                return {"error": str(error)}, 400
+            return {"products": products, "next": next_after}, 200
+        encoding = compression.negotiate()
+        if encoding is not None:
+            return compression.compressed_listing(
+                "PRODUCTS", "products", encoding, products_json
+            )
+        return Response(products_json(get_snapshot()), mimetype="application/json")
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
+@app.get("/product/search")
+@conditional(ProductsTable)
+def search_products():
+    """
+    Searches products by name or code, best matches first.
+
+    Query Parameters:
+        q (string): the words to look for; each one matches as a prefix.
+        limit (integer): maximum number of products to return.
+        offset (integer): number of best matches to skip.
+
+    Returns:
+        products: The matching products.
+
+    Response Codes:
+        200: Successful Request.
+        400: The search text or the limit/offset is missing or invalid.
+        500: Database operation failed
+
+    """
+    text = request.args.get("q", "").strip()
+    if not text:
+        return {"error": "Search text q is missing."}, 400
+    try:
+        limit = int(request.args.get("limit", 20))
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return {"error": "limit and offset must be integers."}, 400
+    if limit <= 0 or offset < 0:
+        return {"error": "limit must be > 0 and offset must be >= 0."}, 400
+    try:
+        products = ProductsTable.search(text, min(limit, MAX_PAGE_LIMIT), offset)
         return {"products": products}, 200
     except sqlite3.Error as error:
         return {"error": str(error)}, 500
 
 
+def change_stream(feed, after, limit):
+    """Builds the Server-Sent Events response of GET /changes.
+
+    Each CHANGE_LOG entry is sent as a "change" event whose id is its
+    sequence number, so a reconnecting EventSource resumes with
+    Last-Event-ID. A comment is sent every CHANGES_HEARTBEAT seconds without
+    changes, and the stream ends after CHANGES_STREAM_TIMEOUT seconds for the
+    client to reconnect. If changes are compacted away under a slow client,
+    a "reset" event tells it to reload the catalog. The stream reads through
+    the change feed, never through a pooled connection. Served by asgi.py,
+    it also ends soon after the client disconnects.
+
+    Args:
+        feed (ChangeFeed): the change feed
+        after (int): the sequence number to resume from
+        limit (int): the maximum number of entries read at once
+
+    Returns:
+        flask.Response: the text/event-stream response
+    """
+    heartbeat = app.config.get("CHANGES_HEARTBEAT", CHANGES_HEARTBEAT)
+    timeout = app.config.get("CHANGES_STREAM_TIMEOUT", CHANGES_STREAM_TIMEOUT)
+    disconnected = request.environ.get(DISCONNECTED_KEY)
+
+    def generate():
+        yield b"retry: 1000\n\n"
+        position = after
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                if disconnected is not None and disconnected.is_set():
+                    return
+                horizon, changes = feed.read(position, limit)
+                if position < horizon:
+                    yield b"event: reset\ndata: %s\n\n" % app.json.encode({"horizon": horizon})
+                    return
+                for change in changes:
+                    yield b"id: %d\nevent: change\ndata: %s\n\n" % (
+                        change["Seq"],
+                        app.json.encode(change),
+                    )
+                if changes:
+                    position = changes[-1]["Seq"]
+                    if len(changes) == limit:
+                        continue
+                wait = min(heartbeat, deadline - time.monotonic())
+                if wait > 0 and feed.wait(position, wait, disconnected) <= position:
+                    yield b": keep-alive\n\n"
+        except sqlite3.Error:
+            # The client reconnects from its last event id.
+            return
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.get("/changes")
+def get_changes():
+    """
+    Retrieves the changes to products and categories since a sequence number.
+
+    The log keeps the latest change of each row only, so resuming from any
+    sequence number brings a client up to date. To start following, read
+    "next" without "after", then load the catalog, then follow from "next".
+
+    Query Parameters:
+        after (integer): the "next" value of the previous call, or the id of
+            the last event received; the Last-Event-ID header is used if absent.
+            Without either, no change is returned and next is the newest
+            sequence number.
+        limit (integer): maximum number of changes to return.
+        wait (number): if there is no change yet, wait up to this many seconds
+            (at most 30) for one.
+
+    With Accept: text/event-stream, the changes are streamed as Server-Sent
+    Events instead, one "change" event per change, as they happen.
+
+    Returns:
+        changes: The changes, oldest first. Each has a Seq, a TableName
+            ("PRODUCTS" or "CATEGORIES"), a RowID, an Op ("upsert" or "delete"),
+            the Data of the row after an upsert and a ChangedAt Unix time.
+        next: The "after" value of the following call.
+
+    Response Codes:
+        200: Successful Request.
+        400: Invalid after, limit or wait parameters.
+        410: Changes after the given sequence number were compacted away; reload
+            the catalog and follow from the newest sequence number.
+        500: Database operation failed
+
+    """
+    try:
+        after = request.args.get("after", request.headers.get("Last-Event-ID"))
+        after = None if after is None else int(after)
+        limit = int(request.args.get("limit", CHANGES_PAGE_LIMIT))
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        return {"error": "after and limit must be integers and wait a number."}, 400
+    if (after is not None and after < 0) or limit <= 0 or wait < 0:
+        return {"error": "after and wait must be >= 0 and limit must be > 0."}, 400
+    limit = min(limit, MAX_PAGE_LIMIT)
+    stream = "text/event-stream" in request.accept_mimetypes.values()
+    try:
+        feed = get_change_feed()
+        if after is None:
+            after = feed.latest()
+            if not stream:
+                return {"changes": [], "next": after}, 200
+        horizon, changes = feed.read(after, limit)
+        if after < horizon:
+            return {"error": "Changes were compacted; reload the catalog.", "horizon": horizon}, 410
+        if stream:
+            return change_stream(feed, after, limit)
+        if not changes and wait > 0:
+            feed.wait(
+                after,
+                min(wait, app.config.get("CHANGES_MAX_WAIT", CHANGES_MAX_WAIT)),
+                request.environ.get(DISCONNECTED_KEY),
+            )
+            horizon, changes = feed.read(after, limit)
+        next_after = changes[-1]["Seq"] if changes else after
+        return {"changes": changes, "next": next_after}, 200
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
 @app.get("/category/<int:category_id>")
+@conditional(CategoriesTable)
 def get_category(category_id):
     """
     Retrieves a specific category by its ID.
@@ -75,7 +519,95 @@ def get_category(category_id):
         return {"error": str(error)}, 500
 
 
+@app.get("/category/<int:category_id>/products")
+@conditional(CategoriesTable, ProductsTable)
+def get_category_products(category_id):
+    """
+    Retrieves one page of the products of a category.
+
+    Parameters:
+    category_id (integer): category identifier.
+
+    Query Parameters:
+        Same as GET /product, except category_id.
+
+    Returns:
+        products: The products of the category.
+        next: The "after" value of the following page.
+
+    Response Codes:
+        200: Successful Request.
+        400: Invalid filter, sort, fields or pagination parameters.
+        404: The category ID given does not exist/did not fetch anything.
+        500: Database operation failed
+
+    """
+    try:
+        category = CategoriesTable.get_by_id(category_id)
+        if category is None:
+            return {"message": "Category not found."}, 404
+        try:
+            query = parse_product_query()
+            query["category_id"] = category_id
+            products, next_after = ProductsTable.query(**query)
+        except ValueError as error:
+            return {"error": str(error)}, 400
+        return {"products": products, "next": next_after}, 200
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
+@app.get("/category/stats")
+def get_categories_stats():
+    """
+    Retrieves the product count and price aggregates of every category.
+
+    Returns:
+        categories: For each category, its CategoryID, CategoryName, ProductCount,
+            MinPrice, AvgPrice and MaxPrice. Prices are null for a category without
+            products; AvgPrice is rounded to cents.
+
+    Response Codes:
+        200: Successful Request.
+        500: Database operation failed
+
+    """
+    try:
+        categories = CategoriesTable.get_stats()
+        return {"categories": categories}, 200
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
+@app.get("/category/<int:category_id>/stats")
+def get_category_stats(category_id):
+    """
+    Retrieves the product count and price aggregates of a category.
+
+    Parameters:
+    category_id (integer): category identifier.
+
+    Returns:
+        The CategoryID, CategoryName, ProductCount, MinPrice, AvgPrice and MaxPrice
+        of the category.
+
+    Response Codes:
+        200: Successful Request.
+        404: The category ID given does not exist/did not fetch anything.
+        500: Database operation failed
+
+    """
+    try:
+        category = CategoriesTable.get_stats_by_id(category_id)
+        if category is None:
+            return {"message": "Category not found."}, 404
+        return category, 200
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
 @app.get("/product/<int:product_id>")
+@conditional(ProductsTable)
 def get_product(product_id):
     """
     Retrieves a specific category by its ID.
@@ -101,6 +633,126 @@ def get_product(product_id):
         return {"error": str(error)}, 500
 
 
+def parse_time_range():
+    """Reads the "from" and "to" Unix times of a range from the query string.
+
+    Raises:
+        ValueError: if "from" or "to" is not a number
+
+    Returns:
+        tuple: (start, end) in seconds; None for a missing bound
+    """
+    try:
+        start = float(request.args["from"]) if "from" in request.args else None
+        end = float(request.args["to"]) if "to" in request.args else None
+    except ValueError:
+        raise ValueError("from and to must be Unix times in seconds.")
+    if start is not None and end is not None and end <= start:
+        raise ValueError("from must be before to.")
+    return start, end
+
+
+def parse_interval():
+    """Reads the bucket width of a price summary from the query string.
+
+    Raises:
+        ValueError: if "interval" is not an integer or not > 0
+
+    Returns:
+        int: the width in seconds; None if "interval" is missing
+    """
+    if "interval" not in request.args:
+        return None
+    try:
+        interval = int(request.args["interval"])
+    except ValueError:
+        raise ValueError("interval must be an integer.")
+    if interval <= 0:
+        raise ValueError("interval must be > 0.")
+    return interval
+
+
+@app.get("/product/<int:product_id>/prices")
+@conditional(ProductsTable)
+def get_product_prices(product_id):
+    """
+    Retrieves the price changes of a product, oldest first.
+
+    Parameters:
+    product_id (integer): product identifier.
+
+    Query Parameters:
+        from: Unix time in seconds of the start of the range, included.
+        to: Unix time in seconds of the end of the range, excluded.
+        limit: Maximum number of changes (default 100, at most 1000).
+
+    Returns:
+        prices: The changes, each with its ChangedAt time and the new Price.
+        next: The "from" value of the following page; null on the last page.
+
+    Response Codes:
+        200: Successful Request.
+        400: Invalid range or limit.
+        404: The product ID given does not exist/did not fetch anything.
+        500: Database operation failed
+
+    """
+    try:
+        if ProductsTable.get_by_id(product_id) is None:
+            return {"message": "Product not found."}, 404
+        try:
+            start, end = parse_time_range()
+            _, limit = parse_page_args()
+        except ValueError as error:
+            return {"error": str(error)}, 400
+        prices, next_start = PriceHistoryTable.get_range(product_id, start, end, limit)
+        return {"prices": prices, "next": next_start}, 200
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
+@app.get("/product/<int:product_id>/prices/summary")
+@conditional(ProductsTable)
+def get_product_price_summary(product_id):
+    """
+    Retrieves the price of a product downsampled into fixed time buckets.
+
+    Parameters:
+    product_id (integer): product identifier.
+
+    Query Parameters:
+        from: Unix time in seconds of the start of the range (default: the first change).
+        to: Unix time in seconds of the end of the range (default: now).
+        interval: Width of a bucket in seconds (default: at most 100 buckets). Buckets
+            are aligned on multiples of the interval; whole hours are read from an
+            hourly rollup and can span any range, shorter ones at most 1000 buckets.
+
+    Returns:
+        interval: The width of a bucket in seconds.
+        buckets: The buckets with changes, oldest first, each with its Start time and
+            the Open, Low, High and Close prices and the number of Changes.
+
+    Response Codes:
+        200: Successful Request.
+        400: Invalid range or interval.
+        404: The product ID given does not exist/did not fetch anything.
+        500: Database operation failed
+
+    """
+    try:
+        if ProductsTable.get_by_id(product_id) is None:
+            return {"message": "Product not found."}, 404
+        try:
+            start, end = parse_time_range()
+            interval = parse_interval()
+            interval, buckets = PriceHistoryTable.get_summary(product_id, start, end, interval)
+        except ValueError as error:
+            return {"error": str(error)}, 400
+        return {"interval": interval, "buckets": buckets}, 200
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
 @app.post("/category")
 def create_category():
     """
@@ -168,6 +820,180 @@ def create_product():
         return {"error": str(error)}, 500
 
 
+def read_ndjson(stream):
+    """Yields one object per non-blank line of an NDJSON request body.
+
+    Lines that are not valid JSON are yielded as None, so that they are
+    reported as an invalid row instead of failing the whole upload.
+
+    Args:
+        stream (file): the request body
+
+    Yields:
+        the decoded value of each line; None for an undecodable line
+    """
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+@app.post("/product/bulk")
+def create_products():
+    """
+    Creates many products in the bakery in one call.
+
+    Request Body:
+
+        A JSON array of products in the format accepted by POST /product, or,
+        with Content-Type application/x-ndjson, one product per line.
+        Example:
+        [
+            {"category_id": 3, "product_code": "cnrP", "product_name": "Cinnamon Raisin Roll", "price": 1.09},
+            {"category_id": 1, "product_code": "ryeB2", "product_name": "Light Rye Bread", "price": 3.49}
+        ]
+
+    Returns:
+        products: The newly created products, in request order.
+        errors: The index and the error message of every product that was not created.
+
+    Response Codes:
+        200: Successful Request; check errors for rejected products.
+        400: The body is neither a JSON array nor NDJSON.
+        500: Database operation failed
+
+    """
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        products_data = read_ndjson(request.stream)
+    else:
+        products_data = request.get_json(silent=True)
+        if not isinstance(products_data, list):
+            return {"error": "Body must be a JSON array of products."}, 400
+    try:
+        products, errors = ProductsTable.insert_many(products_data)
+        return {"products": products, "errors": errors}, 200
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
+def parse_batch_keys(key_name):
+    """Reads the keys of a batch lookup from the JSON body.
+
+    Raises:
+        ValueError: if the body is not an object of lists of keys, or holds
+            more than MAX_BATCH_KEYS keys
+
+    Args:
+        key_name (str): the name of the list of string keys, besides "ids"
+
+    Returns:
+        tuple: (ids, keys) the list of integer ids and the list of string keys
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ValueError(f"Body must be an object with ids and/or {key_name}.")
+    ids = body.get("ids", [])
+    keys = body.get(key_name, [])
+    if not isinstance(ids, list) or not all(
+        isinstance(key, int) and not isinstance(key, bool) for key in ids
+    ):
+        raise ValueError("ids must be a list of integers.")
+    if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+        raise ValueError(f"{key_name} must be a list of strings.")
+    if len(ids) + len(keys) > MAX_BATCH_KEYS:
+        raise ValueError(f"At most {MAX_BATCH_KEYS} keys may be requested at once.")
+    return ids, keys
+
+
+def batch_response(name, key_name, ids, keys, by_id, by_key):
+    """Builds the response of a batch lookup.
+
+    Returns:
+        dict: the rows of the ids then of the keys, in request order with
+            None for a miss, and the keys that missed
+    """
+    missing = [{"id": key} for key, row in zip(ids, by_id) if row is None]
+    missing += [{key_name: key} for key, row in zip(keys, by_key) if row is None]
+    return {name: by_id + by_key, "missing": missing}
+
+
+@app.post("/product/batch-get")
+@read_only
+def batch_get_products():
+    """
+    Retrieves many products by id and/or product code in one call.
+
+    Request Body:
+
+        The ids and the codes of the products, at most 1000 keys in all.
+        Example:
+        {
+            "ids": [3, 17, 42],
+            "codes": ["cnrP", "ryeB2"]
+        }
+
+    Returns:
+        products: The product of each id, then of each code, in request order;
+            null for a key that matches no product.
+        missing: The keys that match no product, as {"id": ...} or {"code": ...}.
+
+    Response Codes:
+        200: Successful Request; check missing for unknown keys.
+        400: The body is not an object of id and code lists, or has too many keys.
+        500: Database operation failed
+
+    """
+    try:
+        ids, codes = parse_batch_keys("codes")
+    except ValueError as error:
+        return {"error": str(error)}, 400
+    try:
+        by_id, by_code = ProductsTable.get_many(ids, codes)
+        return batch_response("products", "code", ids, codes, by_id, by_code), 200
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
+@app.post("/category/batch-get")
+@read_only
+def batch_get_categories():
+    """
+    Retrieves many categories by id and/or category name in one call.
+
+    Request Body:
+
+        The ids and the names of the categories, at most 1000 keys in all.
+        Example:
+        {
+            "ids": [1, 3],
+            "names": ["Cakes"]
+        }
+
+    Returns:
+        categories: The category of each id, then of each name, in request
+            order; null for a key that matches no category.
+        missing: The keys that match no category, as {"id": ...} or {"name": ...}.
+
+    Response Codes:
+        200: Successful Request; check missing for unknown keys.
+        400: The body is not an object of id and name lists, or has too many keys.
+        500: Database operation failed
+
+    """
+    try:
+        ids, names = parse_batch_keys("names")
+    except ValueError as error:
+        return {"error": str(error)}, 400
+    try:
+        by_id, by_name = CategoriesTable.get_many(ids, names)
+        return batch_response("categories", "name", ids, names, by_id, by_name), 200
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
 @app.delete("/category/<int:category_id>")
 def delete_category(category_id):
     """
@@ -262,6 +1088,274 @@ def update_product(product_id):
         return {"error": str(error)}, 500
 
 
+def export_rows(table, with_category=False):
+    """Returns a lazy iterator over the rows of "products" or "categories"."""
+    if table == "products":
+        return ProductsTable.iter_rows(EXPORT_BATCH_SIZE, with_category)
+    return CategoriesTable.iter_rows(EXPORT_BATCH_SIZE)
+
+
+def export_response(table):
+    """Builds the streamed export response of a table.
+
+    The body is encoded and, if the client accepts it, gzipped chunk by chunk
+    as rows come off the cursor, so memory use does not grow with the table.
+    The first chunk is produced before returning, so a failing query is still
+    reported as a 500.
+
+    Raises:
+        sqlite3.Error: If the first database read fails
+
+    Args:
+        table (str): "products" or "categories"
+
+    Returns:
+        flask.Response: the streamed response; a 400 for an unknown format
+    """
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return {"error": f"Format must be one of {', '.join(EXPORT_FORMATS)}."}, 400
+    with_category = request.args.get("with_category", "").lower() in ("1", "true", "yes")
+    chunks = encode_rows(export_rows(table, with_category), export_format)
+    compress = request.accept_encodings["gzip"] > 0
+    if compress:
+        chunks = gzip_chunks(chunks, app.config.get("EXPORT_GZIP_LEVEL", GZIP_LEVEL))
+    chunks = itertools.chain([next(chunks, b"")], chunks)
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[export_format])
+    response.headers["Content-Disposition"] = f"attachment; filename={table}.{export_format}"
+    response.vary.add("Accept-Encoding")
+    if compress:
+        response.content_encoding = "gzip"
+    return response
+
+
+@app.get("/export/products")
+def export_products():
+    """
+    Streams every product of the bakery for downstream systems.
+
+    Query Parameters:
+        format (string): "ndjson" (default) or "csv".
+        with_category (boolean): add the category name to every product.
+
+    Returns:
+        The products, one per line, gzipped if the client accepts gzip.
+
+    Response Codes:
+        200: Successful Request.
+        400: Unknown format.
+        500: Database operation failed
+
+    """
+    try:
+        return export_response("products")
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
+@app.get("/export/categories")
+def export_categories():
+    """
+    Streams every category of the bakery for downstream systems.
+
+    Query Parameters:
+        format (string): "ndjson" (default) or "csv".
+
+    Returns:
+        The categories, one per line, gzipped if the client accepts gzip.
+
+    Response Codes:
+        200: Successful Request.
+        400: Unknown format.
+        500: Database operation failed
+
+    """
+    try:
+        return export_response("categories")
+    except sqlite3.Error as error:
+        return {"error": str(error)}, 500
+
+
+def collect_stats():
+    """Gathers the metrics of the pools, the caches, the writer, the snapshot, the
+    change feed, the rate limiter, the compression, the ASGI executor and the
+    warm-up.
+
+    Returns:
+        dict: the stats() of each component, keyed by component
+    """
+    stats = {
+        "pool": get_pool().stats(),
+        "read_only_pool": get_pool(readonly=True).stats(),
+        "cache": {
+            "products": products_cache.stats(),
+            "categories": categories_cache.stats(),
+        },
+    }
+    writer = get_writer()
+    if writer is not None:
+        stats["group_commit"] = writer.stats()
+    snapshot_manager = get_snapshot_manager()
+    if snapshot_manager is not None:
+        stats["snapshot"] = snapshot_manager.stats()
+    change_feed = get_change_feed(create=False)
+    if change_feed is not None:
+        stats["changes"] = change_feed.stats()
+    stats["compression"] = compression.compression_metrics.stats()
+    stats["compression"]["listings_cache"] = compression.listings_cache.stats()
+    if "rate_limiter" in app.extensions:
+        stats["rate_limit"] = app.extensions["rate_limiter"].stats()
+    if "asgi_executor" in app.extensions:
+        stats["asgi_executor"] = app.extensions["asgi_executor"].stats()
+        stats["asgi_streams"] = app.extensions["asgi_streams"].stats()
+    if "warm_up" in app.extensions:
+        stats["warm_up"] = app.extensions["warm_up"]
+    return stats
+
+
+@app.get("/stats")
+def get_stats():
+    """
+    Retrieves the runtime metrics of the service.
+
+    Returns:
+        pool: The read-write connection pool size, usage and checkout/wait counters.
+        read_only_pool: The same metrics for the pool serving GET requests.
+        cache: The size and hit/miss/eviction counters of the lookup caches.
+        group_commit: The queue depth and batch counters of the group commit writer, when DATABASE_GROUP_COMMIT is on.
+        snapshot: The size and build counters of the in-memory catalog snapshot, when CATALOG_SNAPSHOT is on.
+        changes: The newest sequence number and the waiting clients of the change feed, once it is used.
+        compression: The responses compressed and the bytes saved per encoding, and the cache of compressed listings.
+        rate_limit: The in-flight requests and the throttled/shed counters of the rate limiter, when RATE_LIMIT is on.
+        asgi_executor: The queue depth and counters of the ASGI thread pool, when served through asgi.py.
+        asgi_streams: The same counters for the ASGI threads serving /changes, when served through asgi.py.
+        warm_up: The connections opened, b-trees preloaded and seconds spent by the startup warm-up, when WARM_UP is on.
+        slow_queries: The latest statements over the slow query threshold, with their query plan.
+
+    Response Codes:
+        200: Successful Request.
+
+    """
+    stats = collect_stats()
+    stats["slow_queries"] = list(metrics.query_metrics.slow_queries)
+    return stats, 200
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Retrieves the runtime metrics of the service in the Prometheus text format.
+
+    Returns:
+        Request and query latency histograms, group commit batch size and
+        latency histograms, slow query counters and gauges for the pools, the
+        caches, the group commit writer, the catalog snapshot, the change
+        feed, the rate limiter, the compression and the ASGI executor.
+
+    Response Codes:
+        200: Successful Request.
+
+    """
+    stats = collect_stats()
+    lines = metrics.request_latency.render()
+    lines += metrics.query_metrics.render()
+    lines += metrics.batch_metrics.render()
+    lines += metrics.render_gauges(
+        "bakery_pool",
+        "Database connection pool metric.",
+        [
+            ((("pool", "read_write"),), stats["pool"]),
+            ((("pool", "read_only"),), stats["read_only_pool"]),
+        ],
+    )
+    lines += metrics.render_gauges(
+        "bakery_cache",
+        "Lookup cache metric.",
+        [((("cache", name),), cache) for name, cache in stats["cache"].items()],
+    )
+    if "group_commit" in stats:
+        lines += metrics.render_gauges(
+            "bakery_group_commit", "Group commit writer metric.", [((), stats["group_commit"])]
+        )
+    if "snapshot" in stats:
+        lines += metrics.render_gauges(
+            "bakery_snapshot", "Catalog snapshot metric.", [((), stats["snapshot"])]
+        )
+    compression_stats = dict(stats["compression"])
+    lines += metrics.render_gauges(
+        "bakery_compression_listings_cache",
+        "Compressed listings cache metric.",
+        [((), compression_stats.pop("listings_cache"))],
+    )
+    lines += metrics.render_gauges(
+        "bakery_compression",
+        "Response compression metric.",
+        [((("encoding", encoding),), counters) for encoding, counters in compression_stats.items()],
+    )
+    if "changes" in stats:
+        lines += metrics.render_gauges(
+            "bakery_changes", "Change feed metric.", [((), stats["changes"])]
+        )
+    if "rate_limit" in stats:
+        lines += metrics.render_gauges(
+            "bakery_rate_limit", "Rate limiter metric.", [((), stats["rate_limit"])]
+        )
+        lines += metrics.render_gauges(
+            "bakery_rate_limit_route",
+            "Requests throttled per route.",
+            [
+                ((("route", route),), {"throttled": count})
+                for route, count in sorted(stats["rate_limit"]["throttled_by_route"].items())
+            ],
+        )
+    if "asgi_executor" in stats:
+        lines += metrics.render_gauges(
+            "bakery_asgi_executor", "ASGI executor metric.", [((), stats["asgi_executor"])]
+        )
+        lines += metrics.render_gauges(
+            "bakery_asgi_streams", "ASGI stream executor metric.", [((), stats["asgi_streams"])]
+        )
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
 @app.teardown_appcontext
 def close_connection(exception):
     close_db()
+
+
+@app.cli.command("migrate")
+@click.option("--to", "target", type=int, help="Version to migrate to.")
+@click.option("--check", is_flag=True, help="Only check the hot query plans.")
+def migrate_command(target, check):
+    """Applies pending schema migrations, then checks the hot query plans."""
+    database = database_path()
+    if not check:
+        for version, name in migrate(database, target):
+            click.echo(f"Applied migration {version:04d}_{name}.")
+    try:
+        check_query_plans(database)
+    except QueryPlanError as error:
+        raise click.ClickException(str(error))
+    click.echo("Hot query plans use indexes.")
+
+
+@app.cli.command("export")
+@click.argument("table", type=click.Choice(["products", "categories"]))
+@click.option("--format", "export_format", type=click.Choice(EXPORT_FORMATS), default="ndjson")
+@click.option("--with-category", is_flag=True, help="Add the category name to products.")
+@click.option("--gzip", "compress", is_flag=True, help="Gzip the output.")
+@click.option("-o", "--output", type=click.File("wb"), default="-", help="Output file.")
+def export_command(table, export_format, with_category, compress, output):
+    """Streams every row of TABLE as NDJSON or CSV."""
+    chunks = encode_rows(export_rows(table, with_category), export_format)
+    if compress:
+        chunks = gzip_chunks(chunks, app.config.get("EXPORT_GZIP_LEVEL", GZIP_LEVEL))
+    for chunk in chunks:
+        output.write(chunk)
+
+
+if app.config.get("DATABASE_MIGRATE_ON_STARTUP", True):
+    with app.app_context():
+        migrate(database_path())
+
+warmup.init_app(app)
@@ -0,0 +1,301 @@
+"""ASGI entry point for the bakery API.
+
+Serves the routes of app.py to an ASGI server, for example:
+
+    uvicorn asgi:application --app-dir app
+
+The event loop only does network I/O. Every Flask handler, and therefore
+every CategoriesTable/ProductsTable call, runs on a bounded thread pool whose
+threads check connections out of the database pools. By default there are
+as many threads as a database pool has connections, and a request checks
+out at most one, so a handler never waits for a connection. Requests
+beyond the thread pool's capacity plus ASGI_MAX_QUEUE wait in a bounded
+queue; past that they are refused with a 503 instead of piling up.
+
+Requests to ASGI_STREAM_PATHS (GET /changes) run on a separate pool of
+ASGI_MAX_STREAMS threads with no queue. A long-poll or an event stream
+holds its thread for up to 30 seconds, or for the whole stream, without
+touching the database pools, so it must neither take a handler thread nor
+count against the admission limit of the other requests. While such a
+request runs, a task watches for the client to disconnect and sets the
+threading.Event in environ[DISCONNECTED_KEY]; the change feed then stops
+waiting, the stream ends and its thread and slot are freed within a poll
+interval instead of after the whole stream.
+"""
+import asyncio
+import contextvars
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import DISCONNECTED_KEY, app
+from model.database import POOL_SIZE
+
+
+ASGI_MAX_QUEUE = 64
+ASGI_MAX_STREAMS = 256
+ASGI_STREAM_PATHS = ("/changes",)
+RETRY_AFTER = 1
+
+
+class BoundedExecutor:
+    """A thread pool that admits a bounded number of requests at a time.
+
+    Attributes:
+        max_workers (int): the number of threads running handlers
+        max_queue (int): the number of admitted requests that may wait for a
+            free thread
+    """
+
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="bakery-asgi")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+        self._active = 0
+        self._max_queued = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def admit(self):
+        """Admits a request if there is room for it.
+
+        Returns:
+            bool: True if the request may proceed; it must then call release()
+        """
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        """Marks an admitted request as finished."""
+        with self._lock:
+            self._in_flight -= 1
+
+    async def run(self, func, *args):
+        """Runs a blocking function on the pool and waits for its result.
+
+        Args:
+            func (callable): the blocking function
+            args: its arguments
+
+        Returns:
+            the return value of func
+        """
+        with self._lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+        def job():
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+
+    def shutdown(self):
+        """Waits for the running jobs and stops the threads."""
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        """Returns the executor metrics.
+
+        Returns:
+            dict: the configured limits, the current in-flight requests, queue
+                depth and active jobs, and the completed/rejected counters
+        """
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "queue_depth": self._queued,
+                "max_queue_depth": self._max_queued,
+                "active": self._active,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+
+def build_environ(scope, body):
+    """Translates an ASGI HTTP scope and its body into a WSGI environ."""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        if name in environ:
+            value = environ[name] + "," + value
+        environ[name] = value
+    return environ
+
+
+async def watch_disconnect(receive, disconnected):
+    """Sets `disconnected` once the client has gone away."""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+    disconnected.set()
+
+
+class ASGIApp:
+    """Adapts the Flask app to ASGI with a BoundedExecutor.
+
+    Each request runs in its own copy of the context variables, so Flask's
+    request context survives when a streamed response is read chunk by chunk
+    on different pool threads. Requests to `stream_paths` run on the
+    `streams` executor instead of the handler one.
+    """
+
+    def __init__(self, wsgi_app, max_workers, max_queue, max_streams, stream_paths):
+        self.wsgi_app = wsgi_app
+        self.executor = BoundedExecutor(max_workers, max_queue)
+        self.streams = BoundedExecutor(max_streams, 0)
+        self.stream_paths = stream_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown()
+                self.streams.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        executor = self.streams if scope["path"] in self.stream_paths else self.executor
+        if not executor.admit():
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"retry-after", str(RETRY_AFTER).encode()),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": b'{"error": "Server is busy."}'})
+            return
+        try:
+            body = b""
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                body += message.get("body", b"")
+                more_body = message.get("more_body", False)
+            await self.respond(executor, build_environ(scope, body), receive, send)
+        finally:
+            executor.release()
+
+    async def respond(self, executor, environ, receive, send):
+        context = contextvars.copy_context()
+        started = {}
+        disconnected = environ[DISCONNECTED_KEY] = threading.Event()
+        # A long-poll blocks in begin(), so watch streaming paths from the
+        # start; other requests only once their response turns out to stream.
+        watcher = None
+        if executor is self.streams:
+            watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ]
+
+        def begin():
+            # Most responses are a single chunk: read up to two so that they
+            # are answered and closed in one trip to the pool.
+            result = self.wsgi_app(environ, start_response)
+            chunks = iter(result)
+            first = next(chunks, None)
+            second = next(chunks, None) if first is not None else None
+            if second is None:
+                close(result)
+            return result, chunks, first, second
+
+        def close(result):
+            if hasattr(result, "close"):
+                result.close()
+
+        try:
+            result, chunks, first, second = await executor.run(context.run, begin)
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": started["status"],
+                    "headers": started["headers"],
+                }
+            )
+            if second is None:
+                await send({"type": "http.response.body", "body": first or b""})
+                return
+            if watcher is None:
+                watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+            try:
+                chunk = first
+                while chunk is not None and not disconnected.is_set():
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                    chunk = second
+                    second = await executor.run(context.run, next, chunks, None)
+                if not disconnected.is_set():
+                    await send({"type": "http.response.body", "body": b""})
+            finally:
+                # A generator cannot be closed while a pool thread runs it, so
+                # this waits for the pending chunk; after a disconnect the
+                # change feed returns it within a poll interval.
+                await executor.run(context.run, close, result)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+application = ASGIApp(
+    app,
+    max_workers=app.config.get("ASGI_MAX_WORKERS", app.config.get("DATABASE_POOL_SIZE", POOL_SIZE)),
+    max_queue=app.config.get("ASGI_MAX_QUEUE", ASGI_MAX_QUEUE),
+    max_streams=app.config.get("ASGI_MAX_STREAMS", ASGI_MAX_STREAMS),
+    stream_paths=app.config.get("ASGI_STREAM_PATHS", ASGI_STREAM_PATHS),
+)
+app.extensions["asgi_executor"] = application.executor
+app.extensions["asgi_streams"] = application.streams
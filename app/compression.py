@@ -0,0 +1,191 @@
+"""Response compression negotiated from Accept-Encoding.
+
+gzip comes from the standard library; brotli is used when the optional
+brotli package is installed and the client prefers it. Bodies smaller than
+COMPRESSION_MIN_SIZE bytes go out as they are: below that, the headers
+outweigh the savings.
+
+Compressed bodies of the full catalog listings are cached by
+compressed_listing(), checked against the version of their table, so
+repeated requests skip both the SQL and the compression.
+"""
+import gzip
+import threading
+import time
+from flask import Response, current_app, request
+
+from model.cache import LRUCache, bypass_caches
+from model.database import TABLE_VERSION_QUERY, read_transaction
+from model.snapshot import get_snapshot
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_CACHE_SIZE = 16
+COMPRESSION_CACHE_TTL = 3600.0
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/csv", "text/plain")
+ENCODINGS = ("br", "gzip")
+
+
+class CompressionMetrics:
+    """Counts the bytes compressed and saved, per encoding."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def observe(self, encoding, size, compressed_size, seconds):
+        with self._lock:
+            counters = self._counters.setdefault(
+                encoding, {"responses": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+            )
+            counters["responses"] += 1
+            counters["bytes_in"] += size
+            counters["bytes_out"] += compressed_size
+            counters["seconds"] += seconds
+
+    def stats(self):
+        """Returns the compression metrics.
+
+        Returns:
+            dict: per encoding, the number of compressed responses, the bytes
+                before and after compression, the bytes saved and the time
+                spent compressing
+        """
+        with self._lock:
+            return {
+                encoding: {
+                    **counters,
+                    "bytes_saved": counters["bytes_in"] - counters["bytes_out"],
+                    "seconds": round(counters["seconds"], 6),
+                }
+                for encoding, counters in self._counters.items()
+            }
+
+
+compression_metrics = CompressionMetrics()
+listings_cache = LRUCache(COMPRESSION_CACHE_SIZE, COMPRESSION_CACHE_TTL)
+
+
+def negotiate():
+    """Picks the encoding of the current response from Accept-Encoding.
+
+    Returns:
+        str: "br" or "gzip"; None if the client accepts neither or
+            COMPRESSION is off
+    """
+    if not current_app.config.get("COMPRESSION", True):
+        return None
+    accepted = request.accept_encodings
+    candidates = [encoding for encoding in ENCODINGS if accepted[encoding] > 0]
+    if brotli is None and "br" in candidates:
+        candidates.remove("br")
+    if not candidates:
+        return None
+    return max(candidates, key=lambda encoding: accepted[encoding])
+
+
+def compress(body, encoding):
+    """Compresses a body with the configured level, counting the savings.
+
+    Args:
+        body (bytes): the uncompressed body
+        encoding (str): "br" or "gzip"
+
+    Returns:
+        bytes: the compressed body
+    """
+    start = time.perf_counter()
+    config = current_app.config
+    if encoding == "br":
+        quality = config.get("COMPRESSION_BROTLI_QUALITY", COMPRESSION_BROTLI_QUALITY)
+        compressed = brotli.compress(body, quality=quality)
+    else:
+        level = config.get("COMPRESSION_LEVEL", COMPRESSION_LEVEL)
+        compressed = gzip.compress(body, level, mtime=0)
+    compression_metrics.observe(encoding, len(body), len(compressed), time.perf_counter() - start)
+    return compressed
+
+
+def compressed_listing(table_name, name, encoding, build):
+    """Builds a full listing response from the cache of compressed listings.
+
+    Cached bodies are checked against the table's change counter. With the
+    catalog snapshot, the counter and the body come from the same snapshot;
+    otherwise the counter and, on a miss, the rows are read in one read
+    transaction, around the lookup caches, so a body is never stored under
+    a version it was not read at.
+
+    Raises:
+        sqlite3.Error: If the database operations fail
+
+    Args:
+        table_name (str): "CATEGORIES" or "PRODUCTS"
+        name (str): the name of the listing, e.g. "products"
+        encoding (str): the negotiated encoding, "br" or "gzip"
+        build (callable): takes the current CatalogSnapshot, or None, and
+            returns the uncompressed JSON body
+
+    Returns:
+        flask.Response: the response, compressed unless the body is smaller
+            than COMPRESSION_MIN_SIZE
+    """
+    min_size = current_app.config.get("COMPRESSION_MIN_SIZE", COMPRESSION_MIN_SIZE)
+    snapshot = get_snapshot()
+
+    def load():
+        if snapshot is not None:
+            body = build(snapshot)
+        else:
+            with bypass_caches():
+                body = build(None)
+        if len(body) < min_size:
+            return body, None
+        return compress(body, encoding), encoding
+
+    if snapshot is not None:
+        version, _ = snapshot.versions[table_name]
+        body, body_encoding = listings_cache.get_or_load((name, encoding), load, version)
+    else:
+        with read_transaction() as db:
+            version = db.execute(TABLE_VERSION_QUERY, [table_name]).fetchone()[0]
+            body, body_encoding = listings_cache.get_or_load((name, encoding), load, version)
+    response = Response(body, mimetype="application/json")
+    response.content_encoding = body_encoding
+    return response
+
+
+def etag_variants(etag):
+    """Lists the ETags of a resource's representations, uncompressed first."""
+    return [etag] + [f"{etag}-{encoding}" for encoding in ENCODINGS]
+
+
+def init_app(app):
+    """Installs the response compression hook on the app.
+
+    Reads COMPRESSION (on by default), COMPRESSION_MIN_SIZE,
+    COMPRESSION_LEVEL (gzip, 1-9) and COMPRESSION_BROTLI_QUALITY (0-11)
+    from the app config.
+    """
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or response.status_code != 200:
+            return response
+        response.vary.add("Accept-Encoding")
+        if response.content_encoding is None and not response.is_streamed:
+            encoding = negotiate()
+            min_size = app.config.get("COMPRESSION_MIN_SIZE", COMPRESSION_MIN_SIZE)
+            if encoding is not None and (response.content_length or 0) >= min_size:
+                response.set_data(compress(response.get_data(), encoding))
+                response.content_encoding = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and response.content_encoding in ENCODINGS:
+            response.set_etag(f"{etag}-{response.content_encoding}", weak)
+        return response
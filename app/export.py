@@ -0,0 +1,98 @@
+import csv
+import io
+import zlib
+from flask import json
+
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_CHUNK_SIZE = 64 * 1024
+GZIP_LEVEL = 6
+
+
+def ndjson_chunks(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """Encodes rows as NDJSON, one JSON object per line.
+
+    Args:
+        rows (iterator): the rows as dictionaries
+        chunk_size (int): lines are buffered up to about this many characters
+
+    Yields:
+        str: chunks of whole lines
+    """
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(row) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield "".join(lines)
+
+
+def csv_chunks(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """Encodes rows as CSV with a header taken from the first row.
+
+    Args:
+        rows (iterator): the rows as dictionaries, all with the same keys
+        chunk_size (int): lines are buffered up to about this many characters
+
+    Yields:
+        str: chunks of whole lines
+    """
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.writer(buffer)
+            writer.writerow(row.keys())
+        writer.writerow(row.values())
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def encode_rows(rows, export_format):
+    """Encodes rows in one of the EXPORT_FORMATS.
+
+    Raises:
+        ValueError: if the format is not supported
+
+    Args:
+        rows (iterator): the rows as dictionaries
+        export_format (str): "ndjson" or "csv"
+
+    Yields:
+        bytes: UTF-8 encoded chunks
+    """
+    if export_format == "ndjson":
+        chunks = ndjson_chunks(rows)
+    elif export_format == "csv":
+        chunks = csv_chunks(rows)
+    else:
+        raise ValueError(f"Format must be one of {', '.join(EXPORT_FORMATS)}.")
+    return (chunk.encode() for chunk in chunks)
+
+
+def gzip_chunks(chunks, level=GZIP_LEVEL):
+    """Compresses a stream of byte chunks into a gzip stream on the fly.
+
+    Args:
+        chunks (iterator): the uncompressed chunks
+        level (int): the zlib compression level
+
+    Yields:
+        bytes: the compressed chunks
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
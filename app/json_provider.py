@@ -0,0 +1,82 @@
+"""A JSON provider that encodes with orjson when it is installed.
+
+orjson is optional: without it, every method falls back to Flask's
+DefaultJSONProvider and the standard library json module. Either way the
+output is the same JSON document, with sorted keys and compact separators.
+"""
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, with orjson doing the encoding when available.
+
+    Values orjson can't encode natively, and dates and dataclasses, which it
+    would encode differently, are handed to the default() of Flask's
+    provider, so responses look the same with or without orjson.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.encode(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj) + b"\n", mimetype=self.mimetype)
+
+    def encode(self, obj):
+        """Encodes an object as compact JSON.
+
+        Args:
+            obj: the object to encode
+
+        Returns:
+            bytes: the UTF-8 encoded JSON document
+        """
+        if orjson is None:
+            return json.dumps(
+                obj,
+                default=self.default,
+                ensure_ascii=self.ensure_ascii,
+                sort_keys=self.sort_keys,
+                separators=(",", ":"),
+            ).encode()
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        option |= orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def encode_rows(self, columns, rows):
+        """Encodes a batch of database rows as a JSON array of objects.
+
+        The rows are plain tuples, as returned by a cursor without a row
+        factory. Each one is still turned into a dictionary for the encoder:
+        that is not cheaper than reading sqlite3.Row objects, and encoding
+        the tuples directly (row templates filled with the encoded values,
+        or slotted dataclasses for orjson) measured slower still. What the
+        batches save is memory: only one batch of dictionaries is alive at a
+        time.
+
+        Args:
+            columns (list): the column names, in the order of the values
+            rows (list): the rows, as tuples of values
+
+        Returns:
+            bytes: the UTF-8 encoded JSON array
+        """
+        return self.encode([dict(zip(columns, row)) for row in rows])
@@ -0,0 +1,234 @@
+import functools
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from flask import g, has_app_context, request
+
+from model.database import set_query_observer
+from model.writer import set_batch_observer
+
+
+METRICS_SAMPLE_RATE = 1.0
+METRICS_SLOW_QUERY_MS = 100.0
+SLOW_QUERY_LOG_SIZE = 50
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class Histogram:
+    """A thread-safe latency histogram with one series per label set."""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        """Records one observation.
+
+        Args:
+            labels (tuple): the label values, in the order of label_names
+            seconds (float): the observed duration
+        """
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[index] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += seconds
+
+    def render(self):
+        """Renders the histogram in the Prometheus text format.
+
+        Returns:
+            list: the lines of the exposition
+        """
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            label_text = format_labels(zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                bucket_labels = format_labels(
+                    list(zip(self.label_names, labels)) + [("le", str(bound))]
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{label_text} {values[-1]}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+def format_labels(labels):
+    """Formats label pairs as {name="value",...}, escaping the values."""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+@functools.lru_cache(maxsize=512)
+def normalize_sql(sql):
+    """Collapses whitespace and IN (?,?,...) lists so that a statement is one label."""
+    sql = " ".join(sql.split())
+    return re.sub(r"\(\?(?:\s*,\s*\?)+\)", "(?, ...)", sql)
+
+
+class QueryMetrics:
+    """The query observer: times statements and keeps a slow query log.
+
+    A request is sampled with probability METRICS_SAMPLE_RATE when it starts;
+    only statements of sampled requests are timed, so turning the rate down
+    makes the instrumentation close to free.
+    """
+
+    def __init__(self, slow_query_ms=METRICS_SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self.latency = Histogram(
+            "bakery_query_duration_seconds",
+            "Time to run a statement up to its first row.",
+            ("statement",),
+        )
+        self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self._slow_counts = {}
+        self._lock = threading.Lock()
+
+    def sampled(self):
+        return has_app_context() and g.get("_metrics_sampled", False)
+
+    def observe(self, db, sql, parameters, seconds):
+        statement = normalize_sql(sql)
+        self.latency.observe((statement,), seconds)
+        if seconds * 1000 < self.slow_query_ms:
+            return
+        try:
+            plan = db.explain(sql, parameters) if parameters is not None else []
+        except sqlite3.Error:
+            plan = []
+        with self._lock:
+            self._slow_counts[statement] = self._slow_counts.get(statement, 0) + 1
+            self.slow_queries.append(
+                {
+                    "statement": statement,
+                    "duration_ms": round(seconds * 1000, 3),
+                    "plan": plan,
+                    "at": time.time(),
+                }
+            )
+
+    def render(self):
+        lines = self.latency.render()
+        lines.append("# HELP bakery_slow_queries_total Statements slower than the slow query threshold.")
+        lines.append("# TYPE bakery_slow_queries_total counter")
+        with self._lock:
+            counts = dict(self._slow_counts)
+        for statement, count in sorted(counts.items()):
+            lines.append(f"bakery_slow_queries_total{format_labels([('statement', statement)])} {count}")
+        return lines
+
+
+class BatchMetrics:
+    """The batch observer: records the size and latency of group commits."""
+
+    def __init__(self):
+        self.size = Histogram(
+            "bakery_group_commit_batch_size",
+            "Mutations committed per group commit transaction.",
+            (),
+            buckets=BATCH_SIZE_BUCKETS,
+        )
+        self.latency = Histogram(
+            "bakery_group_commit_latency_seconds",
+            "Time from queueing a mutation to the commit of its batch.",
+            (),
+        )
+
+    def observe(self, batch_size, latencies):
+        self.size.observe((), batch_size)
+        for seconds in latencies:
+            self.latency.observe((), seconds)
+
+    def render(self):
+        return self.size.render() + self.latency.render()
+
+
+request_latency = Histogram(
+    "bakery_request_duration_seconds",
+    "Time to handle a request, up to the return of the view.",
+    ("method", "route", "status"),
+)
+query_metrics = QueryMetrics()
+batch_metrics = BatchMetrics()
+
+
+def render_gauges(name, help_text, series):
+    """Renders every number of some stats() dictionaries as gauges.
+
+    Args:
+        name (str): the metric name prefix, e.g. "bakery_pool"
+        help_text (str): the HELP text shared by the gauges
+        series (list): (labels, stats) pairs where labels is a tuple of
+            (name, value) label pairs and stats a dict returned by a stats()
+            method
+
+    Returns:
+        list: the lines of the exposition
+    """
+    samples = {}
+    for labels, stats in series:
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            samples.setdefault(key, []).append(f"{name}_{key}{format_labels(labels)} {value}")
+    lines = []
+    for key, key_samples in samples.items():
+        lines.append(f"# HELP {name}_{key} {help_text}")
+        lines.append(f"# TYPE {name}_{key} gauge")
+        lines.extend(key_samples)
+    return lines
+
+
+def init_app(app):
+    """Installs the request hooks and the query observer on the app.
+
+    Reads METRICS_SAMPLE_RATE (0 disables the instrumentation, 1 times every
+    request) and METRICS_SLOW_QUERY_MS from the app config.
+    """
+    sample_rate = app.config.get("METRICS_SAMPLE_RATE", METRICS_SAMPLE_RATE)
+    query_metrics.slow_query_ms = app.config.get("METRICS_SLOW_QUERY_MS", METRICS_SLOW_QUERY_MS)
+    set_query_observer(query_metrics if sample_rate > 0 else None)
+    set_batch_observer(batch_metrics if sample_rate > 0 else None)
+
+    @app.before_request
+    def start_timer():
+        if sample_rate >= 1 or random.random() < sample_rate:
+            g._metrics_sampled = True
+            g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def stop_timer(response):
+        if g.get("_metrics_sampled", False):
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            request_latency.observe(
+                (request.method, route, str(response.status_code)),
+                time.perf_counter() - g._metrics_start,
+            )
+        return response
@@ -0,0 +1,149 @@
+import contextlib
+import threading
+import time
+from collections import OrderedDict
+
+
+CACHE_MAX_SIZE = 1024
+CACHE_TTL = 60.0
+
+_bypass = threading.local()
+
+
+class LRUCache:
+    """A bounded, thread-safe least-recently-used cache with a time to live.
+
+    None is a valid cached value, so lookups of rows that don't exist are
+    cached too. Every invalidation bumps a generation counter; a value loaded
+    while an invalidation happened is returned but not stored, so a reader
+    that raced a write can't put the old row back into the cache.
+
+    invalidate() only reaches the cache of the process that wrote. Entries
+    are therefore stored with the version of their table, read before the
+    value was loaded, and an entry is only returned to a reader that passes
+    the same version: a write from another process bumps the version in
+    TABLE_VERSIONS and turns every older entry into a miss.
+    """
+
+    def __init__(self, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._stale = 0
+        self._invalidations = 0
+
+    def configure(self, max_size, ttl):
+        """Changes the size and time to live, dropping every entry.
+
+        Args:
+            max_size (int): the maximum number of entries; 0 disables the cache
+            ttl (float): the number of seconds an entry stays valid
+        """
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._entries.clear()
+            self._generation += 1
+
+    def get_or_load(self, key, load, version=None):
+        """Gets the value cached under key, loading and caching it on a miss.
+
+        Args:
+            key (hashable): the cache key
+            load (callable): computes the value when it is not cached
+            version: the current version of the data, read before load() could
+                run; an entry stored with another version is a miss
+
+        Returns:
+            the cached or loaded value; within bypass_caches(), always the
+                loaded one
+        """
+        if getattr(_bypass, "active", False):
+            return load()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, entry_version, value = entry
+                if expires_at > now and entry_version == version:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+                if entry_version != version:
+                    self._stale += 1
+                else:
+                    self._expirations += 1
+            self._misses += 1
+            generation = self._generation
+        value = load()
+        with self._lock:
+            if generation == self._generation and self.max_size > 0:
+                self._entries[key] = (time.monotonic() + self.ttl, version, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return value
+
+    def invalidate(self, *keys):
+        """Drops the given keys from the cache.
+
+        Args:
+            keys (hashable): the keys to drop; missing keys are ignored
+        """
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._invalidations += 1
+
+    def clear(self):
+        """Drops every entry from the cache."""
+        with self._lock:
+            self._generation += 1
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the cache metrics.
+
+        Returns:
+            dict: the configured size and ttl, the current number of entries
+                and the hit/miss/eviction/expiration/stale/invalidation
+                counters; stale counts the entries dropped because their
+                table changed in another process
+        """
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "stale": self._stale,
+                "invalidations": self._invalidations,
+            }
+
+
+@contextlib.contextmanager
+def bypass_caches():
+    """Makes every lookup of the current thread load its value, leaving the
+    caches untouched, e.g. to run each query of a table on purpose."""
+    _bypass.active = True
+    try:
+        yield
+    finally:
+        _bypass.active = False
+
+
+products_cache = LRUCache()
+categories_cache = LRUCache()
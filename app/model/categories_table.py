@@ -1,4 +1,28 @@
-from model.database import get_db
+from model.cache import bypass_caches, categories_cache
+from model.changes import notify_change_feeds
+from model.database import (
+    after_commit,
+    forget_table_versions,
+    get_db,
+    get_table_version,
+    select_in,
+    transaction,
+)
+from model.snapshot import CatalogSnapshot, get_snapshot, invalidate_snapshots
+from model.writer import group_commit
+
+
+STATS_QUERY = """
+    SELECT CategoryID, CategoryName, ProductCount, MinPrice, MaxPrice,
+        ROUND(PriceSum / NULLIF(ProductCount, 0), 2) AS AvgPrice
+    FROM CATEGORIES JOIN CATEGORY_STATS USING (CategoryID)
+"""
+STATS_BY_ID_QUERY = f"{STATS_QUERY} WHERE CategoryID = ?"
+PAGE_QUERY = "SELECT * FROM CATEGORIES WHERE CategoryID > ? ORDER BY CategoryID LIMIT ?"
+BY_ID_QUERY = "SELECT * FROM CATEGORIES WHERE CategoryID = ?"
+BY_NAME_QUERY = "SELECT * FROM CATEGORIES WHERE CategoryName = ?"
+MANY_BY_ID_QUERY = "SELECT * FROM CATEGORIES WHERE CategoryID IN ({marks})"
+MANY_BY_NAME_QUERY = "SELECT * FROM CATEGORIES WHERE CategoryName IN ({marks})"
 
 
 class CategoriesTable:
@@ -15,11 +39,125 @@ class CategoriesTable:
                 column names to values. An empty list is returned if the 
                 table has no columns.
         """
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return [category._asdict() for category in snapshot.categories]
+
+        def load():
+            db = get_db()
+            result = db.execute("SELECT * FROM CATEGORIES")
+            result.row_factory = None
+            columns = [column[0] for column in result.description]
+            categories = [dict(zip(columns, category)) for category in result.fetchall()]
+            return categories
+
+        version, _ = CategoriesTable.get_version()
+        return categories_cache.get_or_load(("all",), load, version)
+
+
+    @staticmethod
+    def get_version():
+        """Gets the change counter of the categories table.
+
+        The counter is bumped by a trigger in the same transaction as every
+        insert, update and delete, so it is shared by all worker processes.
+        It is read once per app context, and also checks the cached lookups.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Returns:
+            tuple: (version, modified_at) where version (int) is the change
+                counter and modified_at (int) the Unix time of the last change
+        """
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return snapshot.versions["CATEGORIES"]
+
+        return get_table_version("CATEGORIES")
+
+
+    @staticmethod
+    def get_page(after=0, limit=100):
+        """Gets one page of rows from the categories table, ordered by id.
+
+        Uses keyset pagination: only rows whose id is greater than `after` are
+        read, so the cost of a page does not depend on how deep it is.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            after (int): the last category id of the previous page; 0 for the
+                first page
+            limit (int): the maximum number of rows to return
+
+        Returns:
+            tuple: (categories, next) where
+                categories (list): the rows of the page as dictionaries
+                next (int): the value of `after` for the following page; None
+                    if this is the last page
+        """
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return snapshot.category_page(after, limit)
+
+        db = get_db()
+        query = PAGE_QUERY
+        data = [after, limit + 1]
+        result = db.execute(query, data)
+        categories = [dict(category) for category in result.fetchall()]
+        next_after = None
+        if len(categories) > limit:
+            categories = categories[:limit]
+            next_after = categories[-1]["CategoryID"]
+        return categories, next_after
+
+
+    @staticmethod
+    def iter_rows(batch_size=500):
+        """Yields all rows from the categories table, ordered by id.
+
+        Rows are read from the cursor in batches of `batch_size`, so only one
+        batch is held in memory at a time.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            batch_size (int): the number of rows fetched per round trip
+
+        Yields:
+            dict: one row of the table
+        """
+        for columns, categories in CategoriesTable.iter_batches(batch_size):
+            for category in categories:
+                yield dict(zip(columns, category))
+
+
+    @staticmethod
+    def iter_batches(batch_size=500):
+        """Yields all rows from the categories table in batches of plain tuples.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            batch_size (int): the number of rows fetched per round trip
+
+        Yields:
+            tuple: (columns, categories) where columns lists the column names
+                and categories is a list of at most batch_size tuples
+        """
         db = get_db()
-        result = db.execute("SELECT * FROM CATEGORIES")
-        categories = result.fetchall()
-        categories = [dict(category) for category in categories]
-        return categories
+        result = db.execute("SELECT * FROM CATEGORIES ORDER BY CategoryID")
+        result.row_factory = None
+        columns = [column[0] for column in result.description]
+        while True:
+            categories = result.fetchmany(batch_size)
+            if not categories:
+                break
+            yield columns, categories
 
 
     @staticmethod
@@ -35,14 +173,22 @@ class CategoriesTable:
         dict: the catgory with the specified category id; None if no such
             category exists
         """
-        db = get_db()
-        query = "SELECT * FROM CATEGORIES WHERE CategoryID = ?"
-        data = [category_id]
-        result = db.execute(query, data)
-        category = result.fetchone()
-        if category is not None:
-            category = dict(category)
-        return category
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return CatalogSnapshot.as_dict(snapshot.categories_by_id.get(category_id))
+
+        def load():
+            db = get_db()
+            query = BY_ID_QUERY
+            data = [category_id]
+            result = db.execute(query, data)
+            category = result.fetchone()
+            if category is not None:
+                category = dict(category)
+            return category
+
+        version, _ = CategoriesTable.get_version()
+        return categories_cache.get_or_load(("id", category_id), load, version)
 
 
     @staticmethod
@@ -59,17 +205,173 @@ class CategoriesTable:
             dict: the catgory with the specified name; None if no such 
                     catgory exists
         """
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return CatalogSnapshot.as_dict(snapshot.categories_by_name.get(category_name))
+
+        def load():
+            db = get_db()
+            query = BY_NAME_QUERY
+            data = [category_name]
+            result = db.execute(query, data)
+            category = result.fetchone()
+            if category is not None:
+                category = dict(category)
+            return category
+
+        version, _ = CategoriesTable.get_version()
+        return categories_cache.get_or_load(("name", category_name), load, version)
+
+
+    @staticmethod
+    def get_many(category_ids=(), category_names=()):
+        """Gets many rows from the categories table by id and by name at once.
+
+        The keys are resolved with a few set-based IN (...) queries, in
+        chunks, instead of one query per key.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            category_ids (list): the ids of the categories to be returned
+            category_names (list): the names of the categories to be returned
+
+        Returns:
+            tuple: (by_id, by_name) where
+                by_id (list): the category of each id, in the order of
+                    category_ids; None for an id that doesn't exist
+                by_name (list): the category of each name, in the order of
+                    category_names; None for a name that doesn't exist
+        """
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            found_ids = snapshot.categories_by_id
+            found_names = snapshot.categories_by_name
+            return (
+                [CatalogSnapshot.as_dict(found_ids.get(key)) for key in category_ids],
+                [CatalogSnapshot.as_dict(found_names.get(key)) for key in category_names],
+            )
+
+        found_ids = {
+            row["CategoryID"]: dict(row) for row in select_in(MANY_BY_ID_QUERY, category_ids)
+        }
+        found_names = {
+            row["CategoryName"]: dict(row) for row in select_in(MANY_BY_NAME_QUERY, category_names)
+        }
+        return (
+            [found_ids.get(key) for key in category_ids],
+            [found_names.get(key) for key in category_names],
+        )
+
+
+    @staticmethod
+    def get_stats():
+        """Gets the product count and price aggregates of every category.
+
+        The aggregates are read from CATEGORY_STATS, which triggers keep up to
+        date with every product change, so the cost only depends on the
+        number of categories.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Returns:
+            list: one dictionary per category, ordered by id, that maps
+                "CategoryID", "CategoryName", "ProductCount", "MinPrice",
+                "AvgPrice" and "MaxPrice"; the prices are None for a category
+                without products and the average is rounded to cents
+        """
         db = get_db()
-        query = "SELECT * FROM CATEGORIES WHERE CategoryName = ?"
-        data = [category_name]
+        query = f"{STATS_QUERY} ORDER BY CategoryID"
+        result = db.execute(query)
+        return [dict(category) for category in result.fetchall()]
+
+
+    @staticmethod
+    def get_stats_by_id(category_id):
+        """Gets the product count and price aggregates of one category.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            category_id (int): the id of the category
+
+        Returns:
+            dict: the aggregates, as returned by get_stats(); None if no such
+                category exists
+        """
+        db = get_db()
+        query = STATS_BY_ID_QUERY
+        data = [category_id]
         result = db.execute(query, data)
         category = result.fetchone()
         if category is not None:
-                category = dict(category)
+            category = dict(category)
         return category
 
 
     @staticmethod
+    def prime_statements():
+        """Runs every read query of the table once on the current connection.
+
+        The queries run around the lookup caches, with keys that match no
+        row, so that each statement is compiled into the connection's
+        statement cache before a request needs it. Writes are left out:
+        running them would take the write lock.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+        """
+        with bypass_caches():
+            CategoriesTable.get_version()
+            CategoriesTable.get_page(0, 1)
+            CategoriesTable.get_by_id(0)
+            CategoriesTable.get_by_name("")
+            CategoriesTable.get_many([0], [""])
+            CategoriesTable.get_stats()
+            CategoriesTable.get_stats_by_id(0)
+
+
+    @staticmethod
+    def hot_queries():
+        """Lists the read statements of the table that run on every request,
+        for check_query_plans(): the lookups by key and the pages by id.
+
+        Returns:
+            list: the statements
+        """
+        return [
+            PAGE_QUERY,
+            BY_ID_QUERY,
+            BY_NAME_QUERY,
+            MANY_BY_ID_QUERY.format(marks="?,?,?,?"),
+            MANY_BY_NAME_QUERY.format(marks="?,?,?,?"),
+            STATS_BY_ID_QUERY,
+        ]
+
+
+    @staticmethod
+    def invalidate_cache(*categories):
+        """Drops the cached lookups that the given categories may have changed.
+
+        Args:
+            categories (dict): the categories before and/or after a write;
+                each must map "CategoryID" and "CategoryName"
+        """
+        keys = [("all",)]
+        for category in categories:
+            keys.append(("id", category["CategoryID"]))
+            keys.append(("name", category["CategoryName"]))
+        categories_cache.invalidate(*keys)
+        forget_table_versions()
+        invalidate_snapshots()
+        notify_change_feeds()
+
+
+    @staticmethod
+    @group_commit
     def insert(category_data):
         """Inserts the specified category into the categories table.
 
@@ -94,23 +396,25 @@ class CategoriesTable:
         if len(category_name) == 0:
             return False, "Category name is empty.", None
 
-        category = CategoriesTable.get_by_name(category_name)
-        if category is not None:
-            return False, "Category name exists already.", None
-
         db = get_db()
         query = """
-            INSERT INTO CATEGORIES (CategoryName) 
+            INSERT INTO CATEGORIES (CategoryName)
                 VALUES (?)
+            ON CONFLICT (CategoryName) DO NOTHING
+            RETURNING *
         """
         data = [category_name]
-        db.execute(query, data)
-        category = CategoriesTable.get_by_name(category_name)
-        db.commit()
+        with transaction(db):
+            category = db.execute(query, data).fetchone()
+            if category is None:
+                return False, "Category name exists already.", None
+            category = dict(category)
+            after_commit(lambda: CategoriesTable.invalidate_cache(category), db)
         return True, "The category has been inserted.", category
 
 
     @staticmethod
+    @group_commit
     def delete(category_id):
         """Deletes the row with the given id from the categories table.
 
@@ -127,21 +431,24 @@ class CategoriesTable:
                 category (dict): the category with the specified identifier 
                     category_id; None if no such category exists
         """
-        category = CategoriesTable.get_by_id(category_id)
-        if category is None:
-            return False, "Category not found.", None
-
         db = get_db()
-        query = "SELECT * FROM PRODUCTS WHERE CategoryID = ?"
-        data = [category_id]
-        result = db.execute(query, data)
-        product = result.fetchone()
-        if product is not None:
-            return False, "Category has products.", category
-
-        query = "DELETE FROM CATEGORIES WHERE CategoryID = ?"
-        data = [category_id]
-        db.execute(query, data)
-        db.commit()
+        query = """
+            DELETE FROM CATEGORIES
+            WHERE CategoryID = ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM CATEGORY_STATS WHERE CategoryID = ? AND ProductCount > 0
+                )
+            RETURNING *
+        """
+        data = [category_id, category_id]
+        with transaction(db):
+            category = db.execute(query, data).fetchone()
+            if category is None:
+                query = "SELECT * FROM CATEGORIES WHERE CategoryID = ?"
+                category = db.execute(query, [category_id]).fetchone()
+                if category is None:
+                    return False, "Category not found.", None
+                return False, "Category has products.", dict(category)
+            category = dict(category)
+            after_commit(lambda: CategoriesTable.invalidate_cache(category), db)
         return True, "The category has been deleted.", category
-
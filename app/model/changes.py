@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from flask import current_app
+
+from model.database import database_path, get_pool
+
+
+CHANGES_POLL_INTERVAL = 1.0
+CHANGES_PAGE_LIMIT = 500
+QUERY = """
+    SELECT Seq, TableName, RowID, Op, Data, ChangedAt
+    FROM CHANGE_LOG WHERE Seq > ? ORDER BY Seq LIMIT ?
+"""
+
+
+class ChangeFeed:
+    """Tells waiting change feed clients about new CHANGE_LOG entries.
+
+    However many clients wait, the feed reads the newest sequence number at
+    most once per `poll_interval` seconds, on a connection of its own, and
+    only when PRAGMA data_version shows that something was committed. Writes
+    of this process call notify(), which wakes the clients at once; writes
+    of other processes are seen at the next poll.
+
+    No pooled connection is held while a client waits, so long-lived
+    streams don't starve the pools.
+    """
+
+    def __init__(self, database, poll_interval=CHANGES_POLL_INTERVAL):
+        self.database = database
+        self.poll_interval = poll_interval
+        self.pid = os.getpid()
+        self._db = get_pool(readonly=True).connect()
+        self._condition = threading.Condition()
+        self._data_version = None
+        self._latest = 0
+        self._stale = True
+        self._checked_at = 0.0
+        self._waiting = 0
+        self._polls = 0
+        self._notifications = 0
+
+    def notify(self):
+        """Wakes the waiting clients after a write of this process."""
+        with self._condition:
+            self._stale = True
+            self._notifications += 1
+            self._condition.notify_all()
+
+    def latest(self):
+        """Gets the newest sequence number of the log.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+        """
+        with self._condition:
+            return self._refresh()
+
+    def wait(self, after, timeout, cancelled=None):
+        """Waits until the log has an entry newer than `after`.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            after (int): the last sequence number the client has seen
+            timeout (float): the maximum number of seconds to wait
+            cancelled (threading.Event): stops the wait, within
+                `poll_interval` seconds, once set, e.g. when the client
+                has gone away
+
+        Returns:
+            int: the newest sequence number; not greater than `after` if the
+                wait timed out
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._waiting += 1
+            try:
+                while True:
+                    latest = self._refresh()
+                    remaining = deadline - time.monotonic()
+                    if latest > after or remaining <= 0:
+                        return latest
+                    if cancelled is not None and cancelled.is_set():
+                        return latest
+                    self._condition.wait(min(remaining, self.poll_interval))
+            finally:
+                self._waiting -= 1
+
+    def read(self, after, limit=CHANGES_PAGE_LIMIT):
+        """Reads the entries that follow a sequence number.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            after (int): the last sequence number the client has seen
+            limit (int): the maximum number of entries to return
+
+        Returns:
+            tuple: (horizon, changes) where
+                horizon (int): the newest sequence number compacted away; a
+                    client with `after` below it has missed changes
+                changes (list): the entries as dictionaries, oldest first,
+                    with "Data" decoded; None for a delete
+        """
+        with self._condition:
+            db = self._db
+            db.execute("BEGIN")
+            try:
+                horizon = db.execute("SELECT Horizon FROM CHANGE_LOG_STATE").fetchone()[0]
+                result = db.execute(QUERY, [after, limit])
+                changes = [dict(change) for change in result.fetchall()]
+            finally:
+                db.rollback()
+        for change in changes:
+            if change["Data"] is not None:
+                change["Data"] = json.loads(change["Data"])
+        return horizon, changes
+
+    def stats(self):
+        """Returns the feed metrics.
+
+        Returns:
+            dict: the newest sequence number seen, the number of waiting
+                clients and the poll/notification counters
+        """
+        with self._condition:
+            return {
+                "latest": self._latest,
+                "waiting": self._waiting,
+                "polls": self._polls,
+                "notifications": self._notifications,
+            }
+
+    def _refresh(self):
+        if not self._stale and time.monotonic() - self._checked_at < self.poll_interval:
+            return self._latest
+        self._checked_at = time.monotonic()
+        self._stale = False
+        data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._polls += 1
+            query = "SELECT IFNULL(MAX(Seq), 0) FROM CHANGE_LOG"
+            self._latest = self._db.execute(query).fetchone()[0]
+        return self._latest
+
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def get_change_feed(create=True):
+    """Returns the change feed of the configured database.
+
+    The feed is created on first use, with CHANGES_POLL_INTERVAL from the
+    current app. A forked process never reuses its parent's feed.
+
+    Args:
+        create (bool): False to only return a feed that already exists
+
+    Returns:
+        ChangeFeed: the feed; None if create is False and no client has
+            used the feed yet
+    """
+    database = database_path()
+    feed = _feeds.get(database)
+    if feed is not None and feed.pid != os.getpid():
+        feed = None
+    if feed is None and not create:
+        return None
+    if feed is None:
+        with _feeds_lock:
+            feed = _feeds.get(database)
+            if feed is None or feed.pid != os.getpid():
+                feed = _feeds[database] = ChangeFeed(
+                    database,
+                    current_app.config.get("CHANGES_POLL_INTERVAL", CHANGES_POLL_INTERVAL),
+                )
+    return feed
+
+
+def notify_change_feeds():
+    """Wakes the change feed clients of every database of this process."""
+    for feed in list(_feeds.values()):
+        if feed.pid == os.getpid():
+            feed.notify()
@@ -1,13 +1,357 @@
+import contextlib
+import os
+import pathlib
+import queue
 import sqlite3
-from flask import g
+import threading
+import time
+from flask import current_app, g, has_app_context, has_request_context, request
 
 
 DATABASE = "./app/model/database/bakery.db"
+POOL_SIZE = 5
+POOL_TIMEOUT = 5.0
+POOL_HEALTH_CHECK_INTERVAL = 30.0
+JOURNAL_MODE = "WAL"
+PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -16000,
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+READ_ONLY_METHODS = ("GET", "HEAD", "OPTIONS")
+IN_CHUNK_SIZE = 500
+TABLE_VERSION_QUERY = "SELECT Version, ModifiedAt FROM TABLE_VERSIONS WHERE TableName = ?"
+
+
+class Connection(sqlite3.Connection):
+    """A connection that reports its execute() calls to the query observer.
+
+    The observer is set with set_query_observer(); while it is None, or while
+    it declines to sample the current context, execute() costs one attribute
+    lookup more than sqlite3.Connection.execute().
+    """
+
+    observer = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.savepoint_depth = 0
+        self.after_commit_callbacks = []
+
+    def execute(self, sql, parameters=()):
+        observer = Connection.observer
+        if observer is None or not observer.sampled():
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observer.observe(self, sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        observer = Connection.observer
+        if observer is None or not observer.sampled():
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observer.observe(self, sql, None, time.perf_counter() - start)
+
+    def explain(self, sql, parameters=()):
+        """Gets the EXPLAIN QUERY PLAN details of a statement, unobserved."""
+        result = super().execute("EXPLAIN QUERY PLAN " + sql, parameters)
+        return [row[-1] for row in result.fetchall()]
+
+
+def set_query_observer(observer):
+    """Sets the object told about every statement run on pooled connections.
+
+    Args:
+        observer: an object with sampled() -> bool and
+            observe(db, sql, parameters, seconds) methods; None to stop
+            observing
+    """
+    Connection.observer = observer
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes free within the pool timeout."""
+
+
+class ConnectionPool:
+    """A bounded pool of reusable connections to one database file.
+
+    Connections are checked out for the duration of a request and checked back
+    in on teardown, so their page cache and compiled statements survive from
+    one request to the next. At most `size` connections are ever opened; when
+    all of them are in use, checkout waits up to `timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        database,
+        size=POOL_SIZE,
+        timeout=POOL_TIMEOUT,
+        health_check_interval=POOL_HEALTH_CHECK_INTERVAL,
+        pragmas=None,
+        readonly=False,
+    ):
+        self.database = database
+        self.pragmas = PRAGMAS if pragmas is None else pragmas
+        self.readonly = readonly
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._discarded = 0
+
+    def connect(self):
+        """Opens a new connection configured like every pooled connection.
+
+        Read-only pools open the file through a "mode=ro" URI, so a GET
+        handler can never take the write lock.
+
+        Raises:
+            sqlite3.Error: if the database connection cannot be established
+
+        Returns:
+            sqlite3.Connection: the database connection
+        """
+        if self.readonly:
+            uri = pathlib.Path(self.database).resolve().as_uri() + "?mode=ro"
+            db = sqlite3.connect(
+                uri, uri=True, check_same_thread=False, factory=Connection
+            )
+        else:
+            db = sqlite3.connect(
+                self.database, check_same_thread=False, factory=Connection
+            )
+        db.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            db.execute(f"PRAGMA {name} = {value}")
+        return db
+
+    def checkout(self):
+        """Takes a connection from the pool, opening one if the pool is not full.
+
+        Connections that sat idle longer than the health check interval are
+        probed with a trivial query and replaced if they are no longer usable.
+
+        Raises:
+            PoolTimeout: if every connection stays in use for `timeout` seconds
+            sqlite3.Error: if a new connection cannot be established
+
+        Returns:
+            sqlite3.Connection: the database connection
+        """
+        while True:
+            try:
+                db, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                db, idle_since = self._open_or_wait()
+            if db is None or self._is_healthy(db, idle_since):
+                break
+            self._discard(db)
+        if db is None:
+            db = self._open()
+        with self._lock:
+            self._checkouts += 1
+        return db
+
+    def checkin(self, db):
+        """Returns a connection to the pool, rolling back any open transaction.
+
+        Args:
+            db (sqlite3.Connection): a connection obtained from checkout()
+        """
+        try:
+            if db.in_transaction:
+                db.rollback()
+        except sqlite3.Error:
+            self._discard(db)
+            return
+        self._idle.put((db, time.monotonic()))
+
+    def close(self):
+        """Closes every idle connection and forgets them."""
+        while True:
+            try:
+                db, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(db)
+
+    def stats(self):
+        """Returns the pool metrics.
+
+        Returns:
+            dict: the configured size, the number of open, idle and in-use
+                connections and the checkout/wait/timeout/discard counters
+        """
+        with self._lock:
+            idle = self._idle.qsize()
+            return {
+                "size": self.size,
+                "open": self._opened,
+                "idle": idle,
+                "in_use": self._opened - idle,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+            }
+
+    def _open_or_wait(self):
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                return None, None
+            self._waits += 1
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout("No database connection available.")
+
+    def _open(self):
+        try:
+            return self.connect()
+        except sqlite3.Error:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _is_healthy(self, db, idle_since):
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            db.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, db):
+        with self._lock:
+            self._opened -= 1
+            self._discarded += 1
+        try:
+            db.close()
+        except sqlite3.Error:
+            pass
+
+
+def configure_database(database, journal_mode=JOURNAL_MODE):
+    """Applies the persistent settings of a database file.
+
+    The journal mode is stored in the file itself, so it only needs to be set
+    once, through a read-write connection, before any pool opens it.
+
+    Raises:
+        sqlite3.Error: if the database operations fail
+
+    Args:
+        database (str): the path of the database file
+        journal_mode (str): the journal mode to use, e.g. "WAL" or "DELETE"
+    """
+    db = sqlite3.connect(database)
+    try:
+        db.execute(f"PRAGMA journal_mode = {journal_mode}")
+    finally:
+        db.close()
+
+
+def database_path():
+    """Gets the path of the database file configured for the current app."""
+    return current_app.config.get("DATABASE", DATABASE)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(readonly=False):
+    """Returns the connection pool of the configured database.
+
+    The pool is created on first use from the DATABASE, DATABASE_POOL_SIZE,
+    DATABASE_POOL_TIMEOUT, DATABASE_POOL_HEALTH_CHECK_INTERVAL,
+    DATABASE_JOURNAL_MODE and DATABASE_PRAGMAS settings of the current app;
+    DATABASE_PRAGMAS is merged over PRAGMAS. A forked process never reuses
+    its parent's pool.
+
+    Args:
+        readonly (bool): True for the pool of "mode=ro" connections
+
+    Returns:
+        ConnectionPool: the pool
+    """
+    config = current_app.config
+    database = database_path()
+    key = (database, readonly)
+    pool = _pools.get(key)
+    if pool is None or pool.pid != os.getpid():
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None or pool.pid != os.getpid():
+                if (database, not readonly) not in _pools:
+                    configure_database(
+                        database, config.get("DATABASE_JOURNAL_MODE", JOURNAL_MODE)
+                    )
+                pool = _pools[key] = ConnectionPool(
+                    database,
+                    size=config.get("DATABASE_POOL_SIZE", POOL_SIZE),
+                    timeout=config.get("DATABASE_POOL_TIMEOUT", POOL_TIMEOUT),
+                    health_check_interval=config.get(
+                        "DATABASE_POOL_HEALTH_CHECK_INTERVAL",
+                        POOL_HEALTH_CHECK_INTERVAL,
+                    ),
+                    pragmas={**PRAGMAS, **config.get("DATABASE_PRAGMAS", {})},
+                    readonly=readonly,
+                )
+    return pool
+
+
+def read_only(view):
+    """Marks a view that only reads, whatever its method, as read-only.
+
+    Its requests go through the read-only pool like GET requests, e.g. for
+    a lookup that takes its keys in a POST body.
+    """
+    view.read_only = True
+    return view
+
+
+def wants_readonly():
+    """Tells whether the current context should use a read-only connection.
+
+    Requests with a safe method (GET, HEAD, OPTIONS), and requests to a view
+    marked with read_only(), read through the read-only pool unless
+    DATABASE_READ_ONLY_GETS is turned off; everything else, including CLI
+    commands, uses the read-write pool.
+    """
+    if not has_request_context() or not current_app.config.get("DATABASE_READ_ONLY_GETS", True):
+        return False
+    if request.method in READ_ONLY_METHODS:
+        return True
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, "read_only", False)
 
 
 def get_db():
     """Opens a connection to the database
 
+    The connection is checked out of the pool once per app context and reused
+    for every call in that context.
+
     Raises:
         sqlite3.Error: if the database connection cannot be established
 
@@ -16,17 +360,192 @@ def get_db():
     """
     db = getattr(g, "_database", None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        pool = g._database_pool = get_pool(wants_readonly())
+        db = g._database = pool.checkout()
     return db
 
 
 def close_db():
     """Closes the connection to the database
 
+    The connection is returned to the pool rather than closed.
+
     Raises:
         sqlite3.Error: if the close operation fails
     """
-    db = getattr(g, "_database", None)
+    db = g.pop("_database", None)
     if db is not None:
-        db.close()
+        g.pop("_database_pool").checkin(db)
+
+
+def get_table_version(table_name):
+    """Gets the change counter of a catalog table from TABLE_VERSIONS.
+
+    It is read once per app context, so the ETag of a request and the
+    cached rows it returns are checked against the same version.
+
+    Raises:
+        sqlite3.Error: If the database operations fail
+
+    Args:
+        table_name (str): "PRODUCTS" or "CATEGORIES"
+
+    Returns:
+        tuple: (version, modified_at), see ProductsTable.get_version()
+    """
+    versions = g.setdefault("_table_versions", {})
+    version = versions.get(table_name)
+    if version is None:
+        result = get_db().execute(TABLE_VERSION_QUERY, [table_name])
+        version = versions[table_name] = tuple(result.fetchone())
+    return version
+
+
+def forget_table_versions():
+    """Makes the next get_table_version() of the current app context read
+    TABLE_VERSIONS again, after a write of this context."""
+    if has_app_context():
+        g.pop("_table_versions", None)
+
+
+@contextlib.contextmanager
+def use_connection(db):
+    """Makes get_db() return the given connection within the block, e.g. to
+    run queries on each connection of a pool in turn. The caller keeps it
+    checked out.
+    """
+    previous = g.pop("_database", None)
+    g._database = db
+    try:
+        yield db
+    finally:
+        g.pop("_database", None)
+        if previous is not None:
+            g._database = previous
+
+
+def select_in(query, values, chunk_size=IN_CHUNK_SIZE, db=None):
+    """Runs a query with an IN (...) list once per chunk of values.
+
+    Keeps every statement well under SQLite's limit on bound parameters. A
+    short chunk is padded, by repeating its last value, to the next power of
+    two, so that lists of any length compile to a handful of statements that
+    stay in the connection's statement cache.
+
+    Raises:
+        sqlite3.Error: If the database operations fail
+
+    Args:
+        query (str): the query, with a "{marks}" placeholder for the list,
+            e.g. "SELECT * FROM PRODUCTS WHERE ProductID IN ({marks})"
+        values (list): the values of the list; duplicates are dropped
+        chunk_size (int): the maximum number of values per statement
+        db (Connection): the connection; get_db() if None
+
+    Yields:
+        sqlite3.Row: the rows of every chunk, chunk after chunk
+    """
+    db = get_db() if db is None else db
+    values = list(dict.fromkeys(values))
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        size = min(chunk_size, 1 << (len(chunk) - 1).bit_length())
+        chunk += chunk[-1:] * (size - len(chunk))
+        marks = ",".join("?" * len(chunk))
+        yield from db.execute(query.format(marks=marks), chunk)
+
+
+@contextlib.contextmanager
+def transaction(db=None):
+    """Runs a block of statements as one atomic unit.
+
+    Outside a transaction this is BEGIN IMMEDIATE ... COMMIT, so the write
+    lock is taken up front and the block can't fail half way with "database
+    is locked". Inside one, it is a SAVEPOINT that is rolled back on its own if
+    the block raises, leaving the enclosing transaction usable.
+
+    Raises:
+        sqlite3.Error: If the database operations fail
+
+    Args:
+        db (Connection): the connection; get_db() if None
+
+    Yields:
+        Connection: the connection
+    """
+    db = get_db() if db is None else db
+    if db.in_transaction:
+        db.savepoint_depth += 1
+        name = f"bakery_{db.savepoint_depth}"
+        pending = len(db.after_commit_callbacks)
+        db.execute(f"SAVEPOINT {name}")
+        try:
+            yield db
+        except BaseException:
+            db.execute(f"ROLLBACK TO {name}")
+            db.execute(f"RELEASE {name}")
+            del db.after_commit_callbacks[pending:]
+            raise
+        else:
+            db.execute(f"RELEASE {name}")
+        finally:
+            db.savepoint_depth -= 1
+        return
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        db.after_commit_callbacks.clear()
+        raise
+    db.commit()
+    callbacks = db.after_commit_callbacks[:]
+    db.after_commit_callbacks.clear()
+    for callback in callbacks:
+        callback()
+
+
+@contextlib.contextmanager
+def read_transaction(db=None):
+    """Runs a block of reads against one state of the database.
+
+    Outside a transaction this is BEGIN ... ROLLBACK: unlike transaction(),
+    no lock is taken up front, so it runs on read-only connections too, and
+    the reads of the block all see the database as of its first one. Inside
+    a transaction, the block is part of it.
+
+    Raises:
+        sqlite3.Error: If the database operations fail
+
+    Args:
+        db (Connection): the connection; get_db() if None
+
+    Yields:
+        Connection: the connection
+    """
+    db = get_db() if db is None else db
+    if db.in_transaction:
+        yield db
+        return
+    db.execute("BEGIN")
+    try:
+        yield db
+    finally:
+        db.rollback()
+
+
+def after_commit(callback, db=None):
+    """Runs a callback once the current transaction has committed.
+
+    Callbacks are dropped if the transaction, or the savepoint they were
+    registered in, rolls back. Outside a transaction the callback runs now.
+
+    Args:
+        callback (callable): called without arguments
+        db (Connection): the connection; get_db() if None
+    """
+    db = get_db() if db is None else db
+    if db.in_transaction:
+        db.after_commit_callbacks.append(callback)
+    else:
+        callback()
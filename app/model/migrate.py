@@ -0,0 +1,203 @@
+import os
+import re
+import sqlite3
+from model.categories_table import CategoriesTable
+from model.changes import QUERY as CHANGES_QUERY
+from model.database import TABLE_VERSION_QUERY
+from model.price_history_table import PriceHistoryTable
+from model.products_table import ProductsTable
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Statements that the triggers of the migrations run on every write.
+TRIGGER_QUERIES = (
+    "SELECT MIN(Price) FROM PRODUCTS WHERE CategoryID = ?",
+    "SELECT MAX(Price) FROM PRODUCTS WHERE CategoryID = ?",
+    "DELETE FROM CHANGE_LOG WHERE TableName = ? AND RowID = ?",
+)
+# Statements issued on every request or write; none of them may be answered
+# with a full table scan or sort its rows. The statements of the model are
+# taken from the model itself, so that this list can't drift from them.
+HOT_QUERIES = (
+    TABLE_VERSION_QUERY,
+    CHANGES_QUERY,
+    *CategoriesTable.hot_queries(),
+    *ProductsTable.hot_queries(),
+    *PriceHistoryTable.hot_queries(),
+    *TRIGGER_QUERIES,
+)
+
+
+class MigrationError(Exception):
+    """Raised when a migration cannot be applied."""
+
+
+class QueryPlanError(Exception):
+    """Raised when a hot query is planned as a full table scan or a sort."""
+
+
+def list_migrations(directory=MIGRATIONS_DIR):
+    """Lists the migration files in the order they must be applied.
+
+    Raises:
+        MigrationError: if two files share a version number
+
+    Args:
+        directory (str): the directory holding the NNNN_name.sql files
+
+    Returns:
+        list: (version, name, path) tuples sorted by version
+    """
+    migrations = {}
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match is None:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise MigrationError(f"Duplicate migration version {version}.")
+        path = os.path.join(directory, filename)
+        migrations[version] = (version, match.group(2), path)
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def split_statements(script):
+    """Splits an SQL script into complete statements.
+
+    Unlike executescript(), running the statements one by one keeps them in
+    the caller's transaction; trigger bodies are kept whole.
+
+    Args:
+        script (str): the SQL script
+
+    Returns:
+        list: the statements, in order
+    """
+    statements = []
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            if statement.strip():
+                statements.append(statement)
+            statement = ""
+    if statement.strip() and not statement.strip().startswith("--"):
+        raise MigrationError("Incomplete SQL statement at end of script.")
+    return statements
+
+
+def ensure_version_table(db):
+    """Creates the SCHEMA_VERSION table if it doesn't exist yet."""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS SCHEMA_VERSION (
+            Version INTEGER PRIMARY KEY,
+            Name TEXT NOT NULL,
+            AppliedAt TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def get_version(db):
+    """Gets the version of the newest applied migration; 0 if there is none."""
+    ensure_version_table(db)
+    return db.execute("SELECT IFNULL(MAX(Version), 0) FROM SCHEMA_VERSION").fetchone()[0]
+
+
+def migrate(database, target=None, directory=MIGRATIONS_DIR):
+    """Applies every pending migration up to the target version.
+
+    Each migration runs in its own BEGIN IMMEDIATE transaction together with
+    its SCHEMA_VERSION row, and the version is re-read once the write lock is
+    held, so several workers starting at the same time apply it only once.
+
+    Raises:
+        MigrationError: if the migration files are inconsistent
+        sqlite3.Error: If the database operations fail
+
+    Args:
+        database (str): the path of the database file
+        target (int): the version to migrate to; the newest one if None
+        directory (str): the directory holding the migration files
+
+    Returns:
+        list: the (version, name) of every migration that has been applied
+    """
+    applied = []
+    db = sqlite3.connect(database, isolation_level=None)
+    try:
+        ensure_version_table(db)
+        for version, name, path in list_migrations(directory):
+            if target is not None and version > target:
+                break
+            if version <= get_version(db):
+                continue
+            with open(path, encoding="utf-8") as file:
+                statements = split_statements(file.read())
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if version <= get_version(db):
+                    db.execute("ROLLBACK")
+                    continue
+                for statement in statements:
+                    db.execute(statement)
+                db.execute(
+                    "INSERT INTO SCHEMA_VERSION (Version, Name) VALUES (?, ?)",
+                    [version, name],
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            applied.append((version, name))
+    finally:
+        db.close()
+    return applied
+
+
+def explain(db, query):
+    """Gets the EXPLAIN QUERY PLAN details of a query.
+
+    Args:
+        db (sqlite3.Connection): the database connection
+        query (str): the query; its parameters are bound to NULL
+
+    Returns:
+        list: the "detail" column of each plan step
+    """
+    data = [None] * query.count("?")
+    result = db.execute("EXPLAIN QUERY PLAN " + query, data)
+    return [row[-1] for row in result.fetchall()]
+
+
+def check_query_plans(database, queries=HOT_QUERIES):
+    """Checks that no hot query is answered with a full table scan or needs a
+    temporary b-tree to sort its rows.
+
+    Raises:
+        QueryPlanError: listing every query whose plan contains a SCAN or a
+            USE TEMP B-TREE step
+        sqlite3.Error: If the database operations fail
+
+    Args:
+        database (str): the path of the database file
+        queries (tuple): the queries to check
+    """
+    failures = []
+    db = sqlite3.connect(database)
+    try:
+        for query in queries:
+            scans = [
+                step
+                for step in explain(db, query)
+                if step.startswith("SCAN") or step.startswith("USE TEMP B-TREE")
+            ]
+            if scans:
+                failures.append(f"{query}: {'; '.join(scans)}")
+    finally:
+        db.close()
+    if failures:
+        raise QueryPlanError("Scans or sorts in hot queries:\n" + "\n".join(failures))
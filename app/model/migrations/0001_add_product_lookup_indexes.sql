@@ -0,0 +1,4 @@
+-- ProductsTable.get_by_name() runs on every insert and CategoriesTable.delete()
+-- looks products up by category; both were full scans of PRODUCTS.
+CREATE INDEX IF NOT EXISTS PRODUCTS_ProductName ON PRODUCTS (ProductName);
+CREATE INDEX IF NOT EXISTS PRODUCTS_CategoryID ON PRODUCTS (CategoryID);
@@ -0,0 +1,51 @@
+-- A change counter per catalog table, bumped in the same transaction as every
+-- row change, so HTTP validators stay correct across worker processes.
+CREATE TABLE IF NOT EXISTS TABLE_VERSIONS (
+    TableName TEXT PRIMARY KEY,
+    Version INTEGER NOT NULL DEFAULT 0,
+    ModifiedAt INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO TABLE_VERSIONS (TableName) VALUES ('PRODUCTS'), ('CATEGORIES');
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_version_insert AFTER INSERT ON PRODUCTS
+BEGIN
+    UPDATE TABLE_VERSIONS
+    SET Version = Version + 1, ModifiedAt = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE TableName = 'PRODUCTS';
+END;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_version_update AFTER UPDATE ON PRODUCTS
+BEGIN
+    UPDATE TABLE_VERSIONS
+    SET Version = Version + 1, ModifiedAt = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE TableName = 'PRODUCTS';
+END;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_version_delete AFTER DELETE ON PRODUCTS
+BEGIN
+    UPDATE TABLE_VERSIONS
+    SET Version = Version + 1, ModifiedAt = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE TableName = 'PRODUCTS';
+END;
+
+CREATE TRIGGER IF NOT EXISTS CATEGORIES_version_insert AFTER INSERT ON CATEGORIES
+BEGIN
+    UPDATE TABLE_VERSIONS
+    SET Version = Version + 1, ModifiedAt = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE TableName = 'CATEGORIES';
+END;
+
+CREATE TRIGGER IF NOT EXISTS CATEGORIES_version_update AFTER UPDATE ON CATEGORIES
+BEGIN
+    UPDATE TABLE_VERSIONS
+    SET Version = Version + 1, ModifiedAt = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE TableName = 'CATEGORIES';
+END;
+
+CREATE TRIGGER IF NOT EXISTS CATEGORIES_version_delete AFTER DELETE ON CATEGORIES
+BEGIN
+    UPDATE TABLE_VERSIONS
+    SET Version = Version + 1, ModifiedAt = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE TableName = 'CATEGORIES';
+END;
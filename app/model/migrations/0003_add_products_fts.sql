@@ -0,0 +1,37 @@
+-- Full-text index over product names and codes for ProductsTable.search().
+-- It is an external-content table: the text stays in PRODUCTS and the
+-- triggers below keep the index in step with every write.
+CREATE VIRTUAL TABLE IF NOT EXISTS PRODUCTS_FTS USING fts5(
+    ProductName,
+    ProductCode,
+    content = 'PRODUCTS',
+    content_rowid = 'ProductID',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_fts_insert AFTER INSERT ON PRODUCTS
+BEGIN
+    INSERT INTO PRODUCTS_FTS (rowid, ProductName, ProductCode)
+        VALUES (new.ProductID, new.ProductName, new.ProductCode);
+END;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_fts_delete AFTER DELETE ON PRODUCTS
+BEGIN
+    INSERT INTO PRODUCTS_FTS (PRODUCTS_FTS, rowid, ProductName, ProductCode)
+        VALUES ('delete', old.ProductID, old.ProductName, old.ProductCode);
+END;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_fts_update AFTER UPDATE OF ProductName, ProductCode ON PRODUCTS
+BEGIN
+    INSERT INTO PRODUCTS_FTS (PRODUCTS_FTS, rowid, ProductName, ProductCode)
+        VALUES ('delete', old.ProductID, old.ProductName, old.ProductCode);
+    INSERT INTO PRODUCTS_FTS (rowid, ProductName, ProductCode)
+        VALUES (new.ProductID, new.ProductName, new.ProductCode);
+END;
+
+-- Rank name matches above code matches; "ORDER BY rank" lets FTS5 sort
+-- internally instead of calling bm25() per row from SQL.
+INSERT INTO PRODUCTS_FTS (PRODUCTS_FTS, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+
+INSERT INTO PRODUCTS_FTS (PRODUCTS_FTS) VALUES ('rebuild');
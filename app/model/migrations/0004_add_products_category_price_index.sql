@@ -0,0 +1,7 @@
+-- Backs ProductsTable.query(): category + price range filters sorted by price
+-- are answered from (CategoryID, Price, ProductID) without a sort step, and
+-- price filters/sorts across categories use the Price index. The composite
+-- index covers every lookup PRODUCTS_CategoryID served.
+CREATE INDEX IF NOT EXISTS PRODUCTS_CategoryID_Price ON PRODUCTS (CategoryID, Price);
+CREATE INDEX IF NOT EXISTS PRODUCTS_Price ON PRODUCTS (Price);
+DROP INDEX IF EXISTS PRODUCTS_CategoryID;
@@ -0,0 +1,77 @@
+-- Product count and price aggregates per category, kept up to date by
+-- triggers in the same transaction as every product and category change, so
+-- the category stats endpoints read one row per category. The minimum and
+-- maximum are only recomputed, from the (CategoryID, Price) index, when the
+-- product holding them leaves the category.
+CREATE TABLE IF NOT EXISTS CATEGORY_STATS (
+    CategoryID INTEGER PRIMARY KEY,
+    ProductCount INTEGER NOT NULL DEFAULT 0,
+    PriceSum REAL NOT NULL DEFAULT 0,
+    MinPrice REAL,
+    MaxPrice REAL
+);
+
+INSERT OR REPLACE INTO CATEGORY_STATS (CategoryID, ProductCount, PriceSum, MinPrice, MaxPrice)
+SELECT CategoryID, COUNT(Price), COALESCE(SUM(Price), 0), MIN(Price), MAX(Price)
+FROM (
+    SELECT CategoryID, NULL AS Price FROM CATEGORIES
+    UNION ALL
+    SELECT CategoryID, Price FROM PRODUCTS
+)
+GROUP BY CategoryID;
+
+CREATE TRIGGER IF NOT EXISTS CATEGORIES_stats_insert AFTER INSERT ON CATEGORIES
+BEGIN
+    INSERT OR IGNORE INTO CATEGORY_STATS (CategoryID) VALUES (new.CategoryID);
+END;
+
+CREATE TRIGGER IF NOT EXISTS CATEGORIES_stats_delete AFTER DELETE ON CATEGORIES
+BEGIN
+    DELETE FROM CATEGORY_STATS WHERE CategoryID = old.CategoryID AND ProductCount = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_stats_insert AFTER INSERT ON PRODUCTS
+BEGIN
+    INSERT INTO CATEGORY_STATS (CategoryID, ProductCount, PriceSum, MinPrice, MaxPrice)
+        VALUES (new.CategoryID, 1, new.Price, new.Price, new.Price)
+    ON CONFLICT (CategoryID) DO UPDATE SET
+        ProductCount = ProductCount + 1,
+        PriceSum = PriceSum + excluded.PriceSum,
+        MinPrice = MIN(COALESCE(MinPrice, excluded.MinPrice), excluded.MinPrice),
+        MaxPrice = MAX(COALESCE(MaxPrice, excluded.MaxPrice), excluded.MaxPrice);
+END;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_stats_delete AFTER DELETE ON PRODUCTS
+BEGIN
+    UPDATE CATEGORY_STATS SET
+        ProductCount = ProductCount - 1,
+        PriceSum = CASE WHEN ProductCount = 1 THEN 0 ELSE PriceSum - old.Price END,
+        MinPrice = CASE WHEN old.Price <= MinPrice
+            THEN (SELECT MIN(Price) FROM PRODUCTS WHERE CategoryID = old.CategoryID)
+            ELSE MinPrice END,
+        MaxPrice = CASE WHEN old.Price >= MaxPrice
+            THEN (SELECT MAX(Price) FROM PRODUCTS WHERE CategoryID = old.CategoryID)
+            ELSE MaxPrice END
+    WHERE CategoryID = old.CategoryID;
+END;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_stats_update AFTER UPDATE OF CategoryID, Price ON PRODUCTS
+BEGIN
+    UPDATE CATEGORY_STATS SET
+        ProductCount = ProductCount - 1,
+        PriceSum = CASE WHEN ProductCount = 1 THEN 0 ELSE PriceSum - old.Price END,
+        MinPrice = CASE WHEN old.Price <= MinPrice
+            THEN (SELECT MIN(Price) FROM PRODUCTS WHERE CategoryID = old.CategoryID)
+            ELSE MinPrice END,
+        MaxPrice = CASE WHEN old.Price >= MaxPrice
+            THEN (SELECT MAX(Price) FROM PRODUCTS WHERE CategoryID = old.CategoryID)
+            ELSE MaxPrice END
+    WHERE CategoryID = old.CategoryID;
+    INSERT INTO CATEGORY_STATS (CategoryID, ProductCount, PriceSum, MinPrice, MaxPrice)
+        VALUES (new.CategoryID, 1, new.Price, new.Price, new.Price)
+    ON CONFLICT (CategoryID) DO UPDATE SET
+        ProductCount = ProductCount + 1,
+        PriceSum = PriceSum + excluded.PriceSum,
+        MinPrice = MIN(COALESCE(MinPrice, excluded.MinPrice), excluded.MinPrice),
+        MaxPrice = MAX(COALESCE(MaxPrice, excluded.MaxPrice), excluded.MaxPrice);
+END;
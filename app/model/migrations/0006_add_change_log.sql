@@ -0,0 +1,98 @@
+-- A compacted log of catalog changes for GET /changes. Triggers append to it
+-- in the same transaction as every product and category change, after
+-- dropping the previous entry of the same row, so the log holds at most one
+-- entry per row: its latest upsert, or a delete tombstone. Tombstones older
+-- than TombstoneRetention seconds are dropped, and Horizon records the
+-- newest dropped sequence number: a client resuming from before it has
+-- missed a delete and must reload the catalog.
+CREATE TABLE IF NOT EXISTS CHANGE_LOG (
+    Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    TableName TEXT NOT NULL,
+    RowID INTEGER NOT NULL,
+    Op TEXT NOT NULL,
+    Data TEXT,
+    ChangedAt INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS CHANGE_LOG_row ON CHANGE_LOG (TableName, RowID);
+
+CREATE INDEX IF NOT EXISTS CHANGE_LOG_tombstones ON CHANGE_LOG (ChangedAt) WHERE Op = 'delete';
+
+CREATE TABLE IF NOT EXISTS CHANGE_LOG_STATE (
+    Horizon INTEGER NOT NULL DEFAULT 0,
+    TombstoneRetention INTEGER NOT NULL DEFAULT 604800
+);
+
+INSERT INTO CHANGE_LOG_STATE (Horizon) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM CHANGE_LOG_STATE);
+
+CREATE TRIGGER IF NOT EXISTS CHANGE_LOG_expire_tombstones AFTER INSERT ON CHANGE_LOG
+WHEN new.Op = 'delete'
+BEGIN
+    UPDATE CHANGE_LOG_STATE SET Horizon = MAX(Horizon, IFNULL((
+        SELECT MAX(Seq) FROM CHANGE_LOG
+        WHERE Op = 'delete' AND ChangedAt < new.ChangedAt - TombstoneRetention
+    ), 0));
+    DELETE FROM CHANGE_LOG
+    WHERE Op = 'delete'
+        AND ChangedAt < new.ChangedAt - (SELECT TombstoneRetention FROM CHANGE_LOG_STATE);
+END;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_change_insert AFTER INSERT ON PRODUCTS
+BEGIN
+    DELETE FROM CHANGE_LOG WHERE TableName = 'PRODUCTS' AND RowID = new.ProductID;
+    INSERT INTO CHANGE_LOG (TableName, RowID, Op, Data, ChangedAt)
+    VALUES ('PRODUCTS', new.ProductID, 'upsert', json_object(
+        'ProductID', new.ProductID, 'CategoryID', new.CategoryID,
+        'ProductCode', new.ProductCode, 'ProductName', new.ProductName,
+        'Price', CAST(new.Price AS REAL)
+    ), CAST(strftime('%s', 'now') AS INTEGER));
+END;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_change_update AFTER UPDATE ON PRODUCTS
+BEGIN
+    DELETE FROM CHANGE_LOG WHERE TableName = 'PRODUCTS' AND RowID IN (old.ProductID, new.ProductID);
+    INSERT INTO CHANGE_LOG (TableName, RowID, Op, Data, ChangedAt)
+    SELECT 'PRODUCTS', old.ProductID, 'delete', NULL, CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE old.ProductID != new.ProductID;
+    INSERT INTO CHANGE_LOG (TableName, RowID, Op, Data, ChangedAt)
+    VALUES ('PRODUCTS', new.ProductID, 'upsert', json_object(
+        'ProductID', new.ProductID, 'CategoryID', new.CategoryID,
+        'ProductCode', new.ProductCode, 'ProductName', new.ProductName,
+        'Price', CAST(new.Price AS REAL)
+    ), CAST(strftime('%s', 'now') AS INTEGER));
+END;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_change_delete AFTER DELETE ON PRODUCTS
+BEGIN
+    DELETE FROM CHANGE_LOG WHERE TableName = 'PRODUCTS' AND RowID = old.ProductID;
+    INSERT INTO CHANGE_LOG (TableName, RowID, Op, Data, ChangedAt)
+    VALUES ('PRODUCTS', old.ProductID, 'delete', NULL, CAST(strftime('%s', 'now') AS INTEGER));
+END;
+
+CREATE TRIGGER IF NOT EXISTS CATEGORIES_change_insert AFTER INSERT ON CATEGORIES
+BEGIN
+    DELETE FROM CHANGE_LOG WHERE TableName = 'CATEGORIES' AND RowID = new.CategoryID;
+    INSERT INTO CHANGE_LOG (TableName, RowID, Op, Data, ChangedAt)
+    VALUES ('CATEGORIES', new.CategoryID, 'upsert', json_object(
+        'CategoryID', new.CategoryID, 'CategoryName', new.CategoryName
+    ), CAST(strftime('%s', 'now') AS INTEGER));
+END;
+
+CREATE TRIGGER IF NOT EXISTS CATEGORIES_change_update AFTER UPDATE ON CATEGORIES
+BEGIN
+    DELETE FROM CHANGE_LOG WHERE TableName = 'CATEGORIES' AND RowID IN (old.CategoryID, new.CategoryID);
+    INSERT INTO CHANGE_LOG (TableName, RowID, Op, Data, ChangedAt)
+    SELECT 'CATEGORIES', old.CategoryID, 'delete', NULL, CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE old.CategoryID != new.CategoryID;
+    INSERT INTO CHANGE_LOG (TableName, RowID, Op, Data, ChangedAt)
+    VALUES ('CATEGORIES', new.CategoryID, 'upsert', json_object(
+        'CategoryID', new.CategoryID, 'CategoryName', new.CategoryName
+    ), CAST(strftime('%s', 'now') AS INTEGER));
+END;
+
+CREATE TRIGGER IF NOT EXISTS CATEGORIES_change_delete AFTER DELETE ON CATEGORIES
+BEGIN
+    DELETE FROM CHANGE_LOG WHERE TableName = 'CATEGORIES' AND RowID = old.CategoryID;
+    INSERT INTO CHANGE_LOG (TableName, RowID, Op, Data, ChangedAt)
+    VALUES ('CATEGORIES', old.CategoryID, 'delete', NULL, CAST(strftime('%s', 'now') AS INTEGER));
+END;
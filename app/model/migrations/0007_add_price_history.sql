@@ -0,0 +1,67 @@
+-- An append-only history of product prices, written by triggers in the same
+-- transaction as every product insert and price change. ChangedAt is a Unix
+-- time in milliseconds. Both tables are WITHOUT ROWID, clustered on their
+-- primary key, so each row is stored once and a product's changes in a time
+-- range are read from one contiguous run of pages. Two changes of the same
+-- product in the same millisecond keep the later price.
+--
+-- PRICE_HISTORY_HOURLY rolls the changes up per product and hour (Hour is
+-- ChangedAt / 3600000) so that price summaries over long ranges read one row
+-- per hour instead of every change.
+CREATE TABLE IF NOT EXISTS PRICE_HISTORY (
+    ProductID INTEGER NOT NULL,
+    ChangedAt INTEGER NOT NULL,
+    Price REAL NOT NULL,
+    PRIMARY KEY (ProductID, ChangedAt)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS PRICE_HISTORY_HOURLY (
+    ProductID INTEGER NOT NULL,
+    Hour INTEGER NOT NULL,
+    Open REAL NOT NULL,
+    Low REAL NOT NULL,
+    High REAL NOT NULL,
+    Close REAL NOT NULL,
+    Changes INTEGER NOT NULL,
+    PRIMARY KEY (ProductID, Hour)
+) WITHOUT ROWID;
+
+-- Existing products start their history with their current price.
+INSERT OR IGNORE INTO PRICE_HISTORY (ProductID, ChangedAt, Price)
+SELECT ProductID, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER), Price
+FROM PRODUCTS;
+
+INSERT OR IGNORE INTO PRICE_HISTORY_HOURLY (ProductID, Hour, Open, Low, High, Close, Changes)
+SELECT ProductID, ChangedAt / 3600000, Price, Price, Price, Price, 1
+FROM PRICE_HISTORY;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_price_history_insert AFTER INSERT ON PRODUCTS
+BEGIN
+    INSERT INTO PRICE_HISTORY (ProductID, ChangedAt, Price)
+        VALUES (new.ProductID, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER), new.Price)
+    ON CONFLICT (ProductID, ChangedAt) DO UPDATE SET Price = excluded.Price;
+    INSERT INTO PRICE_HISTORY_HOURLY (ProductID, Hour, Open, Low, High, Close, Changes)
+        VALUES (new.ProductID, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER) / 3600000,
+            new.Price, new.Price, new.Price, new.Price, 1)
+    ON CONFLICT (ProductID, Hour) DO UPDATE SET
+        Low = MIN(Low, excluded.Low),
+        High = MAX(High, excluded.High),
+        Close = excluded.Close,
+        Changes = Changes + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS PRODUCTS_price_history_update AFTER UPDATE OF Price ON PRODUCTS
+WHEN old.Price IS NOT new.Price
+BEGIN
+    INSERT INTO PRICE_HISTORY (ProductID, ChangedAt, Price)
+        VALUES (new.ProductID, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER), new.Price)
+    ON CONFLICT (ProductID, ChangedAt) DO UPDATE SET Price = excluded.Price;
+    INSERT INTO PRICE_HISTORY_HOURLY (ProductID, Hour, Open, Low, High, Close, Changes)
+        VALUES (new.ProductID, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER) / 3600000,
+            new.Price, new.Price, new.Price, new.Price, 1)
+    ON CONFLICT (ProductID, Hour) DO UPDATE SET
+        Low = MIN(Low, excluded.Low),
+        High = MAX(High, excluded.High),
+        Close = excluded.Close,
+        Changes = Changes + 1;
+END;
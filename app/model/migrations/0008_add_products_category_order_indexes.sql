@@ -0,0 +1,6 @@
+-- Backs the category listings of ProductsTable.query() in id and name order.
+-- 0004 dropped PRODUCTS_CategoryID, but (CategoryID, Price) can't return the
+-- products of a category in ProductID order, so those pages were sorted in a
+-- temporary b-tree; (CategoryID, ProductName) does the same for the name sort.
+CREATE INDEX IF NOT EXISTS PRODUCTS_CategoryID_ProductID ON PRODUCTS (CategoryID, ProductID);
+CREATE INDEX IF NOT EXISTS PRODUCTS_CategoryID_ProductName ON PRODUCTS (CategoryID, ProductName);
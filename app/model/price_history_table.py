@@ -0,0 +1,183 @@
+import math
+import time
+from model.database import get_db
+
+
+HOUR = 3600000
+MAX_PRICE_BUCKETS = 1000
+DEFAULT_PRICE_BUCKETS = 100
+# Summary intervals picked when the client does not give one, in seconds.
+PRICE_INTERVALS = (60, 300, 900, 3600, 21600, 86400, 604800, 2592000)
+RANGE_QUERY = """
+    SELECT ChangedAt, Price FROM PRICE_HISTORY
+    WHERE ProductID = ? AND ChangedAt >= ? AND ChangedAt < ?
+    ORDER BY ChangedAt LIMIT ?
+"""
+FIRST_CHANGE_QUERY = "SELECT MIN(ChangedAt) FROM PRICE_HISTORY WHERE ProductID = ?"
+HOURLY_SUMMARY_QUERY = """
+    SELECT Hour * 3600000 AS ChangedAt, Open, Low, High, Close, Changes
+    FROM PRICE_HISTORY_HOURLY
+    WHERE ProductID = ? AND Hour >= ? AND Hour < ?
+    ORDER BY Hour
+"""
+SUMMARY_QUERY = """
+    SELECT ChangedAt, Price AS Open, Price AS Low, Price AS High,
+        Price AS Close, 1 AS Changes
+    FROM PRICE_HISTORY
+    WHERE ProductID = ? AND ChangedAt >= ? AND ChangedAt < ?
+    ORDER BY ChangedAt
+"""
+
+
+def to_millis(seconds):
+    """Converts a Unix time in seconds to the milliseconds of ChangedAt."""
+    return round(seconds * 1000)
+
+
+class PriceHistoryTable:
+    """Reads the price history that triggers record on every price change.
+
+    Times are Unix times in seconds at this interface; the tables store
+    milliseconds.
+    """
+
+    @staticmethod
+    def get_range(product_id, start=None, end=None, limit=100):
+        """Gets the price changes of a product in a time range, oldest first.
+
+        Reads one run of the PRICE_HISTORY primary key, so the cost depends on
+        the number of changes returned, not on the size of the table.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            product_id (int): the id of the product
+            start (float): the start of the range, included; None for the
+                first change
+            end (float): the end of the range, excluded; None for no end
+            limit (int): the maximum number of changes to return
+
+        Returns:
+            tuple: (prices, next) where
+                prices (list): dictionaries mapping "ChangedAt" and "Price"
+                next (float): the start of the range of the following page;
+                    None if this is the last page
+        """
+        db = get_db()
+        query = RANGE_QUERY
+        data = [
+            product_id,
+            0 if start is None else to_millis(start),
+            math.inf if end is None else to_millis(end),
+            limit + 1,
+        ]
+        rows = db.execute(query, data).fetchall()
+        next_start = rows.pop()["ChangedAt"] / 1000 if len(rows) > limit else None
+        prices = [
+            {"ChangedAt": row["ChangedAt"] / 1000, "Price": row["Price"]} for row in rows
+        ]
+        return prices, next_start
+
+    @staticmethod
+    def get_summary(product_id, start=None, end=None, interval=None):
+        """Downsamples the price changes of a product into fixed time buckets.
+
+        Buckets are aligned on multiples of the interval since the epoch and
+        the range is widened to whole buckets. When the interval is a whole
+        number of hours the buckets are folded from PRICE_HISTORY_HOURLY, one
+        row per hour with changes, so long ranges stay cheap however many
+        changes they hold; shorter intervals read PRICE_HISTORY, and are
+        limited to MAX_PRICE_BUCKETS buckets.
+
+        Raises:
+            ValueError: if the range or the interval is invalid
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            product_id (int): the id of the product
+            start (float): the start of the range; None for the first change
+            end (float): the end of the range; None for now
+            interval (int): the width of a bucket in seconds; None to pick
+                the shortest of PRICE_INTERVALS giving at most
+                DEFAULT_PRICE_BUCKETS buckets
+
+        Returns:
+            tuple: (interval, buckets) where
+                interval (int): the width of a bucket in seconds
+                buckets (list): one dictionary per bucket with changes,
+                    oldest first, mapping "Start", "Open", "Low", "High",
+                    "Close" and "Changes"; buckets without changes are left
+                    out, the price did not move during them
+        """
+        db = get_db()
+        if start is None:
+            first = db.execute(FIRST_CHANGE_QUERY, [product_id]).fetchone()[0]
+            if first is None:
+                return interval, []
+            start = first / 1000
+        if end is None:
+            end = time.time()
+        if end <= start:
+            raise ValueError("from must be before to.")
+        if interval is None:
+            interval = next(
+                (
+                    interval
+                    for interval in PRICE_INTERVALS
+                    if (end - start) / interval <= DEFAULT_PRICE_BUCKETS
+                ),
+                math.ceil((end - start) / DEFAULT_PRICE_BUCKETS / 86400) * 86400,
+            )
+        if interval <= 0:
+            raise ValueError("interval must be > 0.")
+
+        width = interval * 1000
+        first_bucket = to_millis(start) // width * width
+        end_bucket = -(-to_millis(end) // width) * width
+        if width % HOUR == 0:
+            query = HOURLY_SUMMARY_QUERY
+            data = [product_id, first_bucket // HOUR, end_bucket // HOUR]
+        else:
+            if (end_bucket - first_bucket) // width > MAX_PRICE_BUCKETS:
+                raise ValueError(
+                    f"The range spans more than {MAX_PRICE_BUCKETS} buckets; "
+                    "use a longer interval or a shorter range."
+                )
+            query = SUMMARY_QUERY
+            data = [product_id, first_bucket, end_bucket]
+        result = db.execute(query, data)
+        result.row_factory = None
+
+        buckets = []
+        bucket = None
+        for changed_at, open_price, low, high, close, changes in result:
+            bucket_start = changed_at // width * width
+            if bucket is None or bucket["Start"] != bucket_start:
+                bucket = {
+                    "Start": bucket_start,
+                    "Open": open_price,
+                    "Low": low,
+                    "High": high,
+                    "Close": close,
+                    "Changes": changes,
+                }
+                buckets.append(bucket)
+                continue
+            bucket["Low"] = min(bucket["Low"], low)
+            bucket["High"] = max(bucket["High"], high)
+            bucket["Close"] = close
+            bucket["Changes"] += changes
+        for bucket in buckets:
+            bucket["Start"] //= 1000
+        return interval, buckets
+
+    @staticmethod
+    def hot_queries():
+        """Lists the read statements of the price history, for
+        check_query_plans().
+
+        Returns:
+            list: the statements
+        """
+        return [RANGE_QUERY, FIRST_CHANGE_QUERY, HOURLY_SUMMARY_QUERY, SUMMARY_QUERY]
@@ -1,4 +1,44 @@
-from model.database import get_db
+import base64
+import json
+import re
+from model.cache import bypass_caches, products_cache
+from model.changes import notify_change_feeds
+from model.database import (
+    after_commit,
+    forget_table_versions,
+    get_db,
+    get_table_version,
+    select_in,
+    transaction,
+)
+from model.snapshot import CatalogSnapshot, get_snapshot, invalidate_snapshots
+from model.writer import group_commit
+
+
+INSERT_CHUNK_SIZE = 500
+SEARCH_TERM = re.compile(r"\w+")
+COLUMNS = ("ProductID", "CategoryID", "ProductCode", "ProductName", "Price")
+SORTS = {
+    "id": ("ProductID", "ASC"),
+    "-id": ("ProductID", "DESC"),
+    "price": ("Price", "ASC"),
+    "-price": ("Price", "DESC"),
+    "name": ("ProductName", "ASC"),
+    "-name": ("ProductName", "DESC"),
+}
+BY_ID_QUERY = "SELECT * FROM PRODUCTS WHERE ProductID = ?"
+BY_NAME_QUERY = "SELECT * FROM PRODUCTS WHERE ProductName = ?"
+BY_CODE_QUERY = "SELECT * FROM PRODUCTS WHERE ProductCode = ?"
+MANY_BY_ID_QUERY = "SELECT * FROM PRODUCTS WHERE ProductID IN ({marks})"
+MANY_BY_CODE_QUERY = "SELECT * FROM PRODUCTS WHERE ProductCode IN ({marks})"
+# The JSON types a cursor may hold for each keyset sort column.
+CURSOR_TYPES = {"Price": (int, float), "ProductName": (str,)}
+SQLITE_INTEGER_RANGE = range(-2**63, 2**63)
+# RETURNING hands back REAL values stored as integers without converting them.
+RETURNING = (
+    "RETURNING ProductID, CategoryID, ProductCode, ProductName, "
+    "CAST(Price AS REAL) AS Price"
+)
 
 
 class ProductsTable:
@@ -14,11 +54,381 @@ class ProductsTable:
                 column names to values. An empty list is returned if the
                 table has no columns.
         """
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return [product._asdict() for product in snapshot.products]
+
+        def load():
+            db = get_db()
+            result = db.execute("SELECT * FROM PRODUCTS")
+            result.row_factory = None
+            columns = [column[0] for column in result.description]
+            products = [dict(zip(columns, product)) for product in result.fetchall()]
+            return products
+
+        version, _ = ProductsTable.get_version()
+        return products_cache.get_or_load(("all",), load, version)
+
+    @staticmethod
+    def get_version():
+        """Gets the change counter of the products table.
+
+        The counter is bumped by a trigger in the same transaction as every
+        insert, update and delete, so it is shared by all worker processes.
+        It is read once per app context, and also checks the cached lookups.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Returns:
+            tuple: (version, modified_at) where version (int) is the change
+                counter and modified_at (int) the Unix time of the last change
+        """
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return snapshot.versions["PRODUCTS"]
+
+        return get_table_version("PRODUCTS")
+
+    @staticmethod
+    def get_page(after=0, limit=100):
+        """Gets one page of rows from the products table, ordered by id.
+
+        Uses keyset pagination: only rows whose id is greater than `after` are
+        read, so the cost of a page does not depend on how deep it is.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            after (int): the last product id of the previous page; 0 for the
+                first page
+            limit (int): the maximum number of rows to return
+
+        Returns:
+            tuple: (products, next) where
+                products (list): the rows of the page as dictionaries
+                next (int): the value of `after` for the following page; None
+                    if this is the last page
+        """
+        return ProductsTable.query(after=after, limit=limit)
+
+    @staticmethod
+    def query(
+        category_id=None,
+        min_price=None,
+        max_price=None,
+        sort="id",
+        fields=None,
+        after=None,
+        limit=100,
+    ):
+        """Gets one page of the products matching some filters, in some order.
+
+        The filters, the order and the projection compile, in build_query(),
+        to one parameterized statement. Pages use keyset pagination on the
+        sort column with ProductID as tie breaker, so each page costs the
+        same however deep it is.
+
+        Raises:
+            ValueError: if the sort order, a field or the cursor is invalid,
+                or if a price filter comes with a sort other than by price
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            category_id (int): only products of this category
+            min_price (float): only products costing at least this much
+            max_price (float): only products costing at most this much
+            sort (str): one of SORTS; a leading "-" sorts in descending order
+            fields (list): the columns to return; all of COLUMNS if None
+            after: the `next` value of the previous page; None for the first
+                page. An int ProductID for the "id" sort, an opaque cursor
+                string for the other sorts.
+            limit (int): the maximum number of rows to return
+
+        Returns:
+            tuple: (products, next) where
+                products (list): the rows of the page as dictionaries
+                next: the value of `after` for the following page; None if
+                    this is the last page
+        """
+        query, data = ProductsTable.build_query(
+            category_id, min_price, max_price, sort, fields, after, limit
+        )
+        column, direction = SORTS[sort]
+
+        snapshot = get_snapshot()
+        if snapshot is not None and column == "ProductID":
+            products, next_after = snapshot.product_page(
+                category_id, direction == "DESC", after, limit
+            )
+            if fields is not None:
+                products = [{field: product[field] for field in fields} for product in products]
+            return products, next_after
+
         db = get_db()
-        result = db.execute("SELECT * FROM PRODUCTS")
-        products = result.fetchall()
-        products = [dict(product) for product in products]
-        return products
+        result = db.execute(query, data)
+        products = [dict(product) for product in result.fetchall()]
+        next_after = None
+        if len(products) > limit:
+            products = products[:limit]
+            last = products[-1]
+            if column == "ProductID":
+                next_after = last["ProductID"]
+            else:
+                next_after = ProductsTable.encode_cursor(last[column], last["ProductID"])
+        if fields is not None:
+            products = [{field: product[field] for field in fields} for product in products]
+        return products, next_after
+
+    @staticmethod
+    def build_query(
+        category_id=None,
+        min_price=None,
+        max_price=None,
+        sort="id",
+        fields=None,
+        after=None,
+        limit=100,
+    ):
+        """Compiles the arguments of query() to its SQL statement.
+
+        The statement is answered without sorting by the Price and
+        ProductName indexes, and the CategoryID indexes on (ProductID),
+        (Price) and (ProductName). A price range can only be read in price
+        order: no index gives its rows by id or name. One row more than
+        `limit` is selected, to tell whether there is a next page.
+
+        Raises:
+            ValueError: if the sort order, a field or the cursor is invalid,
+                or if a price filter comes with a sort other than by price
+
+        Args:
+            see query()
+
+        Returns:
+            tuple: (query, data) where
+                query (str): the statement
+                data (list): its parameters
+        """
+        if sort not in SORTS:
+            raise ValueError(f"sort must be one of {', '.join(SORTS)}.")
+        column, direction = SORTS[sort]
+        if column != "Price" and (min_price is not None or max_price is not None):
+            raise ValueError("min_price and max_price need sort=price or sort=-price.")
+        if fields is None:
+            selected = "*"
+        else:
+            unknown = [field for field in fields if field not in COLUMNS]
+            if unknown or not fields:
+                raise ValueError(f"fields must be among {', '.join(COLUMNS)}.")
+            selected = ", ".join(dict.fromkeys([*fields, column, "ProductID"]))
+
+        conditions = []
+        data = []
+        if category_id is not None:
+            conditions.append("CategoryID = ?")
+            data.append(category_id)
+        if min_price is not None:
+            conditions.append("Price >= ?")
+            data.append(min_price)
+        if max_price is not None:
+            conditions.append("Price <= ?")
+            data.append(max_price)
+        comparison = ">" if direction == "ASC" else "<"
+        if after is not None and column == "ProductID":
+            conditions.append(f"ProductID {comparison} ?")
+            data.append(after)
+        elif after is not None:
+            conditions.append(f"({column}, ProductID) {comparison} (?, ?)")
+            data.extend(ProductsTable.decode_cursor(after, column))
+
+        query = f"SELECT {selected} FROM PRODUCTS"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if column == "ProductID":
+            query += " ORDER BY ProductID" + (" DESC" if direction == "DESC" else "")
+        else:
+            query += f" ORDER BY {column} {direction}, ProductID {direction}"
+        query += " LIMIT ?"
+        data.append(limit + 1)
+        return query, data
+
+    @staticmethod
+    def hot_queries():
+        """Lists the read statements of the table that run on every request.
+
+        These are the lookups by key, and the statements of query() in every
+        sort order, with and without a category, a price range and a cursor,
+        as build_query() compiles them. check_query_plans() checks that none
+        of them scans the table or sorts its rows. The first page without
+        any filter is left out: it reads the first rows of an index in order,
+        which the plan shows as a SCAN that the LIMIT stops.
+
+        Returns:
+            list: the statements
+        """
+        queries = [
+            BY_ID_QUERY,
+            BY_NAME_QUERY,
+            BY_CODE_QUERY,
+            MANY_BY_ID_QUERY.format(marks="?,?,?,?"),
+            MANY_BY_CODE_QUERY.format(marks="?,?,?,?"),
+        ]
+        cursors = {
+            "Price": ProductsTable.encode_cursor(0, 0),
+            "ProductName": ProductsTable.encode_cursor("", 0),
+        }
+        for sort, (column, _) in SORTS.items():
+            prices = [(None, None)]
+            if column == "Price":
+                prices += [(0, None), (None, 0), (0, 0)]
+            for category_id in (None, 0):
+                for min_price, max_price in prices:
+                    for after in (None, cursors.get(column, 0)):
+                        if (category_id, min_price, max_price, after) == (None,) * 4:
+                            continue
+                        query, _ = ProductsTable.build_query(
+                            category_id, min_price, max_price, sort, after=after
+                        )
+                        queries.append(query)
+        return queries
+
+    @staticmethod
+    def encode_cursor(value, product_id):
+        """Encodes a keyset position as an opaque, URL-safe cursor string."""
+        data = json.dumps([value, product_id], separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor, column):
+        """Decodes a cursor made by encode_cursor().
+
+        The cursor comes from the client, so its values are checked before
+        they are bound: the product id must be an SQLite integer and the
+        value must have the type of the sort column.
+
+        Raises:
+            ValueError: if the cursor is malformed
+
+        Args:
+            cursor (str): the cursor
+            column (str): the sort column, one of CURSOR_TYPES
+
+        Returns:
+            list: [value, product_id]
+        """
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            value, product_id = json.loads(base64.urlsafe_b64decode(padded))
+        except (TypeError, ValueError):
+            raise ValueError("after is not a valid cursor.")
+        for item, types in ((value, CURSOR_TYPES[column]), (product_id, (int,))):
+            if (
+                isinstance(item, bool)
+                or not isinstance(item, types)
+                or (isinstance(item, int) and item not in SQLITE_INTEGER_RANGE)
+            ):
+                raise ValueError("after is not a valid cursor.")
+        return [value, product_id]
+
+    @staticmethod
+    def iter_rows(batch_size=500, with_category=False):
+        """Yields all rows from the products table, ordered by id.
+
+        Rows are read from the cursor in batches of `batch_size`, so only one
+        batch is held in memory at a time.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            batch_size (int): the number of rows fetched per round trip
+            with_category (bool): add the "CategoryName" of each product
+
+        Yields:
+            dict: one row of the table
+        """
+        for columns, products in ProductsTable.iter_batches(batch_size, with_category):
+            for product in products:
+                yield dict(zip(columns, product))
+
+    @staticmethod
+    def iter_batches(batch_size=500, with_category=False):
+        """Yields all rows from the products table in batches of plain tuples.
+
+        Like iter_rows(), but without building a sqlite3.Row or a dictionary
+        per row, for callers that encode rows straight from their values.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            batch_size (int): the number of rows fetched per round trip
+            with_category (bool): add the "CategoryName" of each product
+
+        Yields:
+            tuple: (columns, products) where columns lists the column names
+                and products is a list of at most batch_size tuples
+        """
+        db = get_db()
+        if with_category:
+            query = """
+                SELECT PRODUCTS.*, CATEGORIES.CategoryName
+                FROM PRODUCTS LEFT JOIN CATEGORIES USING (CategoryID)
+                ORDER BY ProductID
+            """
+        else:
+            query = "SELECT * FROM PRODUCTS ORDER BY ProductID"
+        result = db.execute(query)
+        result.row_factory = None
+        columns = [column[0] for column in result.description]
+        while True:
+            products = result.fetchmany(batch_size)
+            if not products:
+                break
+            yield columns, products
+
+    @staticmethod
+    def search(text, limit=20, offset=0):
+        """Finds products whose name or code contains words starting with the
+        words of the given text, best matches first.
+
+        Every word of the text must match (as a prefix) a word of the product
+        name or code. Matches are ranked with BM25, name matches weighing more
+        than code matches.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            text (str): the search text, e.g. "cinn rai"
+            limit (int): the maximum number of products to return
+            offset (int): the number of best matches to skip
+
+        Returns:
+            list: the matching products as dictionaries; an empty list if the
+                text has no words
+        """
+        terms = SEARCH_TERM.findall(text)
+        if not terms:
+            return []
+        db = get_db()
+        query = """
+            SELECT PRODUCTS.*
+            FROM (
+                SELECT rowid, rank FROM PRODUCTS_FTS
+                WHERE PRODUCTS_FTS MATCH ?
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            ) AS MATCHES
+            JOIN PRODUCTS ON PRODUCTS.ProductID = MATCHES.rowid
+            ORDER BY MATCHES.rank
+        """
+        match = " ".join(f'"{term}"*' for term in terms)
+        data = [match, limit, offset]
+        result = db.execute(query, data)
+        return [dict(product) for product in result.fetchall()]
 
     @staticmethod
     def get_by_id(product_id):
@@ -33,14 +443,22 @@ class ProductsTable:
         dict: the product with the specified product id; None if no such
             product exists
         """
-        db = get_db()
-        query = "SELECT * FROM PRODUCTS WHERE ProductID = ?"
-        data = [product_id]
-        result = db.execute(query, data)
-        product = result.fetchone()
-        if product is not None:
-            product = dict(product)
-        return product
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return CatalogSnapshot.as_dict(snapshot.products_by_id.get(product_id))
+
+        def load():
+            db = get_db()
+            query = BY_ID_QUERY
+            data = [product_id]
+            result = db.execute(query, data)
+            product = result.fetchone()
+            if product is not None:
+                product = dict(product)
+            return product
+
+        version, _ = ProductsTable.get_version()
+        return products_cache.get_or_load(("id", product_id), load, version)
 
     @staticmethod
     def get_by_name(product_name):
@@ -56,14 +474,22 @@ class ProductsTable:
             dict: the product with the specified name; None if no such
                     product exists
         """
-        db = get_db()
-        query = "SELECT * FROM PRODUCTS WHERE ProductName = ?"
-        data = [product_name]
-        result = db.execute(query, data)
-        product = result.fetchone()
-        if product is not None:
-            product = dict(product)
-        return product
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return CatalogSnapshot.as_dict(snapshot.products_by_name.get(product_name))
+
+        def load():
+            db = get_db()
+            query = BY_NAME_QUERY
+            data = [product_name]
+            result = db.execute(query, data)
+            product = result.fetchone()
+            if product is not None:
+                product = dict(product)
+            return product
+
+        version, _ = ProductsTable.get_version()
+        return products_cache.get_or_load(("name", product_name), load, version)
 
     @staticmethod
     def get_by_code(product_code):
@@ -79,16 +505,159 @@ class ProductsTable:
             dict: the product with the specified code; None if no such
                     product exists
         """
-        db = get_db()
-        query = "SELECT * FROM PRODUCTS WHERE ProductCode = ?"
-        data = [product_code]
-        result = db.execute(query, data)
-        product = result.fetchone()
-        if product is not None:
-            product = dict(product)
-        return product
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return CatalogSnapshot.as_dict(snapshot.products_by_code.get(product_code))
+
+        def load():
+            db = get_db()
+            query = BY_CODE_QUERY
+            data = [product_code]
+            result = db.execute(query, data)
+            product = result.fetchone()
+            if product is not None:
+                product = dict(product)
+            return product
+
+        version, _ = ProductsTable.get_version()
+        return products_cache.get_or_load(("code", product_code), load, version)
 
     @staticmethod
+    def get_many(product_ids=(), product_codes=()):
+        """Gets many rows from the products table by id and by code at once.
+
+        The keys are resolved with a few set-based IN (...) queries, in
+        chunks, instead of one query per key.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+
+        Args:
+            product_ids (list): the ids of the products to be returned
+            product_codes (list): the codes of the products to be returned
+
+        Returns:
+            tuple: (by_id, by_code) where
+                by_id (list): the product of each id, in the order of
+                    product_ids; None for an id that doesn't exist
+                by_code (list): the product of each code, in the order of
+                    product_codes; None for a code that doesn't exist
+        """
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            found_ids = snapshot.products_by_id
+            found_codes = snapshot.products_by_code
+            return (
+                [CatalogSnapshot.as_dict(found_ids.get(key)) for key in product_ids],
+                [CatalogSnapshot.as_dict(found_codes.get(key)) for key in product_codes],
+            )
+
+        found_ids = {
+            row["ProductID"]: dict(row) for row in select_in(MANY_BY_ID_QUERY, product_ids)
+        }
+        found_codes = {
+            row["ProductCode"]: dict(row) for row in select_in(MANY_BY_CODE_QUERY, product_codes)
+        }
+        return (
+            [found_ids.get(key) for key in product_ids],
+            [found_codes.get(key) for key in product_codes],
+        )
+
+    @staticmethod
+    def prime_statements():
+        """Runs every read query of the table once on the current connection.
+
+        The queries run around the lookup caches, with keys that match no
+        row, so that each statement is compiled into the connection's
+        statement cache before a request needs it. query() is primed in every
+        sort order, with and without a category and a cursor. Writes are left
+        out: running them would take the write lock.
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+        """
+        with bypass_caches():
+            ProductsTable.get_version()
+            ProductsTable.get_by_id(0)
+            ProductsTable.get_by_name("")
+            ProductsTable.get_by_code("")
+            ProductsTable.get_many([0], [""])
+            ProductsTable.search("warmup", limit=1)
+            for sort, (column, _) in SORTS.items():
+                after = 0 if column == "ProductID" else ProductsTable.encode_cursor(
+                    "" if column == "ProductName" else 0, 0
+                )
+                for category_id in (None, 0):
+                    ProductsTable.query(category_id=category_id, sort=sort, limit=1)
+                    ProductsTable.query(category_id=category_id, sort=sort, after=after, limit=1)
+
+    @staticmethod
+    def invalidate_cache(*products):
+        """Drops the cached lookups that the given products may have changed.
+
+        Args:
+            products (dict): the products before and/or after a write; each
+                must map "ProductID", "ProductName" and "ProductCode"
+        """
+        keys = [("all",)]
+        for product in products:
+            keys.append(("id", product["ProductID"]))
+            keys.append(("name", product["ProductName"]))
+            keys.append(("code", product["ProductCode"]))
+        products_cache.invalidate(*keys)
+        forget_table_versions()
+        invalidate_snapshots()
+        notify_change_feeds()
+
+    @staticmethod
+    def validate(product_data):
+        """Checks the fields of a product without touching the database.
+
+        Args:
+            product_data (dict): the data of the product to be written
+
+        Returns:
+            str: an error message; None if the product data is valid
+        """
+        if not isinstance(product_data, dict):
+            return "Product data is not an object."
+
+        ## Validation for product_name field
+        if "product_name" not in product_data or not product_data["product_name"]:
+            return "Product name is missing or empty."
+        if not isinstance(product_data["product_name"], str):
+            return "Product name is not a string."
+
+        ## Validation for product_code field
+        if "product_code" not in product_data:
+            return "Product code is missing."
+        if not isinstance(product_data["product_code"], str):
+            return "Product code is not a string."
+        if len(product_data["product_code"]) == 0:
+            return "Product code is empty."
+
+        ## Validation for category_id field
+        if "category_id" not in product_data:
+            return "Category id is missing."
+        category_id = product_data["category_id"]
+        if not isinstance(category_id, int) or isinstance(category_id, bool):
+            return "Category id is not an integer."
+        if category_id <= 0:
+            return "Category id is empty."
+
+        ## Validation for price field
+        if "price" not in product_data:
+            return "Price is missing."
+        price = product_data["price"]
+        if not isinstance(price, (int, float)) or isinstance(price, bool):
+            return "Price is not a number."
+        if price <= 0:
+            return "Price is empty."
+
+        return None
+
+    @staticmethod
+    @group_commit
     def insert(product_data):
         """Inserts the specified product into the products table.
 
@@ -106,57 +675,139 @@ class ProductsTable:
                     True; an error message if success is False
                 product (dict): the inserted product; None if success is False
         """
-        ## Validation for product_name field
-        if "product_name" not in product_data or not product_data["product_name"]:
-            return False, "Product name is missing or empty.", None
+        message = ProductsTable.validate(product_data)
+        if message is not None:
+            return False, message, None
 
         product_name = product_data["product_name"]
+        product_code = product_data["product_code"]
+        category_id = product_data["category_id"]
+        price = product_data["price"]
 
-        product = ProductsTable.get_by_name(product_name)
-        if product is not None:
-            return False, "Product name exists already.", None
+        db = get_db()
+        query = """
+            INSERT INTO PRODUCTS (ProductName, ProductCode, CategoryID, Price)
+                SELECT ?, ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM PRODUCTS WHERE ProductName = ?)
+            ON CONFLICT (ProductCode) DO NOTHING
+        """ + RETURNING
+        data = [product_name, product_code, category_id, price, product_name]
+        with transaction(db):
+            product = db.execute(query, data).fetchone()
+            if product is None:
+                query = "SELECT 1 FROM PRODUCTS WHERE ProductName = ?"
+                if db.execute(query, [product_name]).fetchone() is not None:
+                    return False, "Product name exists already.", None
+                return False, "Product code exists already.", None
+            product = dict(product)
+            after_commit(lambda: ProductsTable.invalidate_cache(product), db)
+        return True, "The product has been inserted.", product
 
-        ## Validation for product_code field
-        if "product_code" not in product_data:
-            return False, "Product code is missing.", None
+    @staticmethod
+    def insert_many(products_data, chunk_size=INSERT_CHUNK_SIZE):
+        """Inserts many products, one transaction per chunk of rows.
 
-        product_code = product_data["product_code"]
-        if len(product_code) == 0:
-            return False, "Product code is empty.", None
+        Every product is validated in memory first. Each chunk then takes the
+        write lock, checks the names and codes of all of its rows against the
+        table with two set-based queries, inserts the valid rows with a single
+        executemany() and commits once. A bad row is reported and skipped; it
+        never aborts the rest of the batch.
 
-        product = ProductsTable.get_by_code(product_code)
-        if product is not None:
-            return False, "Product code exists already.", None
+        Raises:
+            sqlite3.Error: If the database operations fail
 
-        ## Validation for category_id field
-        if "category_id" not in product_data:
-            return False, "Category id is missing.", None
+        Args:
+            products_data (iterable): the data of the products to be inserted,
+                in the format accepted by insert(); may be a generator
+            chunk_size (int): the maximum number of rows per transaction
 
-        category_id = product_data["category_id"]
-        if category_id <= 0:
-            return False, "Category id is empty.", None
+        Returns:
+            tuple: (products, errors) where
+                products (list): the inserted products, in input order
+                errors (list): {"index": ..., "error": ...} for every product
+                    that has not been inserted
+        """
+        products = []
+        errors = []
+        names = set()
+        codes = set()
+        chunk = []
+        for index, product_data in enumerate(products_data):
+            message = ProductsTable.validate(product_data)
+            if message is None and product_data["product_name"] in names:
+                message = "Product name is repeated in the batch."
+            if message is None and product_data["product_code"] in codes:
+                message = "Product code is repeated in the batch."
+            if message is not None:
+                errors.append({"index": index, "error": message})
+                continue
+            names.add(product_data["product_name"])
+            codes.add(product_data["product_code"])
+            chunk.append((index, product_data))
+            if len(chunk) == chunk_size:
+                ProductsTable.insert_chunk(chunk, products, errors)
+                chunk = []
+        if chunk:
+            ProductsTable.insert_chunk(chunk, products, errors)
+        errors.sort(key=lambda error: error["index"])
+        return products, errors
 
-        ## Validation for price field
-        if "price" not in product_data:
-            return False, "Price is missing.", None
+    @staticmethod
+    @group_commit
+    def insert_chunk(chunk, products, errors):
+        """Inserts one chunk of validated products in a single transaction.
 
-        price = product_data["price"]
-        if price <= 0:
-            return False, "Price is empty.", None
+        Raises:
+            sqlite3.Error: If the database operations fail
 
+        Args:
+            chunk (list): (index, product_data) pairs, already validated
+            products (list): the inserted products are appended to it
+            errors (list): the rejected products are appended to it
+        """
         db = get_db()
-        query = """
-            INSERT INTO PRODUCTS (ProductName, ProductCode, CategoryID, Price) 
-                VALUES (?,?,?,?)
-        """
-        data = [product_name, product_code, category_id, price]
-        db.execute(query, data)
-        db.commit()
-        last_id = db.execute("SELECT LAST_INSERT_ROWID()").fetchone()[0]
-        product = ProductsTable.get_by_id(last_id)
-        return True, "The product has been inserted.", product
+        with transaction(db):
+            names = [product_data["product_name"] for _, product_data in chunk]
+            codes = [product_data["product_code"] for _, product_data in chunk]
+            marks = ",".join("?" * len(chunk))
+            query = f"SELECT ProductName FROM PRODUCTS WHERE ProductName IN ({marks})"
+            taken_names = {row[0] for row in db.execute(query, names)}
+            query = f"SELECT ProductCode FROM PRODUCTS WHERE ProductCode IN ({marks})"
+            taken_codes = {row[0] for row in db.execute(query, codes)}
+
+            rows = []
+            for index, product_data in chunk:
+                if product_data["product_name"] in taken_names:
+                    errors.append({"index": index, "error": "Product name exists already."})
+                elif product_data["product_code"] in taken_codes:
+                    errors.append({"index": index, "error": "Product code exists already."})
+                else:
+                    rows.append(product_data)
+            query = """
+                INSERT INTO PRODUCTS (ProductName, ProductCode, CategoryID, Price)
+                    VALUES (?,?,?,?)
+            """
+            data = [
+                (
+                    product_data["product_name"],
+                    product_data["product_code"],
+                    product_data["category_id"],
+                    product_data["price"],
+                )
+                for product_data in rows
+            ]
+            db.executemany(query, data)
+
+            codes = [product_data["product_code"] for product_data in rows]
+            marks = ",".join("?" * len(codes))
+            query = f"SELECT * FROM PRODUCTS WHERE ProductCode IN ({marks})"
+            inserted = {row["ProductCode"]: dict(row) for row in db.execute(query, codes)}
+            inserted = [inserted[code] for code in codes]
+            after_commit(lambda: ProductsTable.invalidate_cache(*inserted), db)
+        products.extend(inserted)
 
     @staticmethod
+    @group_commit
     def delete(product_id):
         """Deletes the row with the given id from the products table.
 
@@ -173,18 +824,19 @@ class ProductsTable:
                 product (dict): the product with the specified identifier
                     product_id; None if no such product exists
         """
-        product = ProductsTable.get_by_id(product_id)
-        if product is None:
-            return False, "Product not found.", None
-
         db = get_db()
-        query = "DELETE FROM PRODUCTS WHERE ProductID = ?"
+        query = "DELETE FROM PRODUCTS WHERE ProductID = ? " + RETURNING
         data = [product_id]
-        db.execute(query, data)
-        db.commit()
+        with transaction(db):
+            product = db.execute(query, data).fetchone()
+            if product is None:
+                return False, "Product not found.", None
+            product = dict(product)
+            after_commit(lambda: ProductsTable.invalidate_cache(product), db)
         return True, "The product has been deleted.", product
 
     @staticmethod
+    @group_commit
     def update(product_id, product_data):
         """Updates the row with the given id from the products table or creates a new one if it doesn't exist.
 
@@ -201,29 +853,33 @@ class ProductsTable:
                 product (dict): the product with the specified identifier
                     product_id; None if no such product exists
         """
-        db = get_db()
+        message = ProductsTable.validate(product_data)
+        if message is not None:
+            return False, message, None
 
-        product = ProductsTable.get_by_id(product_id)
-        if product is None:
-            return False, "Product code doesn't exist.", None
-
-        else:
-            product = ProductsTable.get_by_id(product_id)
-            data = [
-                product_data["product_name"],
-                product_data["product_code"],
-                product_data["category_id"],
-                product_data["price"],
-                product_id,
-            ]
+        db = get_db()
+        data = [
+            product_data["product_name"],
+            product_data["product_code"],
+            product_data["category_id"],
+            product_data["price"],
+            product_id,
+        ]
+        with transaction(db):
+            query = "SELECT * FROM PRODUCTS WHERE ProductID = ?"
+            old_product = db.execute(query, [product_id]).fetchone()
+            if old_product is None:
+                return False, "Product code doesn't exist.", None
             query = """
-                UPDATE PRODUCTS
+                UPDATE OR IGNORE PRODUCTS
                 SET ProductName = ?, ProductCode = ?, CategoryID = ?, Price = ?
                 WHERE ProductID = ?
-
-            """
-            db.execute(query, data)
-            db.commit()
-            product = ProductsTable.get_by_id(product_id)
-
-            return True, "The product has been updated.", product
+            """ + RETURNING
+            product = db.execute(query, data).fetchone()
+            if product is None:
+                return False, "Product code exists already.", None
+            product = dict(product)
+            after_commit(
+                lambda: ProductsTable.invalidate_cache(dict(old_product), product), db
+            )
+        return True, "The product has been updated.", product
@@ -0,0 +1,287 @@
+import bisect
+import collections
+import os
+import threading
+import time
+from flask import current_app, has_app_context
+
+from model.database import database_path, get_pool
+
+
+CATALOG_SNAPSHOT_CHECK_INTERVAL = 1.0
+
+
+class CatalogSnapshot:
+    """An immutable in-memory copy of the catalog, as of one transaction.
+
+    Rows are named tuples indexed by id, by name and (for products) by code.
+    Products are also kept in id order, per category and overall, so id
+    ordered pages are a bisection. The bodies of the full GET /category and
+    GET /product listings are encoded once, when the snapshot is built.
+
+    Attributes:
+        generation (int): the invalidation counter the snapshot was built at
+        data_version (int): the PRAGMA data_version it was built at
+        versions (dict): (version, modified_at) per table name, as stored in
+            TABLE_VERSIONS
+        categories_json (bytes): the body of the full GET /category listing
+        products_json (bytes): the body of the full GET /product listing
+    """
+
+    def __init__(self, generation, data_version, versions, categories, products, encode_rows):
+        category_columns, category_rows = categories
+        product_columns, product_rows = products
+        self.generation = generation
+        self.data_version = data_version
+        self.versions = versions
+        self.built_at = time.time()
+
+        self.categories = category_rows
+        self.categories_by_id = {row.CategoryID: row for row in category_rows}
+        self.categories_by_name = {row.CategoryName: row for row in category_rows}
+        self.category_ids = [row.CategoryID for row in category_rows]
+
+        self.products = product_rows
+        self.products_by_id = {row.ProductID: row for row in product_rows}
+        self.products_by_name = {row.ProductName: row for row in product_rows}
+        self.products_by_code = {row.ProductCode: row for row in product_rows}
+        self.product_ids = [row.ProductID for row in product_rows]
+        by_category = collections.defaultdict(list)
+        for row in product_rows:
+            by_category[row.CategoryID].append(row)
+        self.products_by_category = {
+            category_id: (rows, [row.ProductID for row in rows])
+            for category_id, rows in by_category.items()
+        }
+
+        self.categories_json = (
+            b'{"categories":' + encode_rows(category_columns, category_rows) + b"}\n"
+        )
+        self.products_json = b'{"products":' + encode_rows(product_columns, product_rows) + b"}\n"
+
+    @staticmethod
+    def as_dict(row):
+        """Copies a snapshot row into a new dictionary; None stays None."""
+        return None if row is None else row._asdict()
+
+    def category_page(self, after, limit):
+        """Gets a page of categories in id order, like CategoriesTable.get_page()."""
+        start = bisect.bisect_right(self.category_ids, after)
+        rows = self.categories[start:start + limit + 1]
+        return self._page(rows, limit, "CategoryID")
+
+    def product_page(self, category_id, descending, after, limit):
+        """Gets a page of products in id order, like ProductsTable.query().
+
+        Args:
+            category_id (int): only products of this category; None for all
+            descending (bool): True for the "-id" sort
+            after (int): the last id of the previous page; None for the first
+            limit (int): the maximum number of rows to return
+
+        Returns:
+            tuple: (products, next) as returned by ProductsTable.query()
+        """
+        if category_id is None:
+            rows, ids = self.products, self.product_ids
+        else:
+            rows, ids = self.products_by_category.get(category_id, ((), []))
+        if descending:
+            end = len(ids) if after is None else bisect.bisect_left(ids, after)
+            rows = rows[max(end - limit - 1, 0):end][::-1]
+        else:
+            start = 0 if after is None else bisect.bisect_right(ids, after)
+            rows = rows[start:start + limit + 1]
+        return self._page(rows, limit, "ProductID")
+
+    def stats(self):
+        """Returns the size of the snapshot.
+
+        Returns:
+            dict: the generation and data version it was built at, its row
+                counts and the sizes of its encoded listings
+        """
+        return {
+            "generation": self.generation,
+            "data_version": self.data_version,
+            "categories": len(self.categories),
+            "products": len(self.products),
+            "categories_json_bytes": len(self.categories_json),
+            "products_json_bytes": len(self.products_json),
+            "built_at": self.built_at,
+        }
+
+    @staticmethod
+    def _page(rows, limit, key):
+        rows = [row._asdict() for row in rows]
+        next_after = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_after = rows[-1][key]
+        return rows, next_after
+
+
+class SnapshotManager:
+    """Builds catalog snapshots and swaps them in when they go stale.
+
+    A snapshot goes stale when invalidate() is called, which the tables do
+    after every committed write, and when another connection (another
+    process, or a tool like the sqlite3 shell) commits to the database. The
+    latter is seen through PRAGMA data_version, checked at most every
+    `check_interval` seconds, so in between readers run no SQL at all.
+
+    The first reader to find the snapshot stale builds a new one in a single
+    read transaction on the manager's own connection, while the other
+    readers wait for it; the new snapshot replaces the old one in one
+    assignment.
+    """
+
+    def __init__(self, database, encode_rows, check_interval=CATALOG_SNAPSHOT_CHECK_INTERVAL):
+        self.database = database
+        self.encode_rows = encode_rows
+        self.check_interval = check_interval
+        self.pid = os.getpid()
+        self._db = get_pool(readonly=True).connect()
+        self._snapshot = None
+        self._generation = 0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._builds = 0
+        self._external_changes = 0
+        self._build_seconds = 0.0
+
+    def invalidate(self):
+        """Marks the current snapshot as stale."""
+        with self._lock:
+            self._generation += 1
+
+    def get(self):
+        """Returns an up to date snapshot, building a new one if needed.
+
+        Raises:
+            sqlite3.Error: if a new snapshot can't be read
+
+        Returns:
+            CatalogSnapshot: the snapshot
+        """
+        snapshot = self._snapshot
+        if (
+            snapshot is not None
+            and snapshot.generation == self._generation
+            and time.monotonic() - self._checked_at < self.check_interval
+        ):
+            return snapshot
+        with self._build_lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.generation == self._generation:
+                data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+                self._checked_at = time.monotonic()
+                if data_version == snapshot.data_version:
+                    return snapshot
+                self._external_changes += 1
+            self._snapshot = snapshot = self._build()
+            self._checked_at = time.monotonic()
+            return snapshot
+
+    def stats(self):
+        """Returns the manager metrics.
+
+        Returns:
+            dict: the stats() of the current snapshot and the build, external
+                change and build time counters
+        """
+        snapshot = self._snapshot
+        stats = snapshot.stats() if snapshot is not None else {}
+        stats.update(
+            {
+                "builds": self._builds,
+                "external_changes": self._external_changes,
+                "build_seconds": round(self._build_seconds, 6),
+                "stale": snapshot is None or snapshot.generation != self._generation,
+            }
+        )
+        return stats
+
+    def _build(self):
+        start = time.perf_counter()
+        with self._lock:
+            generation = self._generation
+        db = self._db
+        db.execute("BEGIN")
+        try:
+            data_version = db.execute("PRAGMA data_version").fetchone()[0]
+            versions = {
+                row[0]: (row[1], row[2])
+                for row in db.execute("SELECT TableName, Version, ModifiedAt FROM TABLE_VERSIONS")
+            }
+            categories = self._read(db, "Category", "SELECT * FROM CATEGORIES ORDER BY CategoryID")
+            products = self._read(db, "Product", "SELECT * FROM PRODUCTS ORDER BY ProductID")
+        finally:
+            db.rollback()
+        snapshot = CatalogSnapshot(
+            generation, data_version, versions, categories, products, self.encode_rows
+        )
+        self._builds += 1
+        self._build_seconds += time.perf_counter() - start
+        return snapshot
+
+    @staticmethod
+    def _read(db, name, query):
+        result = db.execute(query)
+        result.row_factory = None
+        columns = [column[0] for column in result.description]
+        row_class = collections.namedtuple(name, columns)
+        return columns, tuple(map(row_class._make, result.fetchall()))
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_snapshot_manager():
+    """Returns the snapshot manager of the configured database.
+
+    The manager is created on first use when CATALOG_SNAPSHOT is on, with
+    CATALOG_SNAPSHOT_CHECK_INTERVAL from the current app. A forked process
+    never reuses its parent's manager.
+
+    Returns:
+        SnapshotManager: the manager; None if the snapshot is off or there is
+            no app context
+    """
+    if not has_app_context() or not current_app.config.get("CATALOG_SNAPSHOT", False):
+        return None
+    database = database_path()
+    manager = _managers.get(database)
+    if manager is None or manager.pid != os.getpid():
+        with _managers_lock:
+            manager = _managers.get(database)
+            if manager is None or manager.pid != os.getpid():
+                manager = _managers[database] = SnapshotManager(
+                    database,
+                    current_app.json.encode_rows,
+                    current_app.config.get(
+                        "CATALOG_SNAPSHOT_CHECK_INTERVAL", CATALOG_SNAPSHOT_CHECK_INTERVAL
+                    ),
+                )
+    return manager
+
+
+def get_snapshot():
+    """Returns the current catalog snapshot.
+
+    Raises:
+        sqlite3.Error: if a new snapshot can't be read
+
+    Returns:
+        CatalogSnapshot: the snapshot; None if CATALOG_SNAPSHOT is off
+    """
+    manager = get_snapshot_manager()
+    return None if manager is None else manager.get()
+
+
+def invalidate_snapshots():
+    """Marks the snapshots of every database of this process as stale."""
+    for manager in list(_managers.values()):
+        manager.invalidate()
@@ -0,0 +1,241 @@
+import atexit
+import functools
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from flask import current_app, g, has_app_context
+
+from model.database import database_path, get_pool, transaction
+
+
+GROUP_COMMIT_DELAY_MS = 2.0
+GROUP_COMMIT_MAX_BATCH = 64
+
+
+class GroupCommitWriter:
+    """A writer thread that commits the mutations of many requests together.
+
+    Mutations are queued with submit(). The writer takes the first queued
+    mutation, gathers more for up to `max_delay` seconds or until it holds
+    `max_batch` of them, and runs the whole batch in one transaction on its
+    own connection. Each mutation runs in a savepoint, so one that raises is
+    rolled back alone and gets its own exception; the others still commit.
+    Results are handed back only once the batch has committed.
+
+    Attributes:
+        observer: an object with an observe(batch_size, latencies) method,
+            told about every committed batch; None to stop observing
+    """
+
+    observer = None
+
+    def __init__(self, app, max_delay, max_batch):
+        self.app = app
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.pid = os.getpid()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._operations = 0
+        self._errors = 0
+        self._failed_commits = 0
+        self._last_batch_size = 0
+        self._max_batch_size = 0
+        self._thread = threading.Thread(target=self._run, name="bakery-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, func, args=(), kwargs=None):
+        """Queues a mutation for the next batch.
+
+        Args:
+            func (callable): the mutation; it runs in an app context whose
+                get_db() is the writer's connection
+            args (tuple): its positional arguments
+            kwargs (dict): its keyword arguments
+
+        Returns:
+            concurrent.futures.Future: resolves to the return value of func,
+                or to its exception, once the batch has committed
+        """
+        future = Future()
+        self._queue.put((func, args, kwargs or {}, future, time.perf_counter()))
+        return future
+
+    def is_writer_thread(self):
+        """Tells whether the caller runs on the writer thread."""
+        return threading.current_thread() is self._thread
+
+    def close(self):
+        """Commits the queued mutations and stops the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        """Returns the writer metrics.
+
+        Returns:
+            dict: the configured delay and batch size, the current queue
+                depth, the sizes of the last and largest batches and the
+                batch/operation/error counters
+        """
+        with self._lock:
+            return {
+                "max_delay": self.max_delay,
+                "max_batch": self.max_batch,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "operations": self._operations,
+                "errors": self._errors,
+                "failed_commits": self._failed_commits,
+                "last_batch_size": self._last_batch_size,
+                "max_batch_size": self._max_batch_size,
+            }
+
+    def _run(self):
+        with self.app.app_context():
+            db = get_pool().connect()
+        while True:
+            batch, closing = self._gather()
+            if batch:
+                self._commit(db, batch)
+            if closing:
+                db.close()
+                return
+
+    def _gather(self):
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit(self, db, batch):
+        outcomes = []
+        with self.app.app_context():
+            g._database = db
+            try:
+                with transaction(db):
+                    for func, args, kwargs, _, _ in batch:
+                        try:
+                            with transaction(db):
+                                outcomes.append((func(*args, **kwargs), None))
+                        except Exception as error:
+                            outcomes.append((None, error))
+            except Exception as error:
+                if db.in_transaction:
+                    db.rollback()
+                db.after_commit_callbacks.clear()
+                outcomes = [(None, error)] * len(batch)
+                with self._lock:
+                    self._failed_commits += 1
+            finally:
+                g.pop("_database", None)
+
+        committed = time.perf_counter()
+        errors = 0
+        for (_, _, _, future, queued_at), (result, error) in zip(batch, outcomes):
+            if error is None:
+                future.set_result(result)
+            else:
+                errors += 1
+                future.set_exception(error)
+        with self._lock:
+            self._batches += 1
+            self._operations += len(batch)
+            self._errors += errors
+            self._last_batch_size = len(batch)
+            self._max_batch_size = max(self._max_batch_size, len(batch))
+        observer = GroupCommitWriter.observer
+        if observer is not None:
+            observer.observe(len(batch), [committed - item[4] for item in batch])
+
+
+def set_batch_observer(observer):
+    """Sets the object told about every batch committed by a writer.
+
+    Args:
+        observer: an object with an observe(batch_size, latencies) method;
+            None to stop observing
+    """
+    GroupCommitWriter.observer = observer
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer():
+    """Returns the group commit writer of the configured database.
+
+    The writer is started on first use when DATABASE_GROUP_COMMIT is on,
+    with DATABASE_GROUP_COMMIT_DELAY_MS and DATABASE_GROUP_COMMIT_MAX_BATCH
+    from the current app. A forked process never reuses its parent's writer.
+
+    Returns:
+        GroupCommitWriter: the writer; None if group commit is off or there
+            is no app context
+    """
+    if not has_app_context() or not current_app.config.get("DATABASE_GROUP_COMMIT", False):
+        return None
+    config = current_app.config
+    database = database_path()
+    writer = _writers.get(database)
+    if writer is None or writer.pid != os.getpid():
+        with _writers_lock:
+            writer = _writers.get(database)
+            if writer is None or writer.pid != os.getpid():
+                writer = _writers[database] = GroupCommitWriter(
+                    current_app._get_current_object(),
+                    max_delay=config.get("DATABASE_GROUP_COMMIT_DELAY_MS", GROUP_COMMIT_DELAY_MS) / 1000,
+                    max_batch=config.get("DATABASE_GROUP_COMMIT_MAX_BATCH", GROUP_COMMIT_MAX_BATCH),
+                )
+                atexit.register(writer.close)
+    return writer
+
+
+def group_commit(func):
+    """Routes a mutation through the group commit writer when it is enabled.
+
+    The mutation runs directly when group commit is off, on the writer thread
+    itself, and inside a transaction that the caller opened on its own
+    connection, which must stay atomic.
+
+    Raises:
+        sqlite3.Error: If the database operations fail
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        writer = get_writer()
+        if writer is None or writer.is_writer_thread() or _in_transaction():
+            return func(*args, **kwargs)
+        return writer.submit(func, args, kwargs).result()
+
+    return wrapper
+
+
+def _in_transaction():
+    db = g.get("_database")
+    try:
+        return db is not None and db.in_transaction
+    except sqlite3.ProgrammingError:
+        return False
@@ -0,0 +1,300 @@
+"""Preforking multi-process launcher for the bakery API.
+
+    python app/prefork.py [--workers N] [--threads/--no-threads] [--host 127.0.0.1]
+        [--port 8000] [--max-requests 10000] [--warm-up/--no-warm-up]
+        [--preload/--no-preload]
+
+The master process binds the listening socket, then forks --workers worker
+processes (one per core by default) that share it; the kernel hands each
+new connection to whichever worker accepts it first. The master never
+imports the app: every worker imports it after the fork, so workers share
+nothing but the database file. The master only preloads the third-party
+libraries of PRELOAD_MODULES, so that a new worker inherits them already
+imported and only imports the app's own modules. Each one opens its own connection pools,
+caches, snapshot and group commit writer, and SQLite's WAL mode (set once
+by the first pool) lets the readers of every worker run while one of them
+writes.
+
+A worker runs the app's warm-up (see warmup.py) before it accepts its first
+connection, and tells the master once it is ready.
+
+Signals sent to the master:
+    SIGHUP: graceful reload. A new generation of workers is started; once
+        it is ready, the old workers stop accepting, finish their in-flight
+        requests and exit. New app code is picked up, since workers import
+        it; upgraded preloaded libraries need a restart of the master.
+    SIGTERM, SIGINT: graceful shutdown of every worker, then of the master.
+
+A worker exits after --max-requests requests (plus up to 10% of random
+jitter, so workers don't all recycle together) and the master replaces it;
+0 turns recycling off. A worker that dies is replaced too.
+"""
+import argparse
+import importlib
+import itertools
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+
+PREFORK_MAX_REQUESTS = 10_000
+PREFORK_GRACEFUL_TIMEOUT = 30.0
+RESPAWN_DELAY = 1.0
+# Optional ones that are not installed are skipped.
+PRELOAD_MODULES = ("flask", "flask_cors", "werkzeug.serving", "orjson", "brotli")
+
+
+class Worker:
+    """The master's view of one worker process.
+
+    Attributes:
+        pid (int): the process id
+        generation (int): the reload generation the worker belongs to
+        ready_fd (int): the read end of the pipe the worker writes to once
+            it is warm; None once it has reported
+        ready (bool): True once it has reported that it is warm
+        stopping (bool): True once it has been asked to stop
+        stop_deadline (float): the monotonic time it is killed at if it has
+            not exited by then
+    """
+
+    def __init__(self, pid, generation, ready_fd):
+        self.pid = pid
+        self.generation = generation
+        self.ready_fd = ready_fd
+        self.ready = False
+        self.stopping = False
+        self.stop_deadline = None
+
+
+def serve_worker(listener, ready_fd, args):
+    """Runs one worker: imports the app, warms it up and serves until told to stop.
+
+    Args:
+        listener (socket.socket): the listening socket inherited from the master
+        ready_fd (int): the write end of the ready pipe
+        args (argparse.Namespace): the launcher options
+    """
+    from werkzeug.serving import make_server
+
+    # The app reads its config from the environment when it is imported.
+    os.environ["BAKERY_WARM_UP"] = "true" if args.warm_up else "false"
+    from app import app
+
+    # The random state was inherited from the master: reseed it so that
+    # workers don't all draw the same jitter.
+    random.seed()
+    limit = args.max_requests + random.randint(0, args.max_requests // 10)
+    served = itertools.count(1)
+    server = None
+
+    def stop(*_):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def counted(environ, start_response):
+        if next(served) == limit and args.max_requests:
+            stop()
+        return app(environ, start_response)
+
+    server = make_server(
+        args.host, args.port, counted, threaded=args.threads, fd=listener.fileno()
+    )
+    # Let server_close() wait for in-flight requests instead of dropping them.
+    server.daemon_threads = False
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    os.write(ready_fd, b"1")
+    os.close(ready_fd)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class Master:
+    """Forks, watches and replaces the workers; see the module docstring."""
+
+    def __init__(self, listener, args):
+        self.listener = listener
+        self.args = args
+        self.workers = {}
+        self.generation = 0
+        self.reloading = False
+        self.stopping = False
+        self._signals = []
+        self._respawn_at = 0.0
+
+    def run(self):
+        """Serves until SIGTERM or SIGINT, then stops every worker."""
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+        self.spawn_generation()
+        while not self.stopping or self.workers:
+            self.handle_signals()
+            self.reap()
+            self.wait_ready(0.2)
+            if self.reloading and self.generation_ready():
+                self.stop_workers(lambda worker: worker.generation < self.generation)
+                self.reloading = False
+            if not self.stopping:
+                self.replace_missing()
+
+    def spawn(self):
+        """Forks one worker of the current generation."""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            os.close(read_fd)
+            code = 0
+            try:
+                serve_worker(self.listener, write_fd, self.args)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        self.workers[pid] = Worker(pid, self.generation, read_fd)
+
+    def spawn_generation(self):
+        """Starts a full set of workers of a new generation."""
+        self.generation += 1
+        for _ in range(self.args.workers):
+            self.spawn()
+
+    def handle_signals(self):
+        while self._signals:
+            signum = self._signals.pop(0)
+            if signum == signal.SIGHUP and not self.stopping:
+                print("prefork: reloading workers", file=sys.stderr)
+                self.reloading = True
+                self.spawn_generation()
+            elif signum in (signal.SIGTERM, signal.SIGINT) and not self.stopping:
+                print("prefork: shutting down", file=sys.stderr)
+                self.stopping = True
+                self.stop_workers(lambda worker: True)
+
+    def stop_workers(self, selected):
+        """Asks the selected workers to finish their requests and exit."""
+        for worker in self.workers.values():
+            if selected(worker) and not worker.stopping:
+                worker.stopping = True
+                worker.stop_deadline = time.monotonic() + self.args.graceful_timeout
+                self._kill(worker.pid, signal.SIGTERM)
+
+    def reap(self):
+        """Forgets the workers that exited, killing those past their graceful timeout."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            worker = self.workers.pop(pid, None)
+            if worker is not None and worker.ready_fd is not None:
+                os.close(worker.ready_fd)
+            if worker is not None and not worker.stopping and os.waitstatus_to_exitcode(status):
+                print(f"prefork: worker {pid} died", file=sys.stderr)
+                # Don't fork in a tight loop if workers die as they start.
+                self._respawn_at = time.monotonic() + RESPAWN_DELAY
+        now = time.monotonic()
+        for worker in self.workers.values():
+            if worker.stopping and now > worker.stop_deadline:
+                self._kill(worker.pid, signal.SIGKILL)
+
+    def wait_ready(self, timeout):
+        """Waits up to timeout seconds for workers to report that they are warm."""
+        waiting = {
+            worker.ready_fd: worker for worker in self.workers.values() if worker.ready_fd is not None
+        }
+        if not waiting:
+            time.sleep(timeout)
+            return
+        try:
+            readable, _, _ = select.select(list(waiting), [], [], timeout)
+        except InterruptedError:
+            return
+        for fd in readable:
+            worker = waiting[fd]
+            worker.ready = os.read(fd, 1) == b"1"
+            os.close(fd)
+            worker.ready_fd = None
+
+    def generation_ready(self):
+        current = [w for w in self.workers.values() if w.generation == self.generation]
+        return len(current) >= self.args.workers and all(w.ready for w in current)
+
+    def replace_missing(self):
+        """Forks replacements for the workers of the current generation that exited."""
+        if time.monotonic() < self._respawn_at:
+            return
+        current = [
+            w for w in self.workers.values() if w.generation == self.generation and not w.stopping
+        ]
+        for _ in range(self.args.workers - len(current)):
+            self.spawn()
+
+    @staticmethod
+    def _kill(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def preload(modules):
+    """Imports modules in the master, for every worker to inherit."""
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", action=argparse.BooleanOptionalAction, default=True,
+                        help="handle each connection of a worker on a thread of its own")
+    parser.add_argument("--max-requests", type=int, default=PREFORK_MAX_REQUESTS,
+                        help="recycle a worker after this many requests; 0 to never recycle")
+    parser.add_argument("--graceful-timeout", type=float, default=PREFORK_GRACEFUL_TIMEOUT,
+                        help="seconds a stopping worker may take to finish its requests")
+    parser.add_argument("--warm-up", action=argparse.BooleanOptionalAction, default=True,
+                        help="warm each worker's connections and caches before it accepts traffic")
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction, default=True,
+                        help="import the third-party libraries once in the master, before forking")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.preload:
+        preload(PRELOAD_MODULES)
+    listener = socket.create_server((args.host, args.port), backlog=1024)
+    listener.set_inheritable(True)
+    print(
+        f"prefork: serving on http://{args.host}:{args.port} with {args.workers} workers",
+        file=sys.stderr,
+    )
+    try:
+        Master(listener, args).run()
+    finally:
+        listener.close()
+
+
+if __name__ == "__main__":
+    main()
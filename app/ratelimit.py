@@ -0,0 +1,311 @@
+"""Per-client rate limiting and concurrency-based load shedding.
+
+Both run in a before_request hook, so a refused request never checks a
+connection out of the database pools. A client over its token bucket for a
+route gets a 429; any request arriving while RATE_LIMIT_MAX_CONCURRENCY
+requests are already in flight in this process gets a 503. Both carry a
+Retry-After header. GET /changes is exempt by default: its clients hold
+one long-lived request each, which would count against the concurrency
+limit for as long as they stay connected.
+
+Buckets live in this process by default. With RATE_LIMIT_DATABASE set to
+a file path they are kept in a small SQLite database of their own instead,
+so every worker process on the host shares the same buckets.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from flask import current_app, g, request
+
+
+RATE_LIMIT_RATE = 20.0
+RATE_LIMIT_BURST = 40
+RATE_LIMIT_MAX_CONCURRENCY = 0
+RATE_LIMIT_EXEMPT = ("/metrics", "/stats", "/changes")
+SHED_RETRY_AFTER = 1
+PRUNE_INTERVAL = 1000
+
+
+class MemoryBucketStore:
+    """Token buckets kept in a dictionary of this process."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """Takes one token from a bucket.
+
+        Args:
+            key (str): the bucket key
+            rate (float): the tokens added per second
+            burst (int): the capacity of the bucket
+            now (float): the current time, in seconds
+
+        Returns:
+            tuple: (allowed, tokens) where allowed (bool) tells whether a
+                token was taken and tokens (float) is what is left
+        """
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            return allowed, tokens
+
+    def prune(self, before):
+        """Drops the buckets last used before a given time.
+
+        Args:
+            before (float): buckets untouched since this time are dropped
+        """
+        with self._lock:
+            idle = [key for key, (_, updated_at) in self._buckets.items() if updated_at < before]
+            for key in idle:
+                del self._buckets[key]
+
+    def size(self):
+        return len(self._buckets)
+
+
+class SQLiteBucketStore:
+    """Token buckets kept in a SQLite file shared by every worker process.
+
+    Each take() is a single UPSERT in autocommit mode: the refill, the
+    decision and the new token count are computed from the old row inside
+    the statement, so two processes can never take the same token.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._local = threading.local()
+        db = self._connect()
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS RATE_LIMIT_BUCKETS (
+                BucketKey TEXT PRIMARY KEY,
+                Tokens REAL NOT NULL,
+                UpdatedAt REAL NOT NULL,
+                Allowed INTEGER NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+
+    def take(self, key, rate, burst, now):
+        """Takes one token from a bucket; see MemoryBucketStore.take().
+
+        Raises:
+            sqlite3.Error: If the database operations fail
+        """
+        db = self._connect()
+        query = """
+            INSERT INTO RATE_LIMIT_BUCKETS (BucketKey, Tokens, UpdatedAt, Allowed)
+                VALUES (:key, :burst - 1, :now, 1)
+            ON CONFLICT (BucketKey) DO UPDATE SET
+                Tokens = MIN(:burst, Tokens + MAX(0, :now - UpdatedAt) * :rate)
+                    - (MIN(:burst, Tokens + MAX(0, :now - UpdatedAt) * :rate) >= 1),
+                UpdatedAt = :now,
+                Allowed = MIN(:burst, Tokens + MAX(0, :now - UpdatedAt) * :rate) >= 1
+            RETURNING Allowed, Tokens
+        """
+        data = {"key": key, "rate": rate, "burst": burst, "now": now}
+        allowed, tokens = db.execute(query, data).fetchone()
+        return bool(allowed), tokens
+
+    def prune(self, before):
+        """Drops the buckets last used before a given time; see MemoryBucketStore.prune()."""
+        self._connect().execute("DELETE FROM RATE_LIMIT_BUCKETS WHERE UpdatedAt < ?", [before])
+
+    def size(self):
+        return self._connect().execute("SELECT COUNT(*) FROM RATE_LIMIT_BUCKETS").fetchone()[0]
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            self._local.pid = os.getpid()
+            db = self._local.db = sqlite3.connect(
+                self.database, isolation_level=None, check_same_thread=False
+            )
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = OFF")
+            db.execute("PRAGMA busy_timeout = 1000")
+        return db
+
+
+class RateLimiter:
+    """Admits or refuses requests before they reach their view.
+
+    Every (client, method, route) has its own token bucket of `burst`
+    tokens, refilled at `rate` tokens per second; RATE_LIMIT_ROUTES can give
+    a route rule its own [rate, burst]. On top of that, at most
+    `max_concurrency` requests run at once in the process (0 for no limit).
+
+    Every PRUNE_INTERVAL requests, buckets idle for longer than the slowest
+    refill are dropped: a missing bucket and a full one behave the same, so
+    the store only holds the clients active within one refill period.
+    """
+
+    def __init__(
+        self,
+        store,
+        rate=RATE_LIMIT_RATE,
+        burst=RATE_LIMIT_BURST,
+        routes=None,
+        max_concurrency=RATE_LIMIT_MAX_CONCURRENCY,
+        exempt=RATE_LIMIT_EXEMPT,
+    ):
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+        self.routes = routes or {}
+        self.max_concurrency = max_concurrency
+        self.exempt = exempt
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._allowed = 0
+        self._throttled = 0
+        self._shed = 0
+        self._store_errors = 0
+        self._throttled_by_route = {}
+        self._takes = 0
+        limits = [self.limits(route) for route in self.routes] + [self.limits(None)]
+        self.refill_seconds = max(
+            [burst / rate for rate, burst in limits if rate > 0], default=0.0
+        )
+
+    def limits(self, route):
+        """Gets the (rate, burst) of a route rule."""
+        rate, burst = self.routes.get(route, (self.rate, self.burst))
+        return float(rate), max(1, int(burst))
+
+    def acquire(self, route):
+        """Admits the current request.
+
+        Args:
+            route (str): the rule of the matched route
+
+        Returns:
+            tuple: (status, retry_after); status is None if the request may
+                proceed, and it must then call release() once it is done
+        """
+        with self._lock:
+            if self.max_concurrency and self._in_flight >= self.max_concurrency:
+                self._shed += 1
+                return 503, SHED_RETRY_AFTER
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        rate, burst = self.limits(route)
+        if rate > 0:
+            key = f"{client_address()} {request.method} {route}"
+            now = time.time()
+            with self._lock:
+                self._takes += 1
+                prune = self._takes % PRUNE_INTERVAL == 0
+            try:
+                if prune:
+                    self.store.prune(now - self.refill_seconds)
+                allowed, tokens = self.store.take(key, rate, burst, now)
+            except sqlite3.Error:
+                # Fail open: a broken limiter store must not take the API down.
+                allowed = True
+                with self._lock:
+                    self._store_errors += 1
+            if not allowed:
+                self.release()
+                with self._lock:
+                    self._throttled += 1
+                    self._throttled_by_route[route] = self._throttled_by_route.get(route, 0) + 1
+                return 429, max(1, math.ceil((1 - tokens) / rate))
+        with self._lock:
+            self._allowed += 1
+        return None, None
+
+    def release(self):
+        """Marks an admitted request as finished."""
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self):
+        """Returns the limiter metrics.
+
+        Returns:
+            dict: the configured rate, burst and concurrency limit, the
+                number of buckets, the current and peak in-flight requests,
+                the allowed/throttled/shed/store error counters and the
+                throttled requests per route
+        """
+        with self._lock:
+            stats = {
+                "rate": self.rate,
+                "burst": self.burst,
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "max_in_flight": self._max_in_flight,
+                "allowed": self._allowed,
+                "throttled": self._throttled,
+                "shed": self._shed,
+                "store_errors": self._store_errors,
+                "throttled_by_route": dict(self._throttled_by_route),
+            }
+        try:
+            stats["buckets"] = self.store.size()
+        except sqlite3.Error:
+            pass
+        return stats
+
+
+def client_address():
+    """Gets the address the current request is rate limited by.
+
+    The first X-Forwarded-For address is only trusted when
+    RATE_LIMIT_TRUST_PROXY is on, i.e. when a proxy in front of the app sets it.
+    """
+    if current_app.config.get("RATE_LIMIT_TRUST_PROXY", False) and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or ""
+
+
+def init_app(app):
+    """Installs the rate limiter on the app when RATE_LIMIT is on.
+
+    Reads RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_ROUTES (a route rule
+    to [rate, burst] mapping; a rate of 0 turns the bucket off),
+    RATE_LIMIT_MAX_CONCURRENCY, RATE_LIMIT_EXEMPT and RATE_LIMIT_DATABASE
+    from the app config. The limiter is kept in app.extensions["rate_limiter"].
+    """
+    if not app.config.get("RATE_LIMIT", False):
+        return
+    database = app.config.get("RATE_LIMIT_DATABASE")
+    limiter = RateLimiter(
+        SQLiteBucketStore(database) if database else MemoryBucketStore(),
+        rate=app.config.get("RATE_LIMIT_RATE", RATE_LIMIT_RATE),
+        burst=app.config.get("RATE_LIMIT_BURST", RATE_LIMIT_BURST),
+        routes=app.config.get("RATE_LIMIT_ROUTES"),
+        max_concurrency=app.config.get("RATE_LIMIT_MAX_CONCURRENCY", RATE_LIMIT_MAX_CONCURRENCY),
+        exempt=tuple(app.config.get("RATE_LIMIT_EXEMPT", RATE_LIMIT_EXEMPT)),
+    )
+    app.extensions["rate_limiter"] = limiter
+
+    @app.before_request
+    def limit_request():
+        if request.url_rule is None or request.url_rule.rule in limiter.exempt:
+            return None
+        status, retry_after = limiter.acquire(request.url_rule.rule)
+        if status is None:
+            g._rate_limit_admitted = True
+            return None
+        if status == 429:
+            body = {"error": "Too many requests."}
+        else:
+            body = {"error": "Server is busy."}
+        return body, status, {"Retry-After": str(retry_after)}
+
+    @app.teardown_request
+    def release_request(exception):
+        if g.pop("_rate_limit_admitted", False):
+            limiter.release()
@@ -0,0 +1,103 @@
+"""Warm-up of a new worker before it serves its first request.
+
+A freshly started process has no open connections, a cold SQLite page cache
+and empty statement caches, so its first requests run several times slower
+than steady state. With WARM_UP on, init_app() runs warm_up() once the app
+is set up: every pooled connection is opened, the catalog tables and their
+indexes are read into the page cache of each read-only connection, the read
+queries of CategoriesTable and ProductsTable are compiled on each of them,
+and, unless WARM_UP_LISTINGS is off, the full listings are loaded into the
+lookup caches (the longest step on a large catalog).
+"""
+import time
+
+from model.categories_table import CategoriesTable
+from model.database import get_pool, use_connection
+from model.products_table import ProductsTable
+
+
+WARM_UP_TABLES = ("CATEGORIES", "PRODUCTS", "CATEGORY_STATS", "TABLE_VERSIONS")
+
+
+def preload_table(db, table):
+    """Reads every page of a table and of its indexes through a connection.
+
+    The table and each index are counted with their own b-tree walk, which
+    reads each page once without building any row in Python. Partial and
+    expression indexes are skipped.
+
+    Raises:
+        sqlite3.Error: If the database operations fail
+
+    Args:
+        db (sqlite3.Connection): the connection whose page cache is filled
+        table (str): the name of the table
+
+    Returns:
+        int: the number of b-trees walked
+    """
+    db.execute(f'SELECT COUNT(*) FROM "{table}" NOT INDEXED').fetchone()
+    walked = 1
+    for index in db.execute(f'PRAGMA index_list("{table}")').fetchall():
+        name, partial = index[1], index[4]
+        column = db.execute(f'PRAGMA index_info("{name}")').fetchone()[2]
+        if partial or column is None:
+            continue
+        query = f'SELECT COUNT(*) FROM "{table}" INDEXED BY "{name}" WHERE "{column}" IS NOT NULL'
+        db.execute(query).fetchone()
+        walked += 1
+    return walked
+
+
+def warm_up(app):
+    """Opens the pooled connections of the app and fills its caches.
+
+    Raises:
+        sqlite3.Error: If the database operations fail
+
+    Args:
+        app (flask.Flask): the app; WARM_UP_TABLES in its config lists the
+            tables to preload and WARM_UP_LISTINGS turns off the loading of
+            the full listings
+
+    Returns:
+        dict: what was warmed: the number of connections, the number of
+            table and index b-trees read per read-only connection, and the
+            time spent in seconds
+    """
+    start = time.perf_counter()
+    tables = app.config.get("WARM_UP_TABLES", WARM_UP_TABLES)
+    stats = {"connections": 0, "btrees": 0}
+    with app.test_request_context("/", method="GET"):
+        for readonly in (False, True):
+            pool = get_pool(readonly)
+            connections = [pool.checkout() for _ in range(pool.size)]
+            try:
+                stats["connections"] += len(connections)
+                if readonly:
+                    for db in connections:
+                        stats["btrees"] = sum(preload_table(db, table) for table in tables)
+                        with use_connection(db):
+                            CategoriesTable.prime_statements()
+                            ProductsTable.prime_statements()
+            finally:
+                for db in connections:
+                    pool.checkin(db)
+        if app.config.get("WARM_UP_LISTINGS", True):
+            CategoriesTable.get()
+            ProductsTable.get()
+    stats["seconds"] = round(time.perf_counter() - start, 6)
+    return stats
+
+
+def init_app(app):
+    """Warms the app up when WARM_UP is on (off by default).
+
+    Call it once the routes are registered and the migrations applied. The
+    result of warm_up() is kept in app.extensions["warm_up"].
+
+    Raises:
+        sqlite3.Error: If the database operations fail
+    """
+    if app.config.get("WARM_UP", False):
+        app.extensions["warm_up"] = warm_up(app)
@@ -0,0 +1,7 @@
+"""Benchmarks for the bakery API.
+
+Every benchmark runs against a scratch copy of bakery.db, never the database
+checked into the repository. Run them from the repository root, e.g.:
+
+    python -m benchmarks.wal
+"""
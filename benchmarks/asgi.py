@@ -0,0 +1,124 @@
+"""Load test of the WSGI and ASGI serving paths.
+
+Starts the app on a local port, once behind Werkzeug's threaded WSGI server
+and once behind uvicorn with asgi.py, and drives both with the same number of
+concurrent HTTP clients. Requires uvicorn for the ASGI run.
+
+    python -m benchmarks.asgi [--clients 32] [--seconds 5] [--path /product?limit=50]
+"""
+import argparse
+import http.client
+import logging
+import multiprocessing
+import socket
+import statistics
+import threading
+import time
+
+from benchmarks.common import APP_DIR, load_app, print_report, scratch_database
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(server, database, port):
+    app = load_app(DATABASE=database)
+    if server == "wsgi":
+        from werkzeug.serving import make_server
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+    else:
+        import uvicorn
+
+        uvicorn.run("asgi:application", host="127.0.0.1", port=port,
+                    app_dir=str(APP_DIR), log_level="error")
+
+
+def wait_until_up(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server on port {port} did not start.")
+
+
+def drive(port, path, clients, seconds):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        local = []
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - start)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests_per_second": round(len(latencies) / seconds, 1),
+        "p50_ms": round(quantiles[49] * 1000, 2),
+        "p99_ms": round(quantiles[98] * 1000, 2),
+        "errors": errors[0],
+    }
+
+
+def run(server, args):
+    port = free_port()
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(target=serve, args=(server, scratch_database(), port))
+    process.start()
+    try:
+        wait_until_up(port)
+        return drive(port, args.path, args.clients, args.seconds)
+    finally:
+        process.terminate()
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--path", default="/product?limit=50")
+    args = parser.parse_args()
+    servers = ["wsgi"]
+    try:
+        import uvicorn  # noqa: F401
+
+        servers.append("asgi")
+    except ImportError:
+        print("uvicorn is not installed; skipping the ASGI run.")
+    print_report({server: run(server, args) for server in servers})
+
+
+if __name__ == "__main__":
+    main()
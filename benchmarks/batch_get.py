@@ -0,0 +1,64 @@
+"""One POST /product/batch-get versus N GET /product/<id> calls.
+
+Generates a catalog (100k products by default) into a scratch database and
+times, through the Flask test client, fetching N random products one GET at
+a time and all at once with a batch lookup by id and by code. The lookup
+cache is turned off so that every key costs a query either way.
+
+    python -m benchmarks.batch_get [--products 100000] [--sizes 10,50,200] [--rounds 50]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.catalog import generate_catalog
+from benchmarks.common import load_app, print_report, scratch_database
+
+
+def timed(rounds, func):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--sizes", default="10,50,200")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    database = scratch_database()
+    generate_catalog(database, args.products, 500)
+    app = load_app(DATABASE=database, METRICS_SAMPLE_RATE=0, CACHE_MAX_SIZE=0)
+    client = app.test_client()
+    rng = random.Random(0)
+    report = {}
+    for size in map(int, args.sizes.split(",")):
+        ids = [rng.randint(1, args.products) for _ in range(size)]
+        codes = [client.get(f"/product/{key}").json["ProductCode"] for key in ids]
+
+        def one_by_one():
+            for key in ids:
+                client.get(f"/product/{key}")
+
+        individual = timed(args.rounds, one_by_one)
+        by_id = timed(args.rounds, lambda: client.post("/product/batch-get", json={"ids": ids}))
+        by_code = timed(
+            args.rounds, lambda: client.post("/product/batch-get", json={"codes": codes})
+        )
+        report[f"{size}_products"] = {
+            "individual_gets_ms": individual,
+            "batch_by_id_ms": by_id,
+            "batch_by_code_ms": by_code,
+            "speedup_by_id": round(individual / by_id, 1),
+        }
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Synthetic bakery catalogs for benchmarks.
+
+    python -m benchmarks.catalog 100000 [--categories 200] [--output path]
+"""
+import argparse
+import random
+import sqlite3
+
+from benchmarks.common import scratch_database
+
+
+ADJECTIVES = (
+    "Rustic", "Golden", "Crusty", "Soft", "Glazed", "Toasted", "Honey", "Spiced",
+    "Buttery", "Seeded", "Rich", "Light", "Country", "Classic", "Double", "Mini",
+)
+FLAVOURS = (
+    "Rye", "Sourdough", "Cinnamon", "Raisin", "Almond", "Chocolate", "Lemon",
+    "Blueberry", "Walnut", "Poppy", "Sesame", "Maple", "Pecan", "Vanilla",
+    "Apricot", "Cherry", "Hazelnut", "Pumpkin", "Oat", "Caramel",
+)
+ITEMS = (
+    "Bread", "Roll", "Bagel", "Croissant", "Muffin", "Scone", "Danish", "Loaf",
+    "Tart", "Cake", "Cookie", "Brioche", "Baguette", "Pretzel", "Bun", "Pie",
+)
+
+
+def generate_catalog(database, product_count, category_count=50, seed=0):
+    """Replaces the catalog of a database with synthetic products.
+
+    The schema triggers (table versions, full-text index, ...) stay active,
+    so every derived table is kept consistent with the new rows.
+
+    Args:
+        database (str): the path of the database to fill; use a scratch copy
+        product_count (int): the number of products to create
+        category_count (int): the number of categories to spread them over
+        seed (int): the random seed, so runs are reproducible
+    """
+    rng = random.Random(seed)
+    db = sqlite3.connect(database)
+    try:
+        with db:
+            db.execute("DELETE FROM PRODUCTS")
+            db.execute("DELETE FROM CATEGORIES")
+            db.executemany(
+                "INSERT INTO CATEGORIES (CategoryID, CategoryName) VALUES (?, ?)",
+                [(i, f"Category {i}") for i in range(1, category_count + 1)],
+            )
+            rows = (
+                (
+                    i,
+                    rng.randint(1, category_count),
+                    f"{rng.choice(FLAVOURS)[:3].lower()}{i:07d}",
+                    f"{rng.choice(ADJECTIVES)} {rng.choice(FLAVOURS)} "
+                    f"{rng.choice(ITEMS)} {i}",
+                    round(rng.uniform(0.5, 25.0), 2),
+                )
+                for i in range(1, product_count + 1)
+            )
+            db.executemany(
+                """
+                INSERT INTO PRODUCTS (ProductID, CategoryID, ProductCode, ProductName, Price)
+                    VALUES (?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+        db.execute("ANALYZE")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("products", type=int)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--output", help="Database to fill; a scratch copy by default.")
+    args = parser.parse_args()
+    database = args.output or scratch_database()
+    generate_catalog(database, args.products, args.categories)
+    print(database)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / "app"
+SOURCE_DATABASE = APP_DIR / "model" / "database" / "bakery.db"
+
+
+def scratch_database(name="bakery.db", source=SOURCE_DATABASE):
+    """Copies a database into a fresh temporary directory.
+
+    Args:
+        name (str): the file name of the copy
+        source (Path): the database to copy
+
+    Returns:
+        str: the path of the copy
+    """
+    directory = tempfile.mkdtemp(prefix="bakery-bench-")
+    path = os.path.join(directory, name)
+    shutil.copyfile(source, path)
+    return path
+
+
+def load_app(**config):
+    """Imports the Flask app configured with the given settings.
+
+    Settings are passed as BAKERY_* environment variables, so they are in
+    place before anything that runs at import time. Call this at most once
+    per process.
+
+    Args:
+        config: app config keys (without the BAKERY_ prefix) and values
+
+    Returns:
+        flask.Flask: the app
+    """
+    for key, value in config.items():
+        os.environ["BAKERY_" + key] = json.dumps(value)
+    if str(APP_DIR) not in sys.path:
+        sys.path.insert(0, str(APP_DIR))
+    from app import app
+
+    return app
+
+
+def print_report(report):
+    """Prints a benchmark report as indented JSON."""
+    print(json.dumps(report, indent=2))
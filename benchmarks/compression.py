@@ -0,0 +1,61 @@
+"""Full listings uncompressed, gzipped on every request and from the cache.
+
+Generates a catalog (100k products by default) into a scratch database and
+times GET /product through the Flask test client without Accept-Encoding,
+with gzip and a cold compressed listings cache (a write before every
+request), and with gzip served from the cache.
+
+    python -m benchmarks.compression [--products 100000] [--requests 20]
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.catalog import generate_catalog
+from benchmarks.common import load_app, print_report, scratch_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    database = scratch_database()
+    generate_catalog(database, args.products, 500)
+    app = load_app(DATABASE=database, METRICS_SAMPLE_RATE=0)
+    client = app.test_client()
+    gzip_headers = {"Accept-Encoding": "gzip"}
+
+    def write(i):
+        client.put("/product/1", json={
+            "product_name": f"Benchmark Product {i}", "product_code": "bench1",
+            "category_id": 1, "price": 1.0 + i / 100,
+        })
+
+    scenarios = {
+        "identity": (None, {}),
+        "gzip_cold": (write, gzip_headers),
+        "gzip_cached": (None, gzip_headers),
+    }
+    report = {}
+    for name, (before, headers) in scenarios.items():
+        client.get("/product", headers=headers)
+        timings = []
+        for i in range(args.requests):
+            if before is not None:
+                before(i)
+            start = time.perf_counter()
+            response = client.get("/product", headers=headers)
+            timings.append(time.perf_counter() - start)
+        report[name] = {
+            "p50_ms": round(statistics.median(timings) * 1000, 3),
+            "body_bytes": len(response.get_data()),
+        }
+    with app.app_context():
+        report["stats"] = client.get("/stats").get_json()["compression"]
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
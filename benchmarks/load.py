@@ -0,0 +1,397 @@
+"""Reproducible load test of every route of the bakery API.
+
+Generates a synthetic catalog into a scratch copy of bakery.db, then drives
+the read routes (listings, pages, filters, search and the by-id lookups) and
+the write routes (POST, PUT and DELETE of products and categories) with a
+fixed number of requests from concurrent clients. It does so through the
+Flask test client and through a real local server, each in a process of its
+own, and reports p50/p95/p99 latency, throughput and the peak RSS of the
+process serving the requests as JSON.
+
+    python -m benchmarks.load [--size 1k|100k|1m] [--transport client|server|both]
+        [--server wsgi|asgi] [--concurrency 8] [--requests 400]
+        [--output results.json] [--baseline baseline.json] [--tolerance 0.2]
+
+With --baseline, every route is compared with the same route of a stored
+result: a p95 latency or a throughput worse than the baseline by more than
+the tolerance is reported as a regression and the exit status is 1. A
+route with failed requests (an unexpected status, or no response) is
+listed under "failures" and also makes the exit status 1, so a broken route
+can't pass for a fast one. The
+catalog, the request paths and the write payloads only depend on --seed, so
+two runs of the same revision send the same requests.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import random
+import resource
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+
+from benchmarks.asgi import free_port, serve, wait_until_up
+from benchmarks.catalog import generate_catalog
+from benchmarks.common import load_app, print_report, scratch_database
+
+
+SIZES = {"1k": (1_000, 50), "100k": (100_000, 500), "1m": (1_000_000, 2_000)}
+FULL_LISTING_MAX = 10_000
+SEARCH_TERMS = ("rye", "chocolate bread", "glazed", "almond croissant", "sourdough loaf")
+
+
+def read_routes(products, categories):
+    """The read scenarios: (name, path factory) pairs.
+
+    The full GET /product and GET /product?stream=1 listings are only driven
+    for catalogs of at most FULL_LISTING_MAX products; larger catalogs are
+    read page by page, the way clients are expected to read them.
+    """
+    routes = [
+        ("list_categories", lambda rng: "/category"),
+        ("product_page", lambda rng: f"/product?limit=100&after={rng.randint(0, products - 100)}"),
+        (
+            "product_filter",
+            lambda rng: f"/product?category_id={rng.randint(1, categories)}"
+            f"&min_price=5&max_price=15&sort=price&limit=50",
+        ),
+        (
+            "product_search",
+            lambda rng: "/product/search?"
+            + urllib.parse.urlencode({"q": rng.choice(SEARCH_TERMS)}),
+        ),
+        ("product_by_id", lambda rng: f"/product/{rng.randint(1, products)}"),
+        ("category_by_id", lambda rng: f"/category/{rng.randint(1, categories)}"),
+        (
+            "category_products",
+            lambda rng: f"/category/{rng.randint(1, categories)}/products?limit=50",
+        ),
+    ]
+    if products <= FULL_LISTING_MAX:
+        routes.insert(1, ("list_products", lambda rng: "/product"))
+        routes.insert(2, ("stream_products", lambda rng: "/product?stream=1"))
+    return routes
+
+
+def write_routes(categories):
+    """The write scenarios, in the order they must run.
+
+    Request i of each scenario works on the rows created by request i of the
+    earlier ones, so every write succeeds and the catalog ends as it began.
+    """
+
+    def product(i, price):
+        return {
+            "product_name": f"Load Test Product {i}",
+            "product_code": f"load{i:07d}",
+            "category_id": i % categories + 1,
+            "price": price,
+        }
+
+    return [
+        ("create_product", lambda i, ids: ("POST", "/product", product(i, 1.5), 201)),
+        (
+            "update_product",
+            lambda i, ids: ("PUT", f"/product/{ids.get(i, 0)}", product(i, 2.5), 200),
+        ),
+        ("delete_product", lambda i, ids: ("DELETE", f"/product/{ids.get(i, 0)}", None, 200)),
+        (
+            "create_category",
+            lambda i, ids: ("POST", "/category", {"category_name": f"Load Test Category {i}"}, 201),
+        ),
+        ("delete_category", lambda i, ids: ("DELETE", f"/category/{ids.get(i, 0)}", None, 200)),
+    ]
+
+
+class TestClientTransport:
+    """Sends requests through the Flask test client, one client per thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        data = response.get_data()
+        return response.status_code, data
+
+
+class HTTPTransport:
+    """Sends requests over HTTP/1.1, one keep-alive connection per thread."""
+
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(
+                "127.0.0.1", self.port, timeout=60
+            )
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        try:
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            return 0, b""
+
+
+def summarize(latencies, errors, elapsed):
+    if len(latencies) < 2:
+        return {"requests": len(latencies), "errors": errors}
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(quantiles[49] * 1000, 3),
+        "p95_ms": round(quantiles[94] * 1000, 3),
+        "p99_ms": round(quantiles[98] * 1000, 3),
+    }
+
+
+def run_scenario(transport, concurrency, make_request, count):
+    """Sends count requests from concurrency threads and times each of them.
+
+    Args:
+        transport: a TestClientTransport or an HTTPTransport
+        concurrency (int): the number of client threads
+        make_request (callable): maps a request index to (method, path, body,
+            expected status)
+        count (int): the number of requests
+
+    Returns:
+        tuple: (summary, responses) where responses maps each request index
+            to its decoded JSON body
+    """
+    latencies = []
+    responses = {}
+    errors = [0]
+    lock = threading.Lock()
+    indexes = iter(range(count))
+
+    def client():
+        local = []
+        while True:
+            with lock:
+                index = next(indexes, None)
+            if index is None:
+                break
+            method, path, body, expected = make_request(index)
+            start = time.perf_counter()
+            status, data = transport.request(method, path, body)
+            seconds = time.perf_counter() - start
+            with lock:
+                if status != expected:
+                    errors[0] += 1
+                    continue
+                if method != "GET":
+                    responses[index] = json.loads(data)
+            local.append(seconds)
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - start), responses
+
+
+def drive(transport, args, products, categories):
+    """Runs every scenario once through a transport.
+
+    Returns:
+        dict: the summary of each scenario, keyed by scenario name
+    """
+    results = {}
+    for name, make_path in read_routes(products, categories):
+        rng = random.Random(f"{args.seed}-{name}")
+        paths = [make_path(rng) for _ in range(args.requests)]
+        results[name], _ = run_scenario(
+            transport,
+            args.concurrency,
+            lambda i, paths=paths: ("GET", paths[i], None, 200),
+            args.requests,
+        )
+    ids = {}
+    for name, make_request in write_routes(categories):
+        results[name], responses = run_scenario(
+            transport,
+            args.concurrency,
+            lambda i, make_request=make_request: make_request(i, ids),
+            args.requests,
+        )
+        if name.startswith("create_"):
+            key = "ProductID" if name == "create_product" else "CategoryID"
+            ids = {i: response[key] for i, response in responses.items()}
+    return results
+
+
+def peak_rss_mb(pid=None):
+    """Gets the peak resident set size of this process or of a child process."""
+    if pid is None:
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return None
+
+
+def run_test_client(database, args, products, categories, results):
+    app = load_app(DATABASE=database)
+    report = {"routes": drive(TestClientTransport(app), args, products, categories)}
+    report["peak_rss_mb"] = peak_rss_mb()
+    results.put(report)
+
+
+def run_in_process(context, database, args, products, categories):
+    results = context.Queue()
+    process = context.Process(
+        target=run_test_client, args=(database, args, products, categories, results)
+    )
+    process.start()
+    report = results.get()
+    process.join()
+    return report
+
+
+def run_server(context, database, args, products, categories):
+    port = free_port()
+    process = context.Process(target=serve, args=(args.server, database, port))
+    process.start()
+    try:
+        wait_until_up(port, timeout=60.0)
+        report = {"routes": drive(HTTPTransport(port), args, products, categories)}
+        report["peak_rss_mb"] = peak_rss_mb(process.pid)
+        return report
+    finally:
+        process.terminate()
+        process.join()
+
+
+def find_failures(results):
+    """Lists the routes of a run that had failed requests.
+
+    Returns:
+        list: "transport/route: errors of count requests failed" strings
+    """
+    failures = []
+    for transport, report in results.items():
+        for route, summary in report["routes"].items():
+            if summary["errors"]:
+                count = summary["errors"] + summary["requests"]
+                failures.append(
+                    f"{transport}/{route}: {summary['errors']} of {count} requests failed"
+                )
+    return failures
+
+
+def compare(results, baseline, tolerance):
+    """Compares the routes of a run with those of a baseline run.
+
+    Returns:
+        tuple: (comparison, regressions) where comparison maps
+            "transport/route" to the p95 and throughput ratios of the run over
+            the baseline, and regressions lists the ratios beyond the tolerance
+    """
+    comparison = {}
+    regressions = []
+    for transport, report in results.items():
+        base_report = baseline.get("results", {}).get(transport)
+        if base_report is None:
+            continue
+        for route, summary in report["routes"].items():
+            base = base_report["routes"].get(route)
+            if not base or "p95_ms" not in base or "p95_ms" not in summary:
+                continue
+            key = f"{transport}/{route}"
+            p95 = summary["p95_ms"] / base["p95_ms"]
+            throughput = summary["requests_per_second"] / base["requests_per_second"]
+            comparison[key] = {"p95_ratio": round(p95, 3), "throughput_ratio": round(throughput, 3)}
+            if p95 > 1 + tolerance:
+                regressions.append(f"{key}: p95 {base['p95_ms']} -> {summary['p95_ms']} ms")
+            if throughput < 1 - tolerance:
+                regressions.append(
+                    f"{key}: throughput {base['requests_per_second']} -> "
+                    f"{summary['requests_per_second']} requests/s"
+                )
+    return comparison, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=SIZES, default="1k")
+    parser.add_argument("--transport", choices=("client", "server", "both"), default="both")
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results to this file.")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    products, categories = SIZES[args.size]
+    context = multiprocessing.get_context("spawn")
+    report = {
+        "config": {
+            "size": args.size,
+            "products": products,
+            "categories": categories,
+            "transport": args.transport,
+            "server": args.server,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "seed": args.seed,
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+        },
+        "results": {},
+    }
+    for transport in ("client", "server"):
+        if args.transport not in (transport, "both"):
+            continue
+        # Every transport starts from the same freshly generated catalog.
+        database = scratch_database()
+        generate_catalog(database, products, categories, seed=args.seed)
+        run = run_in_process if transport == "client" else run_server
+        report["results"][transport] = run(context, database, args, products, categories)
+
+    failures = find_failures(report["results"])
+    if failures:
+        report["failures"] = failures
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        report["comparison"], regressions = compare(report["results"], baseline, args.tolerance)
+        report["regressions"] = regressions
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    print_report(report)
+    if regressions or failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
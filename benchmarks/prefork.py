@@ -0,0 +1,63 @@
+"""Throughput of the preforking launcher from 1 to N worker processes.
+
+Generates a catalog into a scratch database, then for each worker count
+starts app/prefork.py on a local port and drives a read-heavy path with
+concurrent HTTP clients. Scaling is bound by the cores of the machine: past
+one worker per core, more workers only add context switches.
+
+    python -m benchmarks.prefork [--max-workers N] [--clients 32] [--seconds 5]
+        [--products 10000] [--path /product?limit=50]
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+
+from benchmarks.asgi import drive, free_port, wait_until_up
+from benchmarks.catalog import generate_catalog
+from benchmarks.common import APP_DIR, print_report, scratch_database
+
+
+def run(database, workers, args):
+    port = free_port()
+    env = dict(os.environ, BAKERY_DATABASE=json.dumps(database), BAKERY_METRICS_SAMPLE_RATE="0")
+    process = subprocess.Popen(
+        [sys.executable, str(APP_DIR / "prefork.py"), "--workers", str(workers),
+         "--port", str(port), "--max-requests", "0"],
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(port, timeout=30.0)
+        drive(port, args.path, args.clients, 1.0)
+        return drive(port, args.path, args.clients, args.seconds)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--path", default="/product?limit=50")
+    args = parser.parse_args()
+
+    database = scratch_database()
+    generate_catalog(database, args.products, 100)
+    report = {"cpu_count": os.cpu_count(), "path": args.path}
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        result = run(database, workers, args)
+        baseline = baseline or result["requests_per_second"]
+        result["speedup"] = round(result["requests_per_second"] / baseline, 2)
+        report[f"{workers}_workers"] = result
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Price history range and summary queries over millions of history rows.
+
+Generates a catalog into a scratch database and a year of synthetic price
+changes (2M by default, a quarter of them on one hot product), then times
+through the Flask test client a page of raw changes, a daily summary over
+the year (read from the hourly rollup), a 5-minute summary over a day (read
+from the raw changes), and a price update, which writes the history rows.
+
+    python -m benchmarks.price_history [--products 1000] [--changes 2000000] [--rounds 50]
+"""
+import argparse
+import random
+import sqlite3
+import statistics
+import time
+
+from benchmarks.catalog import generate_catalog
+from benchmarks.common import load_app, print_report, scratch_database
+
+
+YEAR = 365 * 86400
+
+
+def generate_history(database, product_count, change_count, end, seed=0):
+    """Appends change_count price changes over the year before `end`, with
+    their hourly rollup; a quarter of the changes go to product 1."""
+    rng = random.Random(seed)
+    start_ms = (end - YEAR) * 1000
+    rows = {}
+    for i in range(change_count):
+        product_id = 1 if i % 4 == 0 else rng.randint(2, product_count)
+        changed_at = start_ms + rng.randrange(YEAR * 1000)
+        rows[product_id, changed_at] = round(rng.uniform(0.5, 20.0), 2)
+    hourly = {}
+    for (product_id, changed_at), price in sorted(rows.items()):
+        key = (product_id, changed_at // 3600000)
+        if key in hourly:
+            _, low, high, _, changes = hourly[key]
+            hourly[key] = [hourly[key][0], min(low, price), max(high, price), price, changes + 1]
+        else:
+            hourly[key] = [price, price, price, price, 1]
+    db = sqlite3.connect(database)
+    with db:
+        db.executemany(
+            "INSERT OR IGNORE INTO PRICE_HISTORY VALUES (?, ?, ?)",
+            ((*key, price) for key, price in rows.items()),
+        )
+        db.executemany(
+            "INSERT OR IGNORE INTO PRICE_HISTORY_HOURLY VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((*key, *values) for key, values in hourly.items()),
+        )
+    db.close()
+    return len(rows)
+
+
+def timed(rounds, func):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        response = func()
+        timings.append(time.perf_counter() - start)
+    assert response.status_code == 200, response.get_json()
+    return round(statistics.median(timings) * 1000, 3), response.get_json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--changes", type=int, default=2_000_000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    database = scratch_database()
+    generate_catalog(database, args.products, 50)
+    app = load_app(DATABASE=database, METRICS_SAMPLE_RATE=0, CACHE_MAX_SIZE=0)
+    client = app.test_client()
+    client.get("/product/1")
+    end = int(time.time())
+    rows = generate_history(database, args.products, args.changes, end)
+    day = end - 86400
+
+    report = {"history_rows": rows}
+    for name, path in {
+        "page_of_100": f"/product/1/prices?from={day}",
+        "daily_summary_year": f"/product/1/prices/summary?from={end - YEAR}&interval=86400",
+        "5min_summary_day": f"/product/1/prices/summary?from={day}&interval=300",
+    }.items():
+        # A new query string each round, so no conditional request is answered by ETag.
+        milliseconds, body = timed(args.rounds, lambda: client.get(f"{path}&t={time.time()}"))
+        size = len(body.get("buckets", body.get("prices")))
+        report[name] = {"p50_ms": milliseconds, "rows": size}
+
+    counter = iter(range(10**9))
+    milliseconds, _ = timed(args.rounds, lambda: client.put("/product/2", json={
+        "product_name": "Benchmark Product", "product_code": "bench2",
+        "category_id": 1, "price": 1.0 + next(counter) / 100,
+    }))
+    report["price_update"] = {"p50_ms": milliseconds}
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Full-text product search against a LIKE '%q%' scan.
+
+Fills a scratch database with a synthetic catalog, then times
+ProductsTable.search() against two LIKE queries for a set of terms: "like"
+returns the first 20 hits, unranked, and "like_all" collects every hit, the
+least a LIKE-based search must do before it can rank them.
+
+    python -m benchmarks.search [--products 100000] [--repeat 20]
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.catalog import generate_catalog
+from benchmarks.common import load_app, print_report, scratch_database
+
+
+TERMS = ("cinn", "rye bread", "golden alm", "pecan pie", "cho", "maple bun 77")
+LIKE_QUERY = """
+    SELECT * FROM PRODUCTS
+    WHERE ProductName LIKE ? OR ProductCode LIKE ?
+"""
+
+
+def timed(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return round(statistics.median(durations) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    database = scratch_database()
+    app = load_app(DATABASE=database)
+    generate_catalog(database, args.products)
+
+    from model.database import get_db
+    from model.products_table import ProductsTable
+
+    report = {"products": args.products, "median_ms": {}}
+    with app.app_context():
+        db = get_db()
+        for term in TERMS:
+            pattern = f"%{term}%"
+            report["median_ms"][term] = {
+                "fts5": timed(lambda: ProductsTable.search(term), args.repeat),
+                "like": timed(
+                    lambda: db.execute(LIKE_QUERY + " LIMIT 20", [pattern, pattern]).fetchall(),
+                    args.repeat,
+                ),
+                "like_all": timed(
+                    lambda: db.execute(LIKE_QUERY, [pattern, pattern]).fetchall(),
+                    args.repeat,
+                ),
+            }
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
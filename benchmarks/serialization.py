@@ -0,0 +1,95 @@
+"""JSON serialization of the full catalog listings.
+
+Generates a catalog (100k products by default) into a scratch database and
+times GET /product, with a warm and with a cold lookup cache, and GET
+/product?stream=1 through the Flask test client. Each route runs with the
+orjson encoder, with the standard library fallback of the same provider
+and, for the non-streamed listing, with Flask's DefaultJSONProvider. A
+second, traced pass reports the peak Python memory of each response.
+
+    python -m benchmarks.serialization [--products 100000] [--repeat 5]
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from benchmarks.catalog import generate_catalog
+from benchmarks.common import load_app, print_report, scratch_database
+
+
+def time_request(client, path, clear_cache, repeat):
+    from model.cache import products_cache
+
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        if clear_cache:
+            products_cache.clear()
+        else:
+            client.get(path)
+        start = time.perf_counter()
+        response = client.get(path)
+        size = len(response.get_data())
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings) * 1000, 1), size
+
+
+def peak_memory(client, path, clear_cache):
+    from model.cache import products_cache
+
+    if clear_cache:
+        products_cache.clear()
+    else:
+        client.get(path)
+    tracemalloc.start()
+    response = client.get(path, buffered=False)
+    for _ in response.response:
+        pass
+    response.close()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return round(peak / 1024 / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    database = scratch_database()
+    generate_catalog(database, args.products, category_count=500)
+    app = load_app(DATABASE=database)
+    import json_provider
+    from flask.json.provider import DefaultJSONProvider
+
+    orjson = json_provider.orjson
+    providers = {"flask_default": DefaultJSONProvider(app), "stdlib": app.json, "orjson": app.json}
+    routes = {
+        "product_listing_cached": ("/product", False),
+        "product_listing_uncached": ("/product", True),
+        "product_listing_stream": ("/product?stream=1", False),
+    }
+    client = app.test_client()
+    report = {}
+    for name, provider in providers.items():
+        if name == "orjson" and orjson is None:
+            print("orjson is not installed; skipping its run.")
+            continue
+        app.json = provider
+        json_provider.orjson = orjson if name == "orjson" else None
+        for route, (path, clear_cache) in routes.items():
+            if name == "flask_default" and "stream" in path:
+                continue
+            milliseconds, size = time_request(client, path, clear_cache, args.repeat)
+            report.setdefault(route, {})[name] = {
+                "milliseconds": milliseconds,
+                "bytes": size,
+                "peak_memory_mb": peak_memory(client, path, clear_cache),
+            }
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Read routes served from SQLite versus from the in-memory catalog snapshot.
+
+Generates a catalog (100k products by default) into a scratch database and
+times the GET routes through the Flask test client, with CATALOG_SNAPSHOT
+off and on, and the time to build a snapshot after a write.
+
+    python -m benchmarks.snapshot [--products 100000] [--requests 2000]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.catalog import generate_catalog
+from benchmarks.common import load_app, print_report, scratch_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--categories", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    database = scratch_database()
+    generate_catalog(database, args.products, args.categories)
+    app = load_app(DATABASE=database, METRICS_SAMPLE_RATE=0)
+    from model.products_table import ProductsTable
+    from model.snapshot import get_snapshot_manager
+
+    rng = random.Random(0)
+    routes = {
+        "product_by_id": lambda: f"/product/{rng.randint(1, args.products)}",
+        "category_by_id": lambda: f"/category/{rng.randint(1, args.categories)}",
+        "product_page": lambda: f"/product?limit=100&after={rng.randint(0, args.products)}",
+        "category_products": lambda: f"/category/{rng.randint(1, args.categories)}/products?limit=50",
+        "product_listing": lambda: "/product",
+    }
+    client = app.test_client()
+    report = {}
+    for mode in ("sqlite", "snapshot"):
+        app.config["CATALOG_SNAPSHOT"] = mode == "snapshot"
+        for name, make_path in routes.items():
+            count = args.requests if name != "product_listing" else 20
+            client.get(make_path())
+            timings = []
+            for _ in range(count):
+                path = make_path()
+                start = time.perf_counter()
+                client.get(path)
+                timings.append(time.perf_counter() - start)
+            report.setdefault(name, {})[mode] = {
+                "p50_ms": round(statistics.median(timings) * 1000, 3),
+                "requests_per_second": round(count / sum(timings), 1),
+            }
+
+    with app.app_context():
+        manager = get_snapshot_manager()
+        ProductsTable.invalidate_cache()
+        start = time.perf_counter()
+        manager.get()
+        report["snapshot_build_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        report["snapshot"] = manager.stats()
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
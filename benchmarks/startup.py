@@ -0,0 +1,125 @@
+"""Import time and first-request latency of a new worker, cold and warmed up.
+
+Generates a catalog (100k products by default) into a scratch database,
+then for each scenario starts a fresh Python process that imports the app
+and times, through the Flask test client, the first request to each of a
+few read paths and their steady-state latency. The database file is evicted
+from the OS page cache before each run (posix_fadvise), as after a deploy.
+
+Scenarios:
+    cold: WARM_UP off.
+    warm_up: WARM_UP on; its time is part of the import.
+    preloaded: WARM_UP on, with the libraries of prefork.PRELOAD_MODULES
+        imported beforehand, as a worker forked by app/prefork.py finds them.
+
+    python -m benchmarks.startup [--products 100000] [--rounds 50]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.catalog import generate_catalog
+from benchmarks.common import APP_DIR, load_app, print_report, scratch_database
+
+
+PATHS = (
+    "/product/1",
+    "/product?limit=50",
+    "/product?sort=price&limit=50",
+    "/product/search?q=cinn",
+    "/category/1",
+    "/category/stats",
+)
+SCENARIOS = {
+    "cold": (False, False),
+    "warm_up": (True, False),
+    "preloaded": (True, True),
+}
+
+
+def evict(database):
+    """Drops the database files from the OS page cache."""
+    for path in (database, database + "-wal", database + "-shm"):
+        if not os.path.exists(path):
+            continue
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def probe(database, warm_up, preload, rounds):
+    """Runs in the child process: imports the app and times the requests."""
+    report = {}
+    if preload:
+        sys.path.insert(0, str(APP_DIR))
+        from prefork import PRELOAD_MODULES, preload as preload_modules
+
+        start = time.perf_counter()
+        preload_modules(PRELOAD_MODULES)
+        report["preload_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    start = time.perf_counter()
+    app = load_app(DATABASE=database, WARM_UP=warm_up, METRICS_SAMPLE_RATE=0)
+    report["import_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    if "warm_up" in app.extensions:
+        report["warm_up_ms"] = round(app.extensions["warm_up"]["seconds"] * 1000, 3)
+        report["import_without_warm_up_ms"] = round(report["import_ms"] - report["warm_up_ms"], 3)
+    client = app.test_client()
+    first = []
+    for path in PATHS:
+        start = time.perf_counter()
+        client.get(path)
+        first.append(time.perf_counter() - start)
+    steady = []
+    for _ in range(rounds):
+        for path in PATHS:
+            start = time.perf_counter()
+            client.get(path)
+            steady.append(time.perf_counter() - start)
+    report["first_request_ms"] = round(first[0] * 1000, 3)
+    report["first_requests_total_ms"] = round(sum(first) * 1000, 3)
+    report["steady_request_p50_ms"] = round(statistics.median(steady) * 1000, 3)
+    report["first_by_path_ms"] = {path: round(t * 1000, 3) for path, t in zip(PATHS, first)}
+    print(json.dumps(report))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.probe:
+        probe(**json.loads(args.probe))
+        return
+
+    database = scratch_database()
+    generate_catalog(database, args.products, 500)
+    # Apply the migrations once, so that no scenario pays for them.
+    subprocess.run(
+        [sys.executable, "-c", "import app"],
+        cwd=APP_DIR,
+        env=dict(os.environ, BAKERY_DATABASE=json.dumps(database)),
+        check=True,
+    )
+    report = {}
+    for name, (warm_up, preload) in SCENARIOS.items():
+        evict(database)
+        options = {"database": database, "warm_up": warm_up, "preload": preload, "rounds": args.rounds}
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup", "--probe", json.dumps(options)],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        report[name] = json.loads(output.splitlines()[-1])
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Mixed read/write throughput before and after the WAL/PRAGMA tuning.
+
+Reader and writer processes hammer the same scratch database through the
+Flask test client for a fixed time. The "baseline" run uses the rollback
+journal, SQLite's default PRAGMAs and read-write connections for GETs; the
+"tuned" run uses the defaults of model.database.
+
+    python -m benchmarks.wal [--readers 6] [--writers 2] [--seconds 5]
+"""
+import argparse
+import multiprocessing
+import random
+import time
+
+from benchmarks.common import load_app, print_report, scratch_database
+
+
+CONFIGS = {
+    "baseline": {
+        "DATABASE_JOURNAL_MODE": "DELETE",
+        "DATABASE_PRAGMAS": {
+            "synchronous": "FULL",
+            "cache_size": -2000,
+            "mmap_size": 0,
+            "temp_store": "DEFAULT",
+            "busy_timeout": 5000,
+        },
+        "DATABASE_READ_ONLY_GETS": False,
+    },
+    "tuned": {},
+}
+
+
+def worker(role, config, seconds, results):
+    client = load_app(**config).test_client()
+    product_ids = [p["ProductID"] for p in client.get("/product").json["products"]]
+    done = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        product_id = random.choice(product_ids)
+        if role == "reader":
+            response = client.get(f"/product/{product_id}")
+        else:
+            product = client.get(f"/product/{product_id}").json
+            response = client.put(
+                f"/product/{product_id}",
+                json={
+                    "product_name": product["ProductName"],
+                    "product_code": product["ProductCode"],
+                    "category_id": product["CategoryID"],
+                    "price": round(random.uniform(1, 10), 2),
+                },
+            )
+        if response.status_code < 300:
+            done += 1
+        else:
+            errors += 1
+    results.put((role, done, errors))
+
+
+def run(name, readers, writers, seconds):
+    config = {"DATABASE": scratch_database(), **CONFIGS[name]}
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    roles = ["reader"] * readers + ["writer"] * writers
+    processes = [
+        context.Process(target=worker, args=(role, config, seconds, results))
+        for role in roles
+    ]
+    for process in processes:
+        process.start()
+    totals = {"reader": [0, 0], "writer": [0, 0]}
+    for _ in processes:
+        role, done, errors = results.get()
+        totals[role][0] += done
+        totals[role][1] += errors
+    for process in processes:
+        process.join()
+    return {
+        "reads_per_second": round(totals["reader"][0] / seconds, 1),
+        "writes_per_second": round(totals["writer"][0] / seconds, 1),
+        "read_errors": totals["reader"][1],
+        "write_errors": totals["writer"][1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=6)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+    print_report(
+        {
+            name: run(name, args.readers, args.writers, args.seconds)
+            for name in CONFIGS
+        }
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Write throughput of the CategoriesTable/ProductsTable mutations.
+
+Runs each mutation many times against a scratch database, one app context
+per call like one request per call, and reports writes per second and the
+statements each call sends to SQLite (COMMITs issued through
+Connection.commit() are not counted). With --threads, product inserts are
+also run from that many threads at once, committing directly and then
+through the group commit writer.
+
+    python -m benchmarks.writes [--count 2000] [--threads 16] [--synchronous FULL]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import load_app, print_report, scratch_database
+
+
+class StatementCounter:
+    """A query observer that only counts statements."""
+
+    def __init__(self):
+        self.count = 0
+
+    def sampled(self):
+        return True
+
+    def observe(self, db, sql, parameters, seconds):
+        self.count += 1
+
+
+def measure(app, counter, calls):
+    counter.count = 0
+    start = time.perf_counter()
+    for call in calls:
+        with app.app_context():
+            call()
+    elapsed = time.perf_counter() - start
+    return {
+        "writes_per_second": round(len(calls) / elapsed, 1),
+        "statements_per_write": round(counter.count / len(calls), 2),
+    }
+
+
+def measure_concurrent(app, threads, calls):
+    def run(call):
+        with app.app_context():
+            call()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(run, calls))
+    elapsed = time.perf_counter() - start
+    return {"writes_per_second": round(len(calls) / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--synchronous", default="NORMAL")
+    args = parser.parse_args()
+
+    app = load_app(
+        DATABASE=scratch_database(),
+        DATABASE_PRAGMAS={"synchronous": args.synchronous},
+        DATABASE_POOL_SIZE=max(args.threads, 5),
+    )
+    from model.categories_table import CategoriesTable
+    from model.database import set_query_observer
+    from model.products_table import ProductsTable
+    from model.writer import get_writer
+
+    counter = StatementCounter()
+    set_query_observer(counter)
+    count = args.count
+
+    def product(i, price=1.5):
+        return {
+            "product_name": f"Bench Product {i}",
+            "product_code": f"bench{i}",
+            "category_id": 1,
+            "price": price,
+        }
+
+    with app.app_context():
+        first_id = ProductsTable.insert(product(-1))[2]["ProductID"] + 1
+    report = {
+        "product_insert": measure(
+            app, counter, [lambda i=i: ProductsTable.insert(product(i)) for i in range(count)]
+        ),
+        "product_update": measure(
+            app,
+            counter,
+            [
+                lambda i=i: ProductsTable.update(first_id + i, product(i, 2.5))
+                for i in range(count)
+            ],
+        ),
+        "product_delete": measure(
+            app, counter, [lambda i=i: ProductsTable.delete(first_id + i) for i in range(count)]
+        ),
+        "category_insert": measure(
+            app,
+            counter,
+            [
+                lambda i=i: CategoriesTable.insert({"category_name": f"Bench Category {i}"})
+                for i in range(count)
+            ],
+        ),
+    }
+    with app.app_context():
+        category_ids = [
+            category["CategoryID"]
+            for category in CategoriesTable.get()
+            if category["CategoryName"].startswith("Bench Category")
+        ]
+    report["category_delete"] = measure(
+        app, counter, [lambda i=i: CategoriesTable.delete(i) for i in category_ids]
+    )
+    if args.threads:
+        set_query_observer(None)
+        for mode, offset in (("direct", count), ("group_commit", 2 * count)):
+            app.config["DATABASE_GROUP_COMMIT"] = mode == "group_commit"
+            report[f"concurrent_insert_{mode}"] = measure_concurrent(
+                app,
+                args.threads,
+                [lambda i=i: ProductsTable.insert(product(offset + i)) for i in range(count)],
+            )
+        with app.app_context():
+            report["concurrent_insert_group_commit"].update(get_writer().stats())
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()